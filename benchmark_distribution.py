@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Benchmark distribution formats for the serverless entrypoint.
+
+Builds a synthetic distribution (many small source files plus a few larger
+vendored blobs), packs it as every archive format the entrypoint can read,
+and times extract_distribution_stream() on each one:
+
+    tar.gz      single-member gzip (what pyflyte register produces)
+    tar.bgzf    block-parallel multi-member gzip, inflated on a thread pool
+    tar.zst     zstd (needs 'zstandard')
+    tar.pzstd   size-prefixed zstd frames, decompressed in parallel
+    tar.lz4     lz4 frame (needs 'lz4')
+    tar         uncompressed
+
+Wall time and process CPU time are reported per format, so the cost of
+single-threaded zlib is visible next to the parallel formats. Each run is
+repeated with tarfile's extractall ('extract' column 0) and with the
+parallel extract_tar_stream() engine.
+
+The uncompressed tar is then extracted from a local file three ways:
+tarfile.open(...).extractall, the extract_tar_stream() engine, and
+extract_indexed_tar() (mmap index + os.copy_file_range).
+
+To use:
+    python benchmark_distribution.py --files 10000 --avg-kb 16 --blob-mb 200
+
+For a ~1 GiB archive, comparing local extraction only:
+    python benchmark_distribution.py --indexed-only --files 20000 --avg-kb 16 --blob-mb 700
+
+Formats whose compressor is not installed are skipped.
+"""
+
+import argparse
+import io
+import os
+import random
+import shutil
+import struct
+import sys
+import tarfile
+import tempfile
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from entrypoint_serverless import extract_distribution_stream, extract_indexed_tar, extract_tar_stream  # noqa: E402
+
+
+def log(msg):
+    print(f"[BENCH] {msg}")
+
+
+def make_tree(root: str, files: int, avg_kb: int, blob_mb: int, seed: int = 0):
+    """Write a synthetic distribution: compressible sources plus random blobs."""
+    rng = random.Random(seed)
+    words = [f"token_{i}" for i in range(2000)]
+    for i in range(files):
+        package = os.path.join(root, "project", f"pkg_{i % 200}")
+        os.makedirs(package, exist_ok=True)
+        size = max(64, int(rng.expovariate(1 / (avg_kb * 1024))))
+        text = " ".join(rng.choice(words) for _ in range(size // 8))
+        with open(os.path.join(package, f"module_{i}.py"), "w") as f:
+            f.write(text[:size])
+    vendor = os.path.join(root, "vendor")
+    os.makedirs(vendor, exist_ok=True)
+    remaining = blob_mb << 20
+    index = 0
+    while remaining > 0:
+        size = min(remaining, 16 << 20)
+        with open(os.path.join(vendor, f"blob_{index}.bin"), "wb") as f:
+            # Half random, half zeros: roughly what wheels compress to
+            f.write(os.urandom(size // 2) + bytes(size - size // 2))
+        remaining -= size
+        index += 1
+
+
+def make_tar(root: str, path: str):
+    with tarfile.open(path, mode="w") as tar:
+        tar.add(root, arcname=".")
+
+
+def bgzf_compress(data: bytes, block_size: int = 65280) -> bytes:
+    """Gzip members of `block_size` input bytes with a BGZF 'BC' size field."""
+    out = []
+    for start in range(0, len(data), block_size):
+        block = data[start:start + block_size]
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        deflated = compressor.compress(block) + compressor.flush()
+        total = 12 + 6 + len(deflated) + 8
+        header = b"\x1f\x8b\x08\x04" + b"\x00" * 4 + b"\x00\xff" + struct.pack("<H", 6)
+        extra = b"BC" + struct.pack("<HH", 2, total - 1)
+        trailer = struct.pack("<II", zlib.crc32(block) & 0xFFFFFFFF, len(block) & 0xFFFFFFFF)
+        out.append(header + extra + deflated + trailer)
+    return b"".join(out)
+
+
+def pzstd_compress(data: bytes, block_size: int = 4 << 20) -> bytes:
+    """zstd frames of `block_size` input bytes, each behind a size frame."""
+    import zstandard
+
+    compressor = zstandard.ZstdCompressor(level=3)
+    out = []
+    for start in range(0, len(data), block_size):
+        frame = compressor.compress(data[start:start + block_size])
+        out.append(struct.pack("<III", 0x184D2A50, 4, len(frame)) + frame)
+    return b"".join(out)
+
+
+def build_formats(tar_bytes: bytes) -> dict:
+    import gzip
+
+    formats = {
+        "tar": tar_bytes,
+        "tar.gz": gzip.compress(tar_bytes, compresslevel=6),
+        "tar.bgzf": bgzf_compress(tar_bytes),
+    }
+    try:
+        import zstandard
+
+        formats["tar.zst"] = zstandard.ZstdCompressor(level=3).compress(tar_bytes)
+        formats["tar.pzstd"] = pzstd_compress(tar_bytes)
+    except ImportError:
+        log("zstandard not installed: skipping tar.zst / tar.pzstd")
+    try:
+        import lz4.frame
+
+        formats["tar.lz4"] = lz4.frame.compress(tar_bytes)
+    except ImportError:
+        log("lz4 not installed: skipping tar.lz4")
+    return formats
+
+
+def time_extract(archive: bytes, work_dir: str, threads: int, repeat: int, extract_workers: int):
+    os.environ["FLYTE_DECOMPRESS_THREADS"] = str(threads)
+    os.environ["FLYTE_EXTRACT_WORKERS"] = str(extract_workers)
+    walls, cpus = [], []
+    for _ in range(repeat):
+        dest = tempfile.mkdtemp(dir=work_dir)
+        wall, cpu = time.perf_counter(), time.process_time()
+        fmt = extract_distribution_stream(io.BytesIO(archive), dest)
+        walls.append(time.perf_counter() - wall)
+        cpus.append(time.process_time() - cpu)
+        shutil.rmtree(dest)
+    return fmt, min(walls), min(cpus)
+
+
+def tarfile_extractall(path: str, dest: str):
+    with tarfile.open(path) as tar:
+        if hasattr(tarfile, "data_filter"):
+            tar.extractall(dest, filter="data")
+        else:
+            tar.extractall(dest)
+
+
+def time_local_tar(path: str, work_dir: str, repeat: int, extract_workers: int) -> dict:
+    """Extract an uncompressed tar file with tarfile and with both engines."""
+    def stream(dest):
+        with open(path, "rb") as f:
+            extract_tar_stream(f, dest, workers=extract_workers)
+
+    methods = {
+        "tarfile": lambda dest: tarfile_extractall(path, dest),
+        "stream": stream,
+        "indexed": lambda dest: extract_indexed_tar(path, dest, workers=extract_workers),
+    }
+    results = {}
+    for name, extract in methods.items():
+        walls, cpus = [], []
+        for _ in range(repeat):
+            dest = tempfile.mkdtemp(dir=work_dir)
+            wall, cpu = time.perf_counter(), time.process_time()
+            extract(dest)
+            walls.append(time.perf_counter() - wall)
+            cpus.append(time.process_time() - cpu)
+            shutil.rmtree(dest)
+        results[name] = (min(walls), min(cpus))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=10000, help="number of source files")
+    parser.add_argument("--avg-kb", type=int, default=16, help="average source file size")
+    parser.add_argument("--blob-mb", type=int, default=200, help="size of vendored binary blobs")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1, help="decompression threads")
+    parser.add_argument("--extract-workers", type=int, default=min(16, 2 * (os.cpu_count() or 1)),
+                        help="file writer threads of the extraction engine")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per format (best is reported)")
+    parser.add_argument("--work-dir", default=None, help="where to build and extract (defaults to a temp dir)")
+    parser.add_argument("--indexed-only", action="store_true",
+                        help="only compare local extraction of the uncompressed tar")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="flyte_bench_", dir=args.work_dir)
+    try:
+        log(f"Building {args.files} files (~{args.avg_kb} KiB) + {args.blob_mb} MiB blobs in {work_dir}")
+        tree = os.path.join(work_dir, "tree")
+        make_tree(tree, args.files, args.avg_kb, args.blob_mb)
+        tar_path = os.path.join(work_dir, "distribution.tar")
+        make_tar(tree, tar_path)
+        shutil.rmtree(tree)
+        tar_mib = os.path.getsize(tar_path) / (1 << 20)
+        log(f"Uncompressed tar: {tar_mib:.1f} MiB")
+
+        if not args.indexed_only:
+            with open(tar_path, "rb") as f:
+                formats = build_formats(f.read())
+            log("")
+            log(f"{'format':<10} {'size MiB':>9} {'threads':>7} {'extract':>7} {'wall s':>8} {'cpu s':>8} {'MiB/s':>8}")
+            for name, archive in formats.items():
+                for threads in sorted({1, args.threads}):
+                    for extract_workers in (0, args.extract_workers):
+                        fmt, wall, cpu = time_extract(archive, work_dir, threads, args.repeat, extract_workers)
+                        log(
+                            f"{name:<10} {len(archive) / (1 << 20):9.1f} {threads:7d} {extract_workers:7d} "
+                            f"{wall:8.3f} {cpu:8.3f} {tar_mib / wall:8.1f}  ({fmt})"
+                        )
+
+        log("")
+        log(f"Local uncompressed tar ({args.extract_workers} extract workers)")
+        log(f"{'method':<10} {'wall s':>8} {'cpu s':>8} {'MiB/s':>8}")
+        for name, (wall, cpu) in time_local_tar(tar_path, work_dir, args.repeat, args.extract_workers).items():
+            log(f"{name:<10} {wall:8.3f} {cpu:8.3f} {tar_mib / wall:8.1f}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,21 +10,127 @@ Key features:
 - Uses /tmp as the working directory (accessible in serverless)
 - Configures AWS credentials from Databricks service credentials
 - Works with flytekitplugins-spark which has native serverless support
+- Records a per-phase startup profile (wall-clock, CPU time, peak RSS)
+- Optional warm server mode that runs many tasks on one SparkSession
 
 Credential Provider Configuration (in order of precedence):
     1. Command-line argument: --flyte-credential-provider=<name>
     2. Environment variable: DATABRICKS_SERVICE_CREDENTIAL_PROVIDER
     3. Default fallback (if configured in DEFAULT_CREDENTIAL_PROVIDER below)
 
+Entrypoint options can be passed either as --flyte-<option>=<value> command
+arguments or as the matching environment variable (see ENTRYPOINT_OPTIONS).
+
 Optional Environment Variables:
     AWS_DEFAULT_REGION: AWS region (defaults to 'us-east-1')
     FLYTE_INTERNAL_WORK_DIR: Working directory (defaults to '/tmp/flyte')
+    FLYTE_AWS_CREDENTIAL_MODE: How refreshed AWS credentials are exposed:
+        'process' (default, credential_process profile) or 'env' (env vars)
+    FLYTE_AWS_CREDENTIAL_CACHE: Reuse AWS credentials cached (0600) in the work
+        dir until shortly before they expire (defaults to 'false')
+    FLYTE_AWS_VERIFY_CREDENTIALS: STS identity check: 'background' (default),
+        'sync' or 'off'
+    FLYTE_PREIMPORT: Modules to import in the background during startup,
+        before the task import (comma-separated, or 'true' for
+        DEFAULT_PREIMPORT_MODULES; disabled by default)
+    FLYTE_IMPORT_REPORT: Log and profile import time per package (defaults
+        to 'false')
+    FLYTE_WARM_SERVER: 'unix:<socket>' or 'spool:<dir>'. Tasks are handed to a
+        warm server at that address when one is live; run the entrypoint
+        with the 'flyte-serve' command to start one
+    FLYTE_WARM_SERVER_IDLE_S: Idle time before a warm server exits (600)
+    FLYTE_BATCH_MANIFEST: JSON manifest of several task invocations to run in
+        this process (several Flyte commands on the command line also work)
+    FLYTE_BATCH_CONCURRENCY: Batch tasks run at once (defaults to 1; above 1,
+        tasks share the environment and may not set their own "env")
+    FLYTE_MAP_TASK_SIZE: Number of map task subtasks (defaults to the length
+        of the mapped list inputs)
+    FLYTE_MAP_CONCURRENCY: Map subtasks run at once in-process (defaults to
+        --max-concurrency, else the CPU count)
+    FLYTE_COMPILE_WORKERS: Processes used to precompile the extracted
+        distribution to bytecode before the task is imported (0 disables).
+        When unset, only distribution cache entries are precompiled (once,
+        with the CPU count); other trees compile what the task imports
+    FLYTE_PYCACHE_PREFIX: Write the distribution's bytecode under this
+        prefix (used automatically when the tree isn't writable)
+    FLYTE_STARTUP_PROFILE: Where to write the JSON startup profile
+        ('stdout' or a file path; disabled when unset)
+    FLYTE_CONCURRENT_STARTUP: Run independent startup phases in parallel
+        (defaults to 'true'); credentials wait for the SparkSession, the
+        distribution download for credentials
+    FLYTE_DISTRIBUTION_DOWNLOAD: How to fetch the fast-register tarball:
+        'tempfile' (default), 'stream' (extract while downloading) or
+        'ranged' (stream using parallel byte-range requests)
+    FLYTE_DISTRIBUTION_PART_MB / FLYTE_DISTRIBUTION_CONCURRENCY: Range size
+        and number of parallel requests in 'ranged' mode (defaults 16 / 8)
+    FLYTE_DISTRIBUTION_CHUNK_MB: Read size of the background reader in
+        'stream' and 'ranged' modes (defaults to 8)
+    FLYTE_DOWNLOAD_MAX_ATTEMPTS / FLYTE_DOWNLOAD_BACKOFF_S: Attempts per range
+        request and base of the jittered exponential backoff between them
+        (defaults 8 / 0.25); downloads resume from the last good offset
+    FLYTE_DISTRIBUTION_MIRRORS: Comma-separated directories mirroring the
+        bucket layout (e.g. a Unity Catalog Volume); raced against S3
+    FLYTE_DISTRIBUTION_HEDGE_S: Delay before the next source joins the race
+        (defaults to 2; comma-separated for a delay per source)
+    FLYTE_DECOMPRESS_THREADS: Threads for decompressing distributions
+        (.tar.gz, .tar.zst, .tar.lz4, ...; defaults to the CPU count)
+    FLYTE_EXTRACT_WORKERS: Threads writing extracted files (defaults to twice
+        the CPU count, at most 16; 0 uses tarfile's extractall). Downloaded
+        uncompressed tars are copied with os.copy_file_range
+    FLYTE_DISTRIBUTION_INCLUDE / FLYTE_DISTRIBUTION_EXCLUDE: Comma-separated
+        globs of distribution files to extract / leave out (e.g.
+        'tests/*,*.ipynb'); a pattern matching a directory covers its contents
+    FLYTE_DISTRIBUTION_TRACE: JSON file recording which distribution files the
+        task opens; when it exists, later runs extract those (and all Python
+        modules) first and the rest in the background, on first open or
+        directory listing at the latest (os.path.exists and other stat calls
+        don't wait for them)
+    FLYTE_DISTRIBUTION_SHA256: Expected SHA-256 of the distribution, checked
+        as it is downloaded
+    FLYTE_DISTRIBUTION_VERIFY: Where the expected digest comes from: 'auto'
+        (FLYTE_DISTRIBUTION_SHA256 if set; default), 'metadata' (also the
+        object's x-amz-meta-sha256), 'require' (fail without one) or 'off'
+    FLYTE_DISTRIBUTION_CACHE: Reuse extracted distributions from a node-local
+        cache keyed by S3 ETag/version id and content hash (defaults to 'false')
+    FLYTE_DISTRIBUTION_CACHE_DIR: Cache location (defaults to
+        '<work dir>/.flyte-cache/distributions')
+    FLYTE_DISTRIBUTION_CACHE_MAX_MB: LRU size bound of the cache (defaults to 4096)
+    FLYTE_DISTRIBUTION_CACHE_DEDUP: Store each distinct file of cached
+        distributions once and hardlink it into every tree (defaults to 'true')
+    FLYTE_DISTRIBUTION_SHARED_CACHE_DIR: Second cache tier on a path shared by
+        all nodes (e.g. /Volumes/<catalog>/<schema>/flyte_cache), consulted
+        on a node cache miss before S3
+    FLYTE_DISTRIBUTION_VERSIONS: Extract each distribution into its own tree
+        under '<dest dir>/.flyte-distributions' and run from there, so tasks
+        still running from another version are unaffected (defaults to
+        'false': extract into the dest dir)
+    FLYTE_DISTRIBUTION_LOCK_TIMEOUT_S: How long a task waits for another
+        process on the node fetching the same distribution before fetching it
+        itself (defaults to 600)
+    FLYTE_GIT_CHECKOUT: Run from the job's git_source checkout instead of
+        downloading the distribution when it holds the registered code
+        (defaults to 'false')
+    FLYTE_GIT_COMMIT: Commit the checkout must be at (otherwise its files
+        are compared with the distribution manifest)
+    FLYTE_GIT_CHECKOUT_DIR: Checkout directory to import from (defaults to
+        the entrypoint's directory or a parent up to the repository root)
+    FLYTE_DISTRIBUTION_DELTA: When '<distribution>.manifest.json' exists, fetch
+        only the files changed since the cached / previously extracted
+        version (defaults to 'false')
+    FLYTE_DISTRIBUTION_DELTA_MAX_FRACTION: Share of changed bytes above which
+        the full distribution is downloaded instead (defaults to 0.5)
 """
 
+import hashlib
+import json
 import os
+import resource
 import subprocess
 import sys
 import tempfile
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
 
 
@@ -39,27 +145,466 @@ DEFAULT_CREDENTIAL_PROVIDER = None  # e.g., "my-credential-provider-name"
 
 # =============================================================================
 
+# Entrypoint options, accepted as --flyte-<option>=<value> anywhere in the
+# command line. They are stripped before the Flyte command runs and mapped to
+# the environment variable that configures the same behaviour.
+ENTRYPOINT_OPTIONS = {
+    "--flyte-credential-provider": "DATABRICKS_SERVICE_CREDENTIAL_PROVIDER",
+    "--flyte-aws-credential-mode": "FLYTE_AWS_CREDENTIAL_MODE",
+    "--flyte-aws-credential-cache": "FLYTE_AWS_CREDENTIAL_CACHE",
+    "--flyte-aws-verify-credentials": "FLYTE_AWS_VERIFY_CREDENTIALS",
+    "--flyte-preimport": "FLYTE_PREIMPORT",
+    "--flyte-import-report": "FLYTE_IMPORT_REPORT",
+    "--flyte-warm-server": "FLYTE_WARM_SERVER",
+    "--flyte-warm-server-idle-s": "FLYTE_WARM_SERVER_IDLE_S",
+    "--flyte-batch-manifest": "FLYTE_BATCH_MANIFEST",
+    "--flyte-batch-concurrency": "FLYTE_BATCH_CONCURRENCY",
+    "--flyte-map-task-size": "FLYTE_MAP_TASK_SIZE",
+    "--flyte-map-concurrency": "FLYTE_MAP_CONCURRENCY",
+    "--flyte-compile-workers": "FLYTE_COMPILE_WORKERS",
+    "--flyte-pycache-prefix": "FLYTE_PYCACHE_PREFIX",
+    "--flyte-startup-profile": "FLYTE_STARTUP_PROFILE",
+    "--flyte-concurrent-startup": "FLYTE_CONCURRENT_STARTUP",
+    "--flyte-distribution-download": "FLYTE_DISTRIBUTION_DOWNLOAD",
+    "--flyte-distribution-part-mb": "FLYTE_DISTRIBUTION_PART_MB",
+    "--flyte-distribution-concurrency": "FLYTE_DISTRIBUTION_CONCURRENCY",
+    "--flyte-distribution-chunk-mb": "FLYTE_DISTRIBUTION_CHUNK_MB",
+    "--flyte-distribution-mirrors": "FLYTE_DISTRIBUTION_MIRRORS",
+    "--flyte-distribution-hedge-s": "FLYTE_DISTRIBUTION_HEDGE_S",
+    "--flyte-decompress-threads": "FLYTE_DECOMPRESS_THREADS",
+    "--flyte-extract-workers": "FLYTE_EXTRACT_WORKERS",
+    "--flyte-distribution-include": "FLYTE_DISTRIBUTION_INCLUDE",
+    "--flyte-distribution-exclude": "FLYTE_DISTRIBUTION_EXCLUDE",
+    "--flyte-distribution-trace": "FLYTE_DISTRIBUTION_TRACE",
+    "--flyte-distribution-sha256": "FLYTE_DISTRIBUTION_SHA256",
+    "--flyte-distribution-verify": "FLYTE_DISTRIBUTION_VERIFY",
+    "--flyte-distribution-cache": "FLYTE_DISTRIBUTION_CACHE",
+    "--flyte-distribution-cache-max-mb": "FLYTE_DISTRIBUTION_CACHE_MAX_MB",
+    "--flyte-distribution-cache-dedup": "FLYTE_DISTRIBUTION_CACHE_DEDUP",
+    "--flyte-distribution-shared-cache-dir": "FLYTE_DISTRIBUTION_SHARED_CACHE_DIR",
+    "--flyte-distribution-versions": "FLYTE_DISTRIBUTION_VERSIONS",
+    "--flyte-distribution-lock-timeout-s": "FLYTE_DISTRIBUTION_LOCK_TIMEOUT_S",
+    "--flyte-distribution-delta": "FLYTE_DISTRIBUTION_DELTA",
+    "--flyte-git-checkout": "FLYTE_GIT_CHECKOUT",
+    "--flyte-git-commit": "FLYTE_GIT_COMMIT",
+    "--flyte-git-checkout-dir": "FLYTE_GIT_CHECKOUT_DIR",
+}
+
 
-def parse_credential_provider_from_args():
+def parse_entrypoint_args(argv: list = None):
     """
-    Parse the credential provider from command-line arguments.
+    Parse entrypoint options from command-line arguments.
     
-    Looks for --flyte-credential-provider=<name> anywhere in sys.argv
-    and removes it from the args list.
+    Looks for any --flyte-<option>=<value> listed in ENTRYPOINT_OPTIONS
+    anywhere in argv and removes it from the args list.
+    
+    Args:
+        argv: Arguments to parse (defaults to sys.argv[1:])
     
     Returns:
-        tuple: (credential_provider, remaining_args)
+        tuple: (options, remaining_args) where options maps the environment
+        variable name of each option found to its value
     """
-    credential_provider = None
+    options = {}
     remaining_args = []
     
-    for arg in sys.argv[1:]:
-        if arg.startswith("--flyte-credential-provider="):
-            credential_provider = arg.split("=", 1)[1]
+    for arg in sys.argv[1:] if argv is None else argv:
+        flag, sep, value = arg.partition("=")
+        if sep and flag in ENTRYPOINT_OPTIONS:
+            options[ENTRYPOINT_OPTIONS[flag]] = value
         else:
             remaining_args.append(arg)
     
-    return credential_provider, remaining_args
+    return options, remaining_args
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    """Read a boolean environment variable ('1'/'true'/'yes'/'on' are true)."""
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# =============================================================================
+# STARTUP PROFILING
+# =============================================================================
+
+
+def _peak_rss_mb(who=resource.RUSAGE_SELF) -> float:
+    """Peak resident set size in MiB (ru_maxrss is KiB on Linux)."""
+    return round(resource.getrusage(who).ru_maxrss / 1024.0, 1)
+
+
+class StartupProfile:
+    """
+    Per-phase timing of the entrypoint's cold start.
+    
+    Each phase records its wall-clock time, the CPU time of the thread that
+    ran it (cpu_s), the CPU time of the whole process over the same window
+    (process_cpu_s) and the peak RSS reached by the end of the phase. Phases
+    run concurrently during cold start, so process_cpu_s of overlapping
+    phases includes each other's work and work done by helper threads;
+    cpu_s excludes both. Arbitrary facts about the run (cache
+    hits, retries, decisions taken) can be attached with record().
+    
+    The profile is always collected; emit() writes it as JSON to stdout or a
+    file when FLYTE_STARTUP_PROFILE is set.
+    """
+    
+    def __init__(self):
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self.phases = []
+        self.info = {}
+    
+    @contextmanager
+    def phase(self, name: str):
+        """Time the enclosed block as startup phase `name`."""
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        process_cpu_start = time.process_time()
+        status = "ok"
+        try:
+            yield
+        except BaseException as e:
+            status = "ok" if isinstance(e, SystemExit) and not e.code else "error"
+            raise
+        finally:
+            entry = {
+                "name": name,
+                "start_s": round(wall_start - self._t0, 4),
+                "wall_s": round(time.perf_counter() - wall_start, 4),
+                "cpu_s": round(time.thread_time() - cpu_start, 4),
+                "process_cpu_s": round(time.process_time() - process_cpu_start, 4),
+                "peak_rss_mb": _peak_rss_mb(),
+                "status": status,
+                "thread": threading.current_thread().name,
+            }
+            with self._lock:
+                self.phases.append(entry)
+    
+    def record(self, key: str, value):
+        """Attach a JSON-serializable fact to the profile."""
+        with self._lock:
+            self.info[key] = value
+    
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "version": 1,
+                "started_at": self.started_at,
+                "total_wall_s": round(time.perf_counter() - self._t0, 4),
+                "total_cpu_s": round(time.process_time(), 4),
+                "peak_rss_mb": _peak_rss_mb(),
+                "peak_rss_children_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+                "phases": list(self.phases),
+                "info": dict(self.info),
+            }
+    
+    def print_summary(self):
+        """Log a one-line-per-phase summary."""
+        for entry in self.to_dict()["phases"]:
+            print(
+                f"[Flyte] Phase {entry['name']:<14} wall={entry['wall_s']:8.3f}s "
+                f"cpu={entry['cpu_s']:8.3f}s rss={entry['peak_rss_mb']:.0f}MiB "
+                f"[{entry['status']}]"
+            )
+    
+    def emit(self, destination: str = None):
+        """
+        Write the profile as JSON.
+        
+        Args:
+            destination: 'stdout' (or '-') to print a single
+                '[Flyte] STARTUP_PROFILE {...}' line, or a file path.
+                Defaults to FLYTE_STARTUP_PROFILE; nothing is written if unset.
+        """
+        destination = destination or os.environ.get("FLYTE_STARTUP_PROFILE")
+        if not destination:
+            return
+        payload = json.dumps(self.to_dict(), default=str)
+        try:
+            if destination in ("stdout", "-"):
+                print(f"[Flyte] STARTUP_PROFILE {payload}", flush=True)
+            else:
+                Path(destination).parent.mkdir(parents=True, exist_ok=True)
+                with open(destination, "w") as f:
+                    f.write(payload)
+                print(f"[Flyte] Startup profile written to: {destination}")
+        except Exception as e:
+            print(f"[Flyte] WARNING: Could not write startup profile: {e}")
+
+
+STARTUP_PROFILE = StartupProfile()
+
+
+# =============================================================================
+# AWS CREDENTIALS
+# =============================================================================
+
+
+class RefreshingAwsCredentials:
+    """
+    Keeps AWS credentials from a Databricks service credential provider fresh.
+    
+    A daemon thread re-reads `credentials` (normally botocore
+    RefreshableCredentials backed by the Databricks provider) shortly before
+    they expire and republishes them, so long tasks never run on an expired
+    session token. How they are exposed depends on FLYTE_AWS_CREDENTIAL_MODE:
+    
+        process: (the default) the credentials are written to a private
+                 JSON file served to every AWS SDK (boto3, s3fs/aiobotocore,
+                 flytekit's data persistence) through a `credential_process`
+                 profile in AWS_CONFIG_FILE. SDKs refresh from it themselves,
+                 so even long-lived clients keep working. The static env
+                 vars are removed so they don't shadow the profile.
+        env:     AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY / AWS_SESSION_TOKEN
+                 are rewritten on every refresh, and the s3fs instances
+                 fsspec caches (which flytekit's data persistence reuses)
+                 are dropped so the next lookup creates a client with the
+                 new token. Clients held elsewhere keep the old one.
+    
+    In both modes the default boto3 session is bound to the Databricks
+    botocore session.
+    """
+    
+    # Refresh this long before expiry; botocore's own advisory refresh
+    # window is 15 minutes, so republish comfortably before that.
+    REFRESH_MARGIN_S = 20 * 60
+    # Re-read interval when the provider doesn't report an expiry time
+    FALLBACK_INTERVAL_S = 5 * 60
+    # Environment variables a refresh may rewrite or remove
+    ENV_KEYS = ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SESSION_TOKEN", "AWS_CONFIG_FILE", "AWS_PROFILE")
+    
+    def __init__(self, credentials, mode: str = "process", work_dir: str = None):
+        self.credentials = credentials
+        self.mode = mode
+        work_dir = work_dir or os.environ.get("FLYTE_INTERNAL_WORK_DIR", "/tmp/flyte")
+        self.credentials_dir = os.path.join(work_dir, ".aws")
+        self.refresh_count = 0
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def _expiry(self):
+        """Expiry of the current credentials as an aware datetime, or None."""
+        return getattr(self.credentials, "_expiry_time", None)
+    
+    def refresh(self):
+        """Fetch current credentials and publish them; returns the expiry."""
+        # get_frozen_credentials() refreshes RefreshableCredentials as needed
+        frozen = self.credentials.get_frozen_credentials()
+        expiry = self._expiry()
+        if self.mode == "process":
+            self._publish_process(frozen, expiry)
+        else:
+            self._publish_env(frozen)
+        self.refresh_count += 1
+        return expiry
+    
+    def _publish_env(self, frozen):
+        os.environ["AWS_ACCESS_KEY_ID"] = frozen.access_key
+        os.environ["AWS_SECRET_ACCESS_KEY"] = frozen.secret_key
+        if frozen.token:
+            os.environ["AWS_SESSION_TOKEN"] = frozen.token
+        if self.refresh_count:
+            # Cached filesystems read the env once, when they were created
+            s3fs = sys.modules.get("s3fs")
+            if s3fs is not None:
+                s3fs.S3FileSystem.clear_instance_cache()
+    
+    def _publish_process(self, frozen, expiry):
+        import shutil
+        from datetime import datetime, timedelta, timezone
+        
+        os.makedirs(self.credentials_dir, mode=0o700, exist_ok=True)
+        if expiry is None:
+            # Make SDKs re-read the file periodically even without an expiry
+            expiry = datetime.now(timezone.utc) + timedelta(seconds=2 * self.FALLBACK_INTERVAL_S)
+        payload = {
+            "Version": 1,
+            "AccessKeyId": frozen.access_key,
+            "SecretAccessKey": frozen.secret_key,
+            "Expiration": expiry.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+        if frozen.token:
+            payload["SessionToken"] = frozen.token
+        
+        credentials_path = os.path.join(self.credentials_dir, "credentials.json")
+        tmp_path = f"{credentials_path}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, credentials_path)
+        
+        config_path = os.path.join(self.credentials_dir, "config")
+        if not os.path.exists(config_path):
+            cat = shutil.which("cat")
+            if cat:
+                command = f"{cat} {credentials_path}"
+            else:
+                command = f'{sys.executable} -c "import sys; sys.stdout.write(open(sys.argv[1]).read())" {credentials_path}'
+            with open(config_path, "w") as f:
+                f.write(f"[default]\ncredential_process = {command}\n")
+        
+        os.environ["AWS_CONFIG_FILE"] = config_path
+        os.environ.pop("AWS_PROFILE", None)
+        for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SESSION_TOKEN"):
+            os.environ.pop(name, None)
+    
+    def _seconds_until_refresh(self, expiry) -> float:
+        if expiry is None:
+            return self.FALLBACK_INTERVAL_S
+        from datetime import datetime, timezone
+        
+        remaining = (expiry - datetime.now(timezone.utc)).total_seconds()
+        return max(30.0, remaining - self.REFRESH_MARGIN_S)
+    
+    def _run(self, expiry):
+        while not self._stop.wait(self._seconds_until_refresh(expiry)):
+            try:
+                expiry = self.refresh()
+                print(f"[Flyte] Refreshed AWS credentials (expire {expiry})")
+            except Exception as e:
+                print(f"[Flyte] WARNING: AWS credential refresh failed, retrying: {e}")
+                expiry = None
+    
+    def start(self):
+        """Publish the credentials now and keep refreshing them in the background."""
+        expiry = self.refresh()
+        self._thread = threading.Thread(
+            target=self._run, args=(expiry,), name="flyte-aws-credentials", daemon=True
+        )
+        self._thread.start()
+        return expiry
+    
+    def stop(self):
+        self._stop.set()
+
+
+# Credential refresher of this process (kept alive for its background thread)
+_AWS_CREDENTIALS = None
+
+
+class AwsCredentialCache:
+    """
+    On-disk cache of AWS credentials, keyed by credential provider and region.
+    
+    Entries live in <work dir>/.aws/cache (mode 0700, files 0600) and are
+    reused until `margin_s` seconds before they expire, which lets a task on
+    a warm node skip the Databricks credential provider round trip.
+    """
+    
+    def __init__(self, work_dir: str = None, margin_s: float = 15 * 60):
+        work_dir = work_dir or os.environ.get("FLYTE_INTERNAL_WORK_DIR", "/tmp/flyte")
+        self.cache_dir = os.path.join(work_dir, ".aws", "cache")
+        self.margin_s = margin_s
+    
+    def _path(self, credential_provider: str, region: str) -> str:
+        key = hashlib.sha256(f"{credential_provider}|{region}".encode()).hexdigest()[:32]
+        return os.path.join(self.cache_dir, f"{key}.json")
+    
+    def load(self, credential_provider: str, region: str):
+        """
+        Return cached credential metadata, or None if missing or near expiry.
+        
+        Returns:
+            dict: botocore credential metadata (access_key, secret_key,
+            token, expiry_time as an ISO 8601 string)
+        """
+        from datetime import datetime, timezone
+        
+        path = self._path(credential_provider, region)
+        try:
+            if os.stat(path).st_mode & 0o077:
+                print(f"[Flyte] WARNING: Ignoring credential cache with open permissions: {path}")
+                return None
+        except OSError:
+            return None
+        metadata = _read_json(path)
+        if not metadata or not metadata.get("expiry_time"):
+            return None
+        expiry = datetime.fromisoformat(metadata["expiry_time"])
+        if (expiry - datetime.now(timezone.utc)).total_seconds() <= self.margin_s:
+            return None
+        return metadata
+    
+    def save(self, credential_provider: str, region: str, frozen, expiry):
+        """Store frozen credentials with their expiry (not cached without one)."""
+        if expiry is None:
+            return
+        os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+        path = self._path(credential_provider, region)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump({
+                "access_key": frozen.access_key,
+                "secret_key": frozen.secret_key,
+                "token": frozen.token,
+                "expiry_time": expiry.isoformat(),
+            }, f)
+        os.replace(tmp_path, path)
+
+
+def _get_databricks_botocore_session(credential_provider: str):
+    """Get the botocore session of a Databricks service credential provider."""
+    # Import dbutils - only available in Databricks runtime
+    from pyspark.dbutils import DBUtils
+    from pyspark.sql import SparkSession
+    
+    # Get SparkSession (pre-configured in serverless)
+    spark = SparkSession.builder.getOrCreate()
+    dbutils = DBUtils(spark)
+    
+    print("[Flyte] Calling dbutils.credentials.getServiceCredentialsProvider()...")
+    return dbutils.credentials.getServiceCredentialsProvider(credential_provider)
+
+
+def _botocore_session_from_cache(metadata: dict, credential_provider: str, region: str, cache: AwsCredentialCache):
+    """
+    Build a botocore session from cached credentials.
+    
+    The credentials are botocore RefreshableCredentials whose refresh goes
+    back to the Databricks provider (and updates the cache), so they stay
+    valid after the cached token expires.
+    """
+    import botocore.session
+    from botocore.credentials import RefreshableCredentials
+    
+    def refresh_from_provider():
+        credentials = _get_databricks_botocore_session(credential_provider).get_credentials()
+        frozen = credentials.get_frozen_credentials()
+        expiry = getattr(credentials, "_expiry_time", None)
+        cache.save(credential_provider, region, frozen, expiry)
+        return {
+            "access_key": frozen.access_key,
+            "secret_key": frozen.secret_key,
+            "token": frozen.token,
+            "expiry_time": expiry.isoformat() if expiry else None,
+        }
+    
+    credentials = RefreshableCredentials.create_from_metadata(
+        metadata=metadata,
+        refresh_using=refresh_from_provider,
+        method="flyte-credential-cache",
+    )
+    botocore_session = botocore.session.get_session()
+    botocore_session._credentials = credentials
+    return botocore_session
+
+
+def _verify_aws_credentials(session):
+    """Log the AWS identity behind `session` via STS GetCallerIdentity."""
+    try:
+        sts_client = session.client("sts")
+        identity = sts_client.get_caller_identity()
+        print(f"[Flyte] ✓ AWS credentials configured successfully")
+        print(f"[Flyte]   Account: {identity.get('Account', 'unknown')}")
+        print(f"[Flyte]   ARN: {identity.get('Arn', 'unknown')}")
+    except Exception as e:
+        print(f"[Flyte] WARNING: Could not verify AWS credentials: {e}")
 
 
 def setup_aws_credentials_from_databricks(credential_provider: str = None):
@@ -95,21 +640,21 @@ def setup_aws_credentials_from_databricks(credential_provider: str = None):
     print(f"[Flyte] Configuring AWS credentials from: {credential_provider}")
     
     try:
-        # Import dbutils - only available in Databricks runtime
-        from pyspark.dbutils import DBUtils
-        from pyspark.sql import SparkSession
-        
-        # Get SparkSession (pre-configured in serverless)
-        spark = SparkSession.builder.getOrCreate()
-        dbutils = DBUtils(spark)
+        import boto3
+        region = os.environ.get("AWS_DEFAULT_REGION", "us-east-1")
         
-        # Get the botocore session from Databricks service credentials
-        print("[Flyte] Calling dbutils.credentials.getServiceCredentialsProvider()...")
-        botocore_session = dbutils.credentials.getServiceCredentialsProvider(credential_provider)
+        # Reuse credentials cached on this node, else ask Databricks for the
+        # botocore session of the service credential provider
+        cache = AwsCredentialCache() if _env_flag("FLYTE_AWS_CREDENTIAL_CACHE", False) else None
+        cached = cache.load(credential_provider, region) if cache else None
+        if cached:
+            print("[Flyte] Using cached AWS credentials")
+            botocore_session = _botocore_session_from_cache(cached, credential_provider, region, cache)
+        else:
+            botocore_session = _get_databricks_botocore_session(credential_provider)
+        STARTUP_PROFILE.record("aws_credential_cache", "hit" if cached else ("miss" if cache else "disabled"))
         
         # Create a boto3 session with this botocore session
-        import boto3
-        region = os.environ.get("AWS_DEFAULT_REGION", "us-east-1")
         session = boto3.Session(botocore_session=botocore_session, region_name=region)
         
         # Get credentials from the session
@@ -118,28 +663,32 @@ def setup_aws_credentials_from_databricks(credential_provider: str = None):
             print("[Flyte] ERROR: No credentials returned from service credential provider")
             return False
         
-        # Get frozen credentials (thread-safe snapshot)
-        frozen_credentials = credentials.get_frozen_credentials()
+        # Expose the credentials to AWS SDK / s3fs / flytekit and keep
+        # them refreshed before the session token expires
+        global _AWS_CREDENTIALS
+        if _AWS_CREDENTIALS is not None:
+            _AWS_CREDENTIALS.stop()
+        mode = os.environ.get("FLYTE_AWS_CREDENTIAL_MODE", "process")
+        _AWS_CREDENTIALS = RefreshingAwsCredentials(credentials, mode=mode)
+        expiry = _AWS_CREDENTIALS.start()
+        boto3.setup_default_session(botocore_session=botocore_session, region_name=region)
+        print(f"[Flyte] AWS credentials exposed via '{mode}', refreshed before expiry ({expiry})")
         
-        # Set environment variables for AWS SDK / s3fs / flytekit
-        os.environ["AWS_ACCESS_KEY_ID"] = frozen_credentials.access_key
-        os.environ["AWS_SECRET_ACCESS_KEY"] = frozen_credentials.secret_key
-        
-        if frozen_credentials.token:
-            os.environ["AWS_SESSION_TOKEN"] = frozen_credentials.token
+        if cache and not cached:
+            cache.save(credential_provider, region, credentials.get_frozen_credentials(), expiry)
         
         if region:
             os.environ["AWS_DEFAULT_REGION"] = region
         
-        # Verify credentials are working
-        try:
-            sts_client = session.client("sts")
-            identity = sts_client.get_caller_identity()
-            print(f"[Flyte] ✓ AWS credentials configured successfully")
-            print(f"[Flyte]   Account: {identity.get('Account', 'unknown')}")
-            print(f"[Flyte]   ARN: {identity.get('Arn', 'unknown')}")
-        except Exception as e:
-            print(f"[Flyte] WARNING: Could not verify AWS credentials: {e}")
+        # Verify credentials are working. STS is a network round trip on the
+        # critical path, so by default it runs in the background.
+        verify = os.environ.get("FLYTE_AWS_VERIFY_CREDENTIALS", "background")
+        if verify == "sync":
+            _verify_aws_credentials(session)
+        elif verify == "background":
+            threading.Thread(
+                target=_verify_aws_credentials, args=(session,), name="flyte-sts-verify", daemon=True
+            ).start()
         
         return True
         
@@ -265,166 +814,4466 @@ def setup_environment():
     return work_dir
 
 
-def download_and_extract_distribution(additional_distribution: str, dest_dir: str):
-    """Download and extract the tarball from S3."""
-    import tarfile
-    import tempfile
-    import fsspec
+# =============================================================================
+# DISTRIBUTION DOWNLOAD
+# =============================================================================
+
+
+class _BackgroundReader:
+    """
+    Read-only file object that prefetches its source on a background thread.
     
-    os.makedirs(dest_dir, exist_ok=True)
+    Chunks are read from `raw` into a bounded queue while the consumer is busy
+    decompressing and extracting, so network transfer and extraction overlap.
+    Errors raised by the source are re-raised from read(). The SHA-256 of the
+    bytes consumed so far is kept in `sha256` (unless hash=False).
+    """
     
-    with tempfile.NamedTemporaryFile(suffix='.tar.gz', delete=False) as tmp:
-        tmp_path = tmp.name
+    _EOF = object()
     
-    try:
-        fs = fsspec.filesystem('s3')
-        s3_path = additional_distribution.replace('s3://', '')
-        print(f"[Flyte] Downloading: {s3_path}")
-        fs.get(s3_path, tmp_path)
-        print(f"[Flyte] Downloaded to: {tmp_path}")
+    def __init__(self, raw, chunk_size: int = 8 << 20, max_chunks: int = 4, hash: bool = True):
+        import queue
         
-        with tarfile.open(tmp_path, 'r:gz') as tar:
-            tar.extractall(path=dest_dir)
-        print(f"[Flyte] Extracted to: {dest_dir}")
-    finally:
-        if os.path.exists(tmp_path):
-            os.unlink(tmp_path)
+        self._raw = raw
+        self._chunk_size = chunk_size
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self._stop = threading.Event()
+        self._buffer = b""
+        self._pos = 0
+        self._eof = False
+        self.bytes_read = 0
+        self.sha256 = hashlib.sha256() if hash else None
+        self._thread = threading.Thread(target=self._fill, name="flyte-prefetch", daemon=True)
+        self._thread.start()
+    
+    def _put(self, item):
+        import queue
+        
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+    
+    def _fill(self):
+        try:
+            while not self._stop.is_set():
+                chunk = self._raw.read(self._chunk_size)
+                if not chunk:
+                    break
+                self._put(chunk)
+            self._put(self._EOF)
+        except BaseException as e:
+            self._put(e)
+    
+    def read(self, size: int = -1) -> bytes:
+        parts = []
+        remaining = size if size is not None and size >= 0 else float("inf")
+        while remaining > 0 and not self._eof:
+            if self._pos >= len(self._buffer):
+                item = self._queue.get()
+                if item is self._EOF:
+                    self._eof = True
+                    break
+                if isinstance(item, BaseException):
+                    self._eof = True
+                    raise item
+                self._buffer, self._pos = item, 0
+            take = self._buffer[self._pos:self._pos + min(remaining, len(self._buffer) - self._pos)]
+            self._pos += len(take)
+            remaining -= len(take)
+            parts.append(take)
+        data = b"".join(parts)
+        self.bytes_read += len(data)
+        if self.sha256 is not None:
+            self.sha256.update(data)
+        return data
+    
+    def readable(self) -> bool:
+        return True
+    
+    def close(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
 
 
-def execute_flyte_task_directly(args: list):
+class _HashingReader:
+    """File object that computes the SHA-256 of the bytes read through it."""
+    
+    def __init__(self, raw):
+        self._raw = raw
+        self.bytes_read = 0
+        self.sha256 = hashlib.sha256()
+    
+    def read(self, size: int = -1) -> bytes:
+        data = self._raw.read(size)
+        self.bytes_read += len(data)
+        self.sha256.update(data)
+        return data
+    
+    def readable(self) -> bool:
+        return True
+
+
+# Substrings of errors that mean S3 is throttling requests
+_THROTTLE_MARKERS = ("SlowDown", "503", "Throttl", "TooManyRequests", "RequestLimitExceeded", "reduce your request rate")
+
+# Errors that retrying cannot fix
+_PERMANENT_ERRORS = (FileNotFoundError, PermissionError, NotImplementedError, ValueError, TypeError)
+
+
+class DownloadRetry:
     """
-    Execute Flyte task directly to preserve SparkSession.
+    Retry and flow control shared by the range requests of one download.
     
-    This is the key to making Spark work in Databricks serverless with Flyte.
-    fast_execute_task_cmd clears Python state, losing the SparkSession.
-    By downloading the tarball and importing the module ourselves, we preserve
-    the SparkSession that was created by setup_spark_session().
+    A failed request is retried with full-jitter exponential backoff
+    (FLYTE_DOWNLOAD_BACKOFF_S base, defaults to 0.25, capped at 30s) up to
+    FLYTE_DOWNLOAD_MAX_ATTEMPTS times (defaults to 8). Bytes already
+    received for a range are kept, so a retry resumes from the last good
+    offset.
+    
+    Throttling (503 SlowDown and friends) halves the number of concurrent
+    requests and doubles the part size, so fewer, larger requests are made;
+    other transient errors halve the part size so less is lost per failure.
+    Concurrency grows back by one after every 8 successful requests.
+    
+    stats() reports bytes_rerequested: the size of the remainders asked for
+    again after failures, an upper bound on the bytes actually refetched.
     """
-    import importlib
     
-    # Parse args: --additional-distribution <url> --dest-dir <dir> -- pyflyte-execute ...
-    additional_distribution = None
-    dest_dir = "."
-    execute_args = []
+    def __init__(self, part_size: int, concurrency: int):
+        self.part_size = part_size
+        self.max_part_size = max(part_size, 64 << 20)
+        self.min_part_size = min(part_size, 1 << 20)
+        self.concurrency = self.max_concurrency = max(1, concurrency)
+        self.max_attempts = int(os.environ.get("FLYTE_DOWNLOAD_MAX_ATTEMPTS", "8"))
+        self.backoff_s = float(os.environ.get("FLYTE_DOWNLOAD_BACKOFF_S", "0.25"))
+        self.retries = 0
+        self.throttled = 0
+        self.bytes_rerequested = 0
+        self._successes = 0
+        self._in_flight = 0
+        self._cond = threading.Condition()
     
-    i = 0
-    while i < len(args):
-        if args[i] == "--additional-distribution" and i + 1 < len(args):
-            additional_distribution = args[i + 1]
-            i += 2
-        elif args[i] == "--dest-dir" and i + 1 < len(args):
-            dest_dir = args[i + 1]
-            i += 2
-        elif args[i] == "--":
-            execute_args = args[i + 1:]
-            break
-        else:
-            i += 1
+    @contextmanager
+    def _slot(self):
+        with self._cond:
+            while self._in_flight >= self.concurrency:
+                self._cond.wait()
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
     
-    # Extract task info for logging
-    task_module = None
-    for j, arg in enumerate(execute_args):
-        if arg == "task-module" and j + 1 < len(execute_args):
-            task_module = execute_args[j + 1]
-            break
+    def _adapt(self, error: BaseException = None):
+        with self._cond:
+            if error is None:
+                self._successes += 1
+                if self._successes % 8 == 0 and self.concurrency < self.max_concurrency:
+                    self.concurrency += 1
+            elif any(marker.lower() in f"{type(error).__name__} {error}".lower() for marker in _THROTTLE_MARKERS):
+                self.throttled += 1
+                self.concurrency = max(1, self.concurrency // 2)
+                self.part_size = min(self.max_part_size, self.part_size * 2)
+            else:
+                self.part_size = max(self.min_part_size, self.part_size // 2)
+            self._cond.notify_all()
     
-    print(f"[Flyte] Executing task: {task_module}")
+    def fetch(self, fetch_range, start: int, end: int) -> bytes:
+        """
+        Fetch [start, end) with fetch_range(start, end), retrying failures.
+        
+        Short responses are completed with a request for the remainder.
+        """
+        import random
+        
+        received = []
+        offset = start
+        attempt = 0
+        while offset < end:
+            try:
+                with self._slot():
+                    data = fetch_range(offset, end)
+                if not data:
+                    raise IOError(f"Empty response for range {offset}-{end}")
+                received.append(data)
+                offset += len(data)
+                self._adapt()
+            except _PERMANENT_ERRORS:
+                raise
+            except Exception as e:
+                attempt += 1
+                if attempt >= self.max_attempts:
+                    raise
+                self._adapt(e)
+                delay = random.uniform(0, min(30.0, self.backoff_s * 2 ** attempt))
+                with self._cond:
+                    self.retries += 1
+                    self.bytes_rerequested += end - offset
+                print(f"[Flyte] WARNING: Range {offset}-{end} failed ({type(e).__name__}: {e}); "
+                      f"retry {attempt} in {delay:.2f}s")
+                time.sleep(delay)
+        return b"".join(received)
     
-    # Download and extract tarball
-    if additional_distribution:
-        download_and_extract_distribution(additional_distribution, dest_dir)
+    def stats(self) -> dict:
+        return {
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "bytes_rerequested": self.bytes_rerequested,
+            "part_size": self.part_size,
+            "concurrency": self.concurrency,
+        }
+
+
+class RangedReader:
+    """
+    In-order file object over an object fetched as concurrent byte ranges.
     
-    # Add to sys.path
-    abs_dest = os.path.abspath(dest_dir)
-    if abs_dest not in sys.path:
-        sys.path.insert(0, abs_dest)
+    The object is read as consecutive ranges fetched on a thread pool, at
+    most 2 * concurrency of them in flight or buffered, and read() hands
+    them out strictly in order, so the result can be fed to a streaming
+    extractor. Failed ranges are retried and resumed, and the part size and
+    concurrency adapt to throttling (see DownloadRetry). Per-part timings
+    are kept in `part_stats`.
     
-    # Import task module in our context (preserves SparkSession)
-    if task_module:
-        importlib.import_module(task_module)
+    Args:
+        fetch_range: Callable (start, end) -> bytes for the half-open range
+        size: Object size in bytes
+        part_size: Initial bytes per range request
+        concurrency: Maximum number of concurrent range requests
+    """
     
-    # Execute via flytekit (handles inputs/outputs)
-    from flytekit.bin.entrypoint import execute_task_cmd
-    exec_args = execute_args[1:] if execute_args and execute_args[0] == "pyflyte-execute" else execute_args
+    def __init__(self, fetch_range, size: int, part_size: int, concurrency: int):
+        from collections import deque
+        from concurrent.futures import ThreadPoolExecutor
+        
+        self._fetch_range = fetch_range
+        self.size = size
+        self._next_offset = 0
+        self._next_index = 0
+        self.retry = DownloadRetry(part_size, concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="flyte-range")
+        self._pending = deque()
+        self._buffer = b""
+        self._pos = 0
+        self._lock = threading.Lock()
+        self.part_stats = []
+        self._schedule()
     
-    execute_task_cmd.main(exec_args, standalone_mode=False)
-    return 0
+    def _schedule(self):
+        while self._next_offset < self.size and len(self._pending) < 2 * self.retry.concurrency:
+            start = self._next_offset
+            end = min(start + self.retry.part_size, self.size)
+            self._pending.append(self._executor.submit(self._fetch_part, self._next_index, start, end))
+            self._next_offset, self._next_index = end, self._next_index + 1
+    
+    def _fetch_part(self, index: int, start: int, end: int) -> bytes:
+        began = time.perf_counter()
+        data = self.retry.fetch(self._fetch_range, start, end)
+        elapsed = time.perf_counter() - began
+        if len(data) != end - start:
+            raise IOError(f"Range {start}-{end} returned {len(data)} bytes, expected {end - start}")
+        with self._lock:
+            self.part_stats.append({
+                "part": index,
+                "offset": start,
+                "bytes": len(data),
+                "seconds": round(elapsed, 3),
+                "mib_per_s": round(len(data) / (1 << 20) / elapsed, 2) if elapsed else None,
+            })
+        return data
+    
+    def read(self, size: int = -1) -> bytes:
+        parts = []
+        remaining = size if size is not None and size >= 0 else float("inf")
+        while remaining > 0:
+            if self._pos >= len(self._buffer):
+                if not self._pending:
+                    break
+                self._buffer, self._pos = self._pending.popleft().result(), 0
+                self._schedule()
+            take = self._buffer[self._pos:self._pos + min(remaining, len(self._buffer) - self._pos)]
+            self._pos += len(take)
+            remaining -= len(take)
+            parts.append(take)
+        return b"".join(parts)
+    
+    def readable(self) -> bool:
+        return True
+    
+    def close(self):
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait=False)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
 
 
-def execute_flyte_command_inprocess(args: list):
+def open_distribution_object(additional_distribution: str, concurrency: int = 1) -> RangedReader:
     """
-    Execute the Flyte command IN-PROCESS to preserve SparkSession.
+    Open an S3 object for resumable, in-order reading.
     
-    IMPORTANT: We use direct task execution instead of fast_execute_task_cmd
-    because fast_execute_task_cmd clears Python state when loading the task module,
-    which loses the SparkSession created by this entrypoint.
+    Ranges start at FLYTE_DISTRIBUTION_PART_MB (defaults to 16) and are
+    retried and resumed on failure (see DownloadRetry).
     """
-    if not args:
-        print("[Flyte] ERROR: No command provided", file=sys.stderr)
-        return 1
-    
-    cmd = args[0] if args else ""
+    import fsspec
     
-    try:
-        if cmd == "pyflyte-fast-execute":
-            # Use DIRECT execution to preserve SparkSession
-            return execute_flyte_task_directly(args[1:])
-            
-        elif cmd == "pyflyte-execute":
-            from flytekit.bin.entrypoint import execute_task_cmd
-            return execute_task_cmd.main(args[1:], standalone_mode=False) or 0
-            
-        else:
-            print(f"[Flyte] Unknown command '{cmd}', using subprocess")
-            result = subprocess.run(args, check=False, env=os.environ.copy())
-            return result.returncode
-            
-    except SystemExit as e:
-        return e.code if e.code is not None else 0
-    except Exception as e:
-        print(f"[Flyte] ERROR: {e}", file=sys.stderr)
-        import traceback
-        traceback.print_exc()
-        return 1
+    fs = fsspec.filesystem('s3')
+    s3_path = additional_distribution.replace('s3://', '')
+    part_size = int(float(os.environ.get("FLYTE_DISTRIBUTION_PART_MB", "16")) * (1 << 20))
+    size = fs.info(s3_path)["size"]
+    return RangedReader(
+        lambda start, end: fs.cat_file(s3_path, start=start, end=end),
+        size, part_size, concurrency,
+    )
 
 
-def is_running_in_ipython():
-    """Check if we're running inside IPython/Jupyter/Databricks notebook."""
-    try:
-        get_ipython()  # noqa: F821
+def _record_download_stats(source: RangedReader, **extra):
+    stats = dict(extra, **source.retry.stats())
+    if stats["retries"]:
+        print(f"[Flyte] Download needed {stats['retries']} retries "
+              f"({stats['throttled']} throttled, {stats['bytes_rerequested'] / (1 << 20):.1f} MiB re-requested)")
+    STARTUP_PROFILE.record("distribution_download", stats)
+
+
+# =============================================================================
+# DECOMPRESSION
+# =============================================================================
+
+
+class _PeekableReader:
+    """File object that allows looking at the first bytes of a stream."""
+    
+    def __init__(self, raw, peek_size: int = 512):
+        self._raw = raw
+        self._head = b""
+        while len(self._head) < peek_size:
+            chunk = raw.read(peek_size - len(self._head))
+            if not chunk:
+                break
+            self._head += chunk
+        self.head = self._head
+    
+    def read(self, size: int = -1) -> bytes:
+        if not self._head:
+            return self._raw.read(size)
+        if size is None or size < 0:
+            data, self._head = self._head + self._raw.read(), b""
+            return data
+        data, self._head = self._head[:size], self._head[size:]
+        if len(data) < size:
+            data += self._raw.read(size - len(data))
+        return data
+    
+    def readable(self) -> bool:
         return True
-    except NameError:
-        return False
 
 
-def main():
-    """Main entrypoint for Flyte serverless tasks."""
-    print("[Flyte] Serverless Entrypoint")
-    print(f"[Flyte] Python: {sys.version.split()[0]}")
-    print(f"[Flyte] Raw args: {sys.argv[1:]}")
+def _read_exact(raw, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = raw.read(size - len(data))
+        if not chunk:
+            raise EOFError(f"Truncated compressed member: expected {size} bytes, got {len(data)}")
+        data += chunk
+    return data
+
+
+def _split_bgzf_members(raw):
+    """
+    Yield gzip members that record their size in a 'BC' extra subfield.
     
-    # Parse credential provider from command-line arguments
-    credential_provider, remaining_args = parse_credential_provider_from_args()
-    print(f"[Flyte] Executing: {' '.join(remaining_args[:3])}..." if len(remaining_args) > 3 else f"[Flyte] Executing: {' '.join(remaining_args)}")
+    This is the BGZF layout written by bgzip and other block-parallel gzip
+    compressors; each member can be inflated independently.
+    """
+    import struct
     
-    # Configure AWS credentials from Databricks service credentials
-    # This must happen BEFORE any S3 access attempts
-    if not setup_aws_credentials_from_databricks(credential_provider):
-        print("[Flyte] WARNING: S3 operations may fail without credentials")
+    while True:
+        header = raw.read(12)
+        if not header:
+            return
+        header += _read_exact(raw, 12 - len(header)) if len(header) < 12 else b""
+        xlen = struct.unpack("<H", header[10:12])[0]
+        extra = _read_exact(raw, xlen)
+        block_size = None
+        pos = 0
+        while pos + 4 <= len(extra):
+            si1, si2, slen = extra[pos], extra[pos + 1], struct.unpack("<H", extra[pos + 2:pos + 4])[0]
+            if (si1, si2) == (66, 67) and slen == 2:
+                block_size = struct.unpack("<H", extra[pos + 4:pos + 6])[0] + 1
+            pos += 4 + slen
+        if block_size is None:
+            raise ValueError("gzip member without BGZF block size")
+        yield header + extra + _read_exact(raw, block_size - 12 - xlen)
+
+
+def _split_pzstd_frames(raw):
+    """
+    Yield zstd frames that are each preceded by a skippable frame holding
+    their compressed size (the layout written by pzstd).
+    """
+    import struct
     
-    # Set up working environment
-    setup_environment()
+    while True:
+        header = raw.read(12)
+        if not header:
+            return
+        header += _read_exact(raw, 12 - len(header)) if len(header) < 12 else b""
+        magic, frame_size, compressed_size = struct.unpack("<III", header)
+        if magic != 0x184D2A50 or frame_size != 4:
+            raise ValueError("zstd stream is not split into size-prefixed frames")
+        yield _read_exact(raw, compressed_size)
+
+
+def _is_bgzf(head: bytes) -> bool:
+    import struct
     
-    # Pre-initialize SparkSession and inject into builtins
-    # This is critical - the SparkSession must be created HERE (before fast_execute)
-    # because Databricks' pyspark handles unix:// URLs correctly only on first import
-    spark = setup_spark_session()
-    if not spark:
-        print("[Flyte] ERROR: Failed to create SparkSession - cannot proceed")
-        sys.exit(1)
+    if len(head) < 18 or head[:2] != b"\x1f\x8b" or not head[3] & 4:
+        return False
+    xlen = struct.unpack("<H", head[10:12])[0]
+    return b"BC\x02\x00" in head[12:12 + xlen]
+
+
+def _is_pzstd(head: bytes) -> bool:
+    import struct
     
-    # Execute the Flyte command (uses direct execution to preserve SparkSession)
-    return_code = execute_flyte_command_inprocess(remaining_args)
+    return len(head) >= 16 and struct.unpack("<II", head[:8]) == (0x184D2A50, 4) and head[12:16] == b"\x28\xb5\x2f\xfd"
+
+
+class _ParallelMemberReader:
+    """
+    In-order file object over independently compressed members.
+    
+    Members produced by `split` are decompressed with `decompress` on a
+    thread pool (zlib and zstd release the GIL), keeping at most
+    2 * threads batches of members in flight.
+    """
+    
+    def __init__(self, raw, split, decompress, threads: int):
+        from collections import deque
+        from concurrent.futures import ThreadPoolExecutor
+        
+        self._members = split(raw)
+        self._decompress = decompress
+        self._window = max(1, threads) * 2
+        self._executor = ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix="flyte-inflate")
+        self._pending = deque()
+        self._buffer = b""
+        self._pos = 0
+        self._schedule()
+    
+    # Members are small (BGZF caps them at 64 KiB), so they are submitted
+    # in batches of about this many compressed bytes
+    BATCH_BYTES = 1 << 20
+    
+    def _decompress_batch(self, members: list) -> bytes:
+        return b"".join(self._decompress(member) for member in members)
+    
+    def _schedule(self):
+        while len(self._pending) < self._window:
+            batch, batch_bytes = [], 0
+            while batch_bytes < self.BATCH_BYTES:
+                member = next(self._members, None)
+                if member is None:
+                    break
+                batch.append(member)
+                batch_bytes += len(member)
+            if not batch:
+                return
+            self._pending.append(self._executor.submit(self._decompress_batch, batch))
+    
+    def read(self, size: int = -1) -> bytes:
+        parts = []
+        remaining = size if size is not None and size >= 0 else float("inf")
+        while remaining > 0:
+            if self._pos >= len(self._buffer):
+                if not self._pending:
+                    break
+                self._buffer, self._pos = self._pending.popleft().result(), 0
+                self._schedule()
+                continue
+            take = self._buffer[self._pos:self._pos + min(remaining, len(self._buffer) - self._pos)]
+            self._pos += len(take)
+            remaining -= len(take)
+            parts.append(take)
+        return b"".join(parts)
+    
+    def readable(self) -> bool:
+        return True
+    
+    def close(self):
+        for future in self._pending:
+            future.cancel()
+        self._executor.shutdown(wait=False)
+
+
+def _import_zstandard():
+    """Import the optional `zstandard` package for zstd distributions."""
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd distributions need the 'zstandard' package") from None
+    return zstandard
+
+
+def open_decompressed(raw, threads: int = None):
+    """
+    Detect the compression of a distribution stream and decompress it.
+    
+    Supported: gzip (BGZF multi-member gzip is inflated in parallel), zstd
+    (pzstd size-prefixed frames in parallel; needs `zstandard`), lz4 frame
+    (needs `lz4`), bzip2, xz and uncompressed tar. Sequential formats are
+    decompressed on their own thread, overlapping tar extraction.
+    
+    Args:
+        raw: Compressed binary stream
+        threads: Decompression threads (defaults to FLYTE_DECOMPRESS_THREADS,
+            else the CPU count)
+    
+    Returns:
+        tuple: (decompressed file object, format name)
+    """
+    import zlib
+    
+    if threads is None:
+        threads = int(os.environ.get("FLYTE_DECOMPRESS_THREADS") or os.cpu_count() or 1)
+    raw = _PeekableReader(raw)
+    head = raw.head
+    
+    if _is_bgzf(head) and threads > 1:
+        return _ParallelMemberReader(raw, _split_bgzf_members, lambda m: zlib.decompress(m, 31), threads), "bgzf"
+    if _is_pzstd(head) and threads > 1:
+        zstandard = _import_zstandard()
+        return _ParallelMemberReader(
+            raw, _split_pzstd_frames, lambda m: zstandard.ZstdDecompressor().decompressobj().decompress(m), threads
+        ), "pzstd"
+    
+    if head[:2] == b"\x1f\x8b":
+        import gzip
+        
+        stream, fmt = gzip.GzipFile(fileobj=raw, mode="rb"), "gzip"
+    elif head[:4] == b"\x28\xb5\x2f\xfd" or _is_pzstd(head):
+        zstandard = _import_zstandard()
+        stream, fmt = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True), "zstd"
+    elif head[:4] == b"\x04\x22\x4d\x18":
+        try:
+            import lz4.frame
+        except ImportError:
+            raise ImportError("lz4 distributions need the 'lz4' package") from None
+        stream, fmt = lz4.frame.LZ4FrameFile(raw, mode="rb"), "lz4"
+    elif head[:3] == b"BZh":
+        import bz2
+        
+        stream, fmt = bz2.BZ2File(raw, mode="rb"), "bzip2"
+    elif head[:6] == b"\xfd7zXZ\x00":
+        import lzma
+        
+        stream, fmt = lzma.LZMAFile(raw, mode="rb"), "xz"
+    elif head[257:262] == b"ustar":
+        return raw, "tar"
+    else:
+        raise ValueError(f"Unrecognized distribution format (magic {head[:4].hex()})")
+    
+    if threads > 1:
+        return _BackgroundReader(stream, chunk_size=1 << 20, max_chunks=8, hash=False), fmt
+    return stream, fmt
+
+
+# =============================================================================
+# EXTRACTION
+# =============================================================================
+
+# Regular files up to this size are read from the tar stream and handed to a
+# writer thread; larger ones are copied through in chunks on the reader
+_MAX_QUEUED_FILE = 4 << 20
+
+
+def _current_umask() -> int:
+    """The process umask, read without changing it (None if unknown)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("Umask:"):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _member_relpath(name: str) -> str:
+    """A tar member name as a normalized relative path ('' for the root)."""
+    return "/".join(part for part in name.lstrip("/").split("/") if part not in ("", "."))
+
+
+def _safe_member_path(dest_dir: str, name: str) -> str:
+    """
+    Resolve a tar member name inside dest_dir, without touching the disk.
+    
+    Like tarfile's 'data' filter, leading slashes are stripped and names
+    with '..' components are rejected. Returns None for the archive root.
+    """
+    relpath = _member_relpath(name)
+    if ".." in relpath.split("/"):
+        raise ValueError(f"Refusing to extract {name!r} outside {dest_dir}")
+    return os.path.join(dest_dir, relpath) if relpath else None
+
+
+def distribution_member_filter(include: list = None, exclude: list = None):
+    """
+    Predicate selecting the distribution files to extract.
+    
+    `include` and `exclude` are fnmatch globs matched against each file's
+    relative path ('*' also matches '/'); a glob matching one of its parent
+    directories matches the file too. They default to the comma-separated
+    FLYTE_DISTRIBUTION_INCLUDE and FLYTE_DISTRIBUTION_EXCLUDE.
+    
+    Returns:
+        Callable[[str], bool]: Takes a relative path, or None to extract
+        everything
+    """
+    from fnmatch import fnmatchcase
+    
+    def patterns(value, name):
+        if value is None:
+            value = [p.strip() for p in os.environ.get(name, "").split(",")]
+        return [p.strip("/") for p in value if p and p.strip("/")]
+    
+    include = patterns(include, "FLYTE_DISTRIBUTION_INCLUDE")
+    exclude = patterns(exclude, "FLYTE_DISTRIBUTION_EXCLUDE")
+    if not include and not exclude:
+        return None
+    
+    def matches(relpath, globs):
+        parts = relpath.split("/")
+        prefixes = ["/".join(parts[:i]) for i in range(1, len(parts) + 1)]
+        return any(fnmatchcase(prefix, glob) for glob in globs for prefix in prefixes)
+    
+    def select(relpath):
+        return (not include or matches(relpath, include)) and not matches(relpath, exclude)
+    
+    return select
+
+
+def _data_file_mode(mode: int) -> int:
+    """Permission bits tarfile's 'data' filter gives a regular file."""
+    mode &= 0o755
+    if not mode & 0o100:
+        mode &= ~0o111
+    return mode | 0o600
+
+
+def _create_file(path: str, mode: int) -> int:
+    """Open a new `path` for writing, replacing (never following) what was there."""
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_CLOEXEC", 0)
+    try:
+        return os.open(path, flags, mode)
+    except FileExistsError:
+        os.unlink(path)
+        return os.open(path, flags, mode)
+
+
+def _write_file(path: str, data: bytes, mode: int, umask: int):
+    """Create `path` with `data`, replacing (never following) what was there."""
+    fd = _create_file(path, mode)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+        if umask is None or mode & umask:
+            os.fchmod(fd, mode)
+    finally:
+        os.close(fd)
+
+
+def _extract_member_stdlib(tar, member, dest_dir: str):
+    """Extract one member with tarfile, under the 'data' filter when available."""
+    import tarfile
+    
+    if hasattr(tarfile, "data_filter"):
+        tar.extract(member, dest_dir, filter="data")
+        return
+    if member.issym() or member.islnk():
+        if os.path.isabs(member.linkname):
+            raise ValueError(f"Refusing absolute link {member.name!r} -> {member.linkname!r}")
+        base = os.path.dirname(member.name) if member.issym() else ""
+        target = os.path.realpath(os.path.join(dest_dir, base, member.linkname))
+        if os.path.commonpath([target, os.path.realpath(dest_dir)]) != os.path.realpath(dest_dir):
+            raise ValueError(f"Refusing link {member.name!r} outside {dest_dir}")
+    elif not (member.isreg() or member.isdir()):
+        raise ValueError(f"Refusing to extract special file {member.name!r}")
+    tar.extract(member, dest_dir, set_attrs=not member.isdir())
+
+
+def extract_tar_stream(fileobj, dest_dir: str, workers: int = None, select=None, blobs=None) -> dict:
+    """
+    Extract an uncompressed tar stream with parallel file writes.
+    
+    Members are read in order from the stream; file bodies are written by
+    a pool of `workers` threads (FLYTE_EXTRACT_WORKERS, defaults to twice
+    the CPU count, at most 16) with at most 64 MiB queued. Each directory is
+    created once. Only the metadata the task can observe is applied: file
+    modes, passed straight to open() so no chmod is needed under the usual
+    umask. Ownership and modification times are not restored.
+    
+    File contents and modes match tarfile's extractall(filter='data'); so
+    does path safety: leading slashes are stripped and '..' components
+    rejected. Links and anything after the first link are handed to
+    tarfile itself, since a link can redirect later paths.
+    
+    With `select` (see distribution_member_filter), members whose relative
+    path it rejects are skipped (directories still come with their files).
+    
+    With a BlobStore `blobs`, every file is hashed as it is written and
+    added to the store; one whose content the store already has is
+    hardlinked from it instead of written.
+    
+    Returns:
+        dict: {"files", "dirs", "links", "bytes", "skipped", "workers"},
+        plus "deduplicated_bytes" with `blobs`
+    """
+    import tarfile
+    from concurrent.futures import ThreadPoolExecutor
+    
+    if workers is None:
+        workers = int(os.environ.get("FLYTE_EXTRACT_WORKERS") or min(16, 2 * (os.cpu_count() or 1)))
+    dest_dir = os.path.abspath(dest_dir)
+    os.makedirs(dest_dir, exist_ok=True)
+    umask = _current_umask()
+    budget = threading.Condition()
+    queued = [0]
+    created_dirs = {dest_dir}
+    pending = {}
+    stats = {"files": 0, "dirs": 0, "links": 0, "bytes": 0, "skipped": 0, "workers": workers}
+    if blobs is not None:
+        stats["deduplicated_bytes"] = 0
+    
+    def ensure_dir(path):
+        if path not in created_dirs:
+            os.makedirs(path, exist_ok=True)
+            while path not in created_dirs:
+                created_dirs.add(path)
+                path = os.path.dirname(path)
+    
+    def write(path, data, mode):
+        saved = 0
+        try:
+            if blobs is None:
+                _write_file(path, data, mode, umask)
+            else:
+                digest = hashlib.sha256(data).hexdigest()
+                if blobs.place(digest, mode, path):
+                    saved = len(data)
+                else:
+                    _write_file(path, data, mode, umask)
+                    saved = blobs.ingest(path, digest)
+        finally:
+            with budget:
+                queued[0] -= len(data)
+                if saved:
+                    stats["deduplicated_bytes"] += saved
+                budget.notify_all()
+    
+    def drain():
+        for future in pending.values():
+            future.result()
+        pending.clear()
+    
+    with tarfile.open(fileobj=fileobj, mode='r|') as tar, \
+            ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="flyte-extract") as executor:
+        stdlib = False
+        for member in tar:
+            if select is not None and not select(_member_relpath(member.name)):
+                stats["skipped"] += 1
+                continue
+            if stdlib or not (member.isreg() or member.isdir()):
+                # Links may point elsewhere in the tree; from here on let
+                # tarfile resolve every path
+                drain()
+                stdlib = True
+                stats["links"] += member.issym() or member.islnk()
+                _extract_member_stdlib(tar, member, dest_dir)
+                if blobs is not None and member.isreg():
+                    stats["deduplicated_bytes"] += blobs.ingest(_safe_member_path(dest_dir, member.name))
+                continue
+            path = _safe_member_path(dest_dir, member.name)
+            if path is None:
+                continue
+            if member.isdir():
+                ensure_dir(path)
+                stats["dirs"] += 1
+                continue
+            
+            ensure_dir(os.path.dirname(path))
+            if path in pending:
+                pending.pop(path).result()
+            mode = _data_file_mode(member.mode)
+            source = tar.extractfile(member)
+            if member.size > _MAX_QUEUED_FILE:
+                digest = hashlib.sha256()
+                with open(path, "wb") as f:
+                    for chunk in iter(lambda: source.read(1 << 20), b""):
+                        f.write(chunk)
+                        if blobs is not None:
+                            digest.update(chunk)
+                os.chmod(path, mode)
+                if blobs is not None:
+                    # Too big to hold until hashed: written, then swapped
+                    # for the stored copy if there is one
+                    stats["deduplicated_bytes"] += blobs.ingest(path, digest.hexdigest())
+            else:
+                data = source.read()
+                with budget:
+                    while queued[0] and queued[0] + len(data) > 64 << 20:
+                        budget.wait()
+                    queued[0] += len(data)
+                pending[path] = executor.submit(write, path, data, mode)
+            stats["files"] += 1
+            stats["bytes"] += member.size
+        drain()
+    return stats
+
+
+def extract_distribution_stream(raw, dest_dir: str, select=None, blobs=None) -> str:
+    """
+    Extract a (compressed) tar stream into dest_dir.
+    
+    Uses extract_tar_stream(); FLYTE_EXTRACT_WORKERS=0 falls back to
+    tarfile's extractall. `select` limits which files are extracted (see
+    distribution_member_filter); files are added to the BlobStore `blobs`,
+    if given.
+    
+    Returns:
+        str: Detected format
+    """
+    import tarfile
+    
+    stream, fmt = open_decompressed(raw)
+    try:
+        if os.environ.get("FLYTE_EXTRACT_WORKERS") == "0":
+            with tarfile.open(fileobj=stream, mode='r|') as tar:
+                members = tar if select is None else (m for m in tar if select(_member_relpath(m.name)))
+                tar.extractall(path=dest_dir, members=members)
+            if blobs is not None:
+                STARTUP_PROFILE.record("distribution_blobs", blobs.ingest_tree(dest_dir))
+        else:
+            STARTUP_PROFILE.record(
+                "distribution_extract", extract_tar_stream(stream, dest_dir, select=select, blobs=blobs)
+            )
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+    STARTUP_PROFILE.record("distribution_format", fmt)
+    return fmt
+
+
+# Kernel-side copy used by extract_indexed_tar, degraded on the first
+# failure the kernel or filesystem reports as unsupported
+_COPY_METHODS = ("copy_file_range", "sendfile", "mmap")
+_copy_method = [_COPY_METHODS[0] if hasattr(os, "copy_file_range") else "sendfile"]
+
+
+def _copy_archive_range(src_fd: int, dst_fd: int, offset: int, size: int, view: memoryview):
+    """Copy `size` bytes at `offset` of the archive into dst_fd's position."""
+    import errno
+    
+    done = 0
+    while done < size:
+        method = _copy_method[0]
+        try:
+            if method == "copy_file_range":
+                copied = os.copy_file_range(src_fd, dst_fd, size - done, offset + done)
+            elif method == "sendfile":
+                copied = os.sendfile(dst_fd, src_fd, offset + done, size - done)
+            else:
+                copied = os.write(dst_fd, view[offset + done:offset + size])
+        except OSError as e:
+            if method == "mmap" or e.errno not in (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+            _copy_method[0] = _COPY_METHODS[_COPY_METHODS.index(method) + 1]
+            continue
+        if not copied:
+            raise EOFError(f"Archive truncated at offset {offset + done}")
+        done += copied
+
+
+def extract_indexed_tar(path: str, dest_dir: str, workers: int = None, select=None, blobs=None) -> dict:
+    """
+    Extract a local uncompressed tar without reading file bodies in Python.
+    
+    The archive is memory-mapped and indexed by reading its headers only
+    (tarfile seeks over the bodies). Each regular file is then created
+    with its mode and filled by os.copy_file_range from the archive's
+    data offset, so the bytes stay in the kernel (or share extents on
+    filesystems that support it); os.sendfile and writes from the mapping
+    are the fallbacks. Files are copied by `workers` threads (defaults as
+    in extract_tar_stream).
+    
+    Contents, modes, path safety, `select`, `blobs` (files are hashed from
+    the mapping) and the handling of links (the first link and everything
+    after it go through tarfile) are the same as extract_tar_stream's.
+    
+    Returns:
+        dict: {"files", "dirs", "links", "bytes", "skipped", "workers", "copy"},
+        plus "deduplicated_bytes" with `blobs`
+    """
+    import mmap
+    import tarfile
+    from concurrent.futures import ThreadPoolExecutor
+    
+    if workers is None:
+        workers = int(os.environ.get("FLYTE_EXTRACT_WORKERS") or min(16, 2 * (os.cpu_count() or 1)))
+    dest_dir = os.path.abspath(dest_dir)
+    os.makedirs(dest_dir, exist_ok=True)
+    umask = _current_umask()
+    stats = {"files": 0, "dirs": 0, "links": 0, "bytes": 0, "skipped": 0, "workers": workers}
+    
+    with open(path, "rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            raise ValueError(f"Empty distribution archive: {path}")
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        try:
+            with tarfile.open(fileobj=mapped, mode="r:") as tar:
+                members = tar.getmembers()
+                # Later members replace earlier ones of the same name
+                files, dirs, rest = {}, set(), []
+                for index, member in enumerate(members):
+                    if select is not None and not select(_member_relpath(member.name)):
+                        stats["skipped"] += 1
+                        continue
+                    if not (member.isreg() or member.isdir()):
+                        rest = [m for m in members[index:] if select is None or select(_member_relpath(m.name))]
+                        stats["skipped"] += len(members) - index - len(rest)
+                        break
+                    target = _safe_member_path(dest_dir, member.name)
+                    if target is None:
+                        continue
+                    if member.isdir():
+                        dirs.add(target)
+                        stats["dirs"] += 1
+                    else:
+                        files.pop(target, None)
+                        files[target] = member
+                
+                for directory in sorted(dirs | {os.path.dirname(target) for target in files}):
+                    os.makedirs(directory, exist_ok=True)
+                
+                def copy(target, member):
+                    mode = _data_file_mode(member.mode)
+                    if blobs is not None:
+                        body = view[member.offset_data:member.offset_data + member.size]
+                        try:
+                            digest = hashlib.sha256(body).hexdigest()
+                        finally:
+                            body.release()
+                        if blobs.place(digest, mode, target):
+                            return member.size
+                    fd = _create_file(target, mode)
+                    try:
+                        _copy_archive_range(f.fileno(), fd, member.offset_data, member.size, view)
+                        if umask is None or mode & umask:
+                            os.fchmod(fd, mode)
+                    finally:
+                        os.close(fd)
+                    return blobs.ingest(target, digest) if blobs is not None else 0
+                
+                with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="flyte-extract") as executor:
+                    saved = sum(future.result() for future in
+                                [executor.submit(copy, target, member) for target, member in files.items()])
+                stats["files"] = len(files)
+                stats["bytes"] = sum(member.size for member in files.values())
+                
+                # Links may point elsewhere in the tree; from here on let
+                # tarfile resolve every path
+                for member in rest:
+                    stats["links"] += member.issym() or member.islnk()
+                    _extract_member_stdlib(tar, member, dest_dir)
+                    if blobs is not None and member.isreg():
+                        saved += blobs.ingest(_safe_member_path(dest_dir, member.name))
+                if blobs is not None:
+                    stats["deduplicated_bytes"] = saved
+        finally:
+            view.release()
+            mapped.close()
+    stats["copy"] = _copy_method[0]
+    return stats
+
+
+def extract_distribution_file(path: str, dest_dir: str, select=None, blobs=None) -> str:
+    """
+    Extract a downloaded distribution file into dest_dir.
+    
+    Uncompressed tars are extracted with extract_indexed_tar(), anything
+    else as a stream (see extract_distribution_stream). Files are added to
+    the BlobStore `blobs`, if given.
+    
+    Returns:
+        str: Detected format
+    """
+    with open(path, "rb") as f:
+        head = f.read(512)
+        if head[257:262] != b"ustar" or os.environ.get("FLYTE_EXTRACT_WORKERS") == "0":
+            f.seek(0)
+            return extract_distribution_stream(f, dest_dir, select=select, blobs=blobs)
+    STARTUP_PROFILE.record("distribution_extract", extract_indexed_tar(path, dest_dir, select=select, blobs=blobs))
+    STARTUP_PROFILE.record("distribution_format", "tar")
+    return "tar"
+
+
+# =============================================================================
+# INTEGRITY
+# =============================================================================
+
+# Expected digest per distribution, so object metadata is read only once
+_EXPECTED_DIGESTS = {}
+
+
+def expected_distribution_digest(additional_distribution: str) -> str:
+    """
+    The SHA-256 a distribution must have, if one is known.
+    
+    FLYTE_DISTRIBUTION_VERIFY selects the sources:
+        auto:     FLYTE_DISTRIBUTION_SHA256 (--flyte-distribution-sha256),
+                  if given (default)
+        metadata: as 'auto', else the 'sha256' user metadata of the S3
+                  object (x-amz-meta-sha256)
+        require:  as 'metadata', and fail if neither provides a digest
+        off:      no verification
+    
+    Returns:
+        str: Lowercase hex digest, or None
+    """
+    mode = os.environ.get("FLYTE_DISTRIBUTION_VERIFY", "auto")
+    if mode == "off":
+        return None
+    if mode not in ("auto", "metadata", "require"):
+        raise ValueError(f"Unknown FLYTE_DISTRIBUTION_VERIFY mode: {mode}")
+    if additional_distribution in _EXPECTED_DIGESTS:
+        return _EXPECTED_DIGESTS[additional_distribution]
+    
+    digest, source = os.environ.get("FLYTE_DISTRIBUTION_SHA256"), "argv"
+    if not digest and mode in ("metadata", "require"):
+        import fsspec
+        
+        try:
+            metadata = fsspec.filesystem('s3').metadata(additional_distribution.replace('s3://', ''))
+        except Exception as e:
+            print(f"[Flyte] WARNING: Could not read metadata of {additional_distribution}: {e}")
+            metadata = {}
+        digest, source = metadata.get("sha256"), "metadata"
+    if not digest:
+        if mode == "require":
+            raise ValueError(f"No expected SHA-256 for distribution {additional_distribution}")
+        digest = None
+    else:
+        digest = digest.strip().lower().removeprefix("sha256:")
+        print(f"[Flyte] Expecting distribution sha256 {digest[:12]} (from {source})")
+        STARTUP_PROFILE.record("distribution_expected_sha256", {"digest": digest, "source": source})
+    _EXPECTED_DIGESTS[additional_distribution] = digest
+    return digest
+
+
+def verify_distribution_digest(additional_distribution: str, actual: str):
+    """
+    Check a downloaded distribution against its expected digest.
+    
+    The digest is computed while the distribution streams through
+    extraction, so this runs before anything from it is imported.
+    
+    Raises:
+        ValueError: If the digest doesn't match
+    """
+    expected = expected_distribution_digest(additional_distribution)
+    if expected is None:
+        return
+    ok = actual == expected
+    STARTUP_PROFILE.record("distribution_verified", ok)
+    if not ok:
+        raise ValueError(
+            f"Distribution {additional_distribution} failed verification: "
+            f"sha256 {actual}, expected {expected}"
+        )
+    print(f"[Flyte] Verified distribution sha256 {actual[:12]}")
+
+
+# =============================================================================
+# HEDGED FETCH
+# =============================================================================
+
+
+class _FetchCancelled(Exception):
+    """Raised inside a hedged fetch that lost the race."""
+
+
+def _copy_hashed(source, path: str, cancelled: threading.Event = None) -> dict:
+    """Copy a readable into `path`, hashing it; stop early once `cancelled`."""
+    reader = _HashingReader(source)
+    with open(path, 'wb') as f:
+        for chunk in iter(lambda: reader.read(8 << 20), b""):
+            if cancelled is not None and cancelled.is_set():
+                raise _FetchCancelled()
+            f.write(chunk)
+    return {"sha256": reader.sha256.hexdigest(), "bytes": reader.bytes_read}
+
+
+def distribution_sources(additional_distribution: str) -> list:
+    """
+    Where a distribution can be fetched from, in order of preference.
+    
+    Each directory of FLYTE_DISTRIBUTION_MIRRORS (comma-separated; e.g. a
+    Unity Catalog Volume or /dbfs path) mirrors the bucket layout, so
+    s3://bucket/key is looked up as <mirror>/bucket/key. S3 comes last.
+    
+    Returns:
+        list: (name, opener) pairs; opener() returns a readable
+    """
+    s3_key = additional_distribution.replace('s3://', '').lstrip('/')
+    sources = []
+    for mirror in filter(None, (m.strip() for m in os.environ.get("FLYTE_DISTRIBUTION_MIRRORS", "").split(","))):
+        path = os.path.join(mirror, s3_key)
+        sources.append((f"mirror:{mirror}", lambda path=path: open(path, 'rb')))
+    sources.append(("s3", lambda: open_distribution_object(additional_distribution)))
+    return sources
+
+
+def fetch_distribution_hedged(additional_distribution: str, path: str, sources: list = None) -> dict:
+    """
+    Race the sources of a distribution and keep the first verified copy.
+    
+    Sources start in order: each one FLYTE_DISTRIBUTION_HEDGE_S seconds
+    (defaults to 2; a comma-separated list sets a delay per source) after
+    the previous one, or as soon as the previous one fails. Each copies the
+    object to its own file while hashing it; the first complete copy that
+    matches the expected digest (if one is known, see
+    expected_distribution_digest) is renamed to `path` and the others are
+    cancelled.
+    
+    Returns:
+        dict: {"sha256", "bytes", "source"}
+    """
+    sources = sources or distribution_sources(additional_distribution)
+    delays = [float(d) for d in os.environ.get("FLYTE_DISTRIBUTION_HEDGE_S", "2").split(",")]
+    expected = expected_distribution_digest(additional_distribution)
+    
+    won = threading.Event()
+    cond = threading.Condition()
+    outcomes = [None] * len(sources)
+    report = {}
+    began = time.perf_counter()
+    
+    def run(index, name, opener):
+        part_path = f"{path}.{index}.part"
+        started = time.perf_counter()
+        with cond:
+            report[index] = {"source": name, "started_s": round(started - began, 3), "status": "running"}
+        try:
+            with opener() as source:
+                info = _copy_hashed(source, part_path, won)
+            if expected and info["sha256"] != expected:
+                raise ValueError(f"sha256 {info['sha256']} does not match the expected {expected}")
+            with cond:
+                if won.is_set():
+                    raise _FetchCancelled()
+                os.replace(part_path, path)
+                won.set()
+            outcome = dict(info, source=name)
+        except _FetchCancelled:
+            outcome = "cancelled"
+        except Exception as e:
+            print(f"[Flyte] WARNING: Fetching distribution from {name} failed: {e}")
+            outcome = e
+        finally:
+            if os.path.exists(part_path):
+                os.unlink(part_path)
+        with cond:
+            outcomes[index] = outcome
+            report[index].update(
+                seconds=round(time.perf_counter() - started, 3),
+                status="won" if isinstance(outcome, dict) else "cancelled" if outcome == "cancelled" else "error",
+            )
+            cond.notify_all()
+    
+    for index, (name, opener) in enumerate(sources):
+        threading.Thread(target=run, args=(index, name, opener), name=f"flyte-hedge-{index}", daemon=True).start()
+        if index == len(sources) - 1:
+            break
+        deadline = time.monotonic() + delays[min(index, len(delays) - 1)]
+        with cond:
+            # Start the next source after the hedge delay, or right away
+            # if this one has already failed
+            while not won.is_set() and outcomes[index] is None and time.monotonic() < deadline:
+                cond.wait(deadline - time.monotonic())
+        if won.is_set():
+            break
+    
+    with cond:
+        while not won.is_set() and any(outcome is None for outcome in outcomes[:index + 1]):
+            cond.wait()
+        winner = next((outcome for outcome in outcomes if isinstance(outcome, dict)), None)
+        # Losers still running stop at their next chunk
+        sources_report = [dict(report[i], status="cancelled") if report[i]["status"] == "running" else dict(report[i])
+                          for i in sorted(report)]
+    STARTUP_PROFILE.record("distribution_hedge", {
+        "winner": winner["source"] if winner else None,
+        "sources": sources_report,
+    })
+    if winner is None:
+        errors = [outcome for outcome in outcomes if isinstance(outcome, Exception)]
+        raise errors[-1] if errors else IOError(f"No source could fetch {additional_distribution}")
+    print(f"[Flyte] Fetched distribution from {winner['source']} in {time.perf_counter() - began:.1f}s")
+    return winner
+
+
+def download_distribution_file(additional_distribution: str, path: str) -> dict:
+    """
+    Download a distribution to `path`, hashing it on the way.
+    
+    Races the mirrors and S3 when FLYTE_DISTRIBUTION_MIRRORS is set (see
+    fetch_distribution_hedged), otherwise reads S3 resumably.
+    
+    Returns:
+        dict: {"sha256", "bytes"}
+    """
+    if os.environ.get("FLYTE_DISTRIBUTION_MIRRORS"):
+        return fetch_distribution_hedged(additional_distribution, path)
+    with open_distribution_object(additional_distribution) as source:
+        info = _copy_hashed(source, path)
+    _record_download_stats(source)
+    return info
+
+
+# =============================================================================
+# DOWNLOAD AND EXTRACT
+# =============================================================================
+
+
+def download_and_extract_distribution(additional_distribution: str, dest_dir: str, include: list = None,
+                                      exclude: list = None, needed: set = None, blobs=None) -> dict:
+    """
+    Download and extract the tarball from S3.
+    
+    FLYTE_DISTRIBUTION_DOWNLOAD selects how:
+        tempfile: copy the whole tarball to a temporary file, then extract it
+        stream:   pipe the S3 object straight into a streaming tar reader, so
+                  extraction overlaps the transfer and nothing lands in /tmp
+        ranged:   like 'stream', but the object is fetched as concurrent byte
+                  ranges (see RangedReader) for throughput on large tarballs
+    
+    Zip distributions (*.zip) are not extracted: the archive is saved as
+    dest_dir/ZIP_DISTRIBUTION_NAME and imported from directly (see
+    mount_zip_distribution).
+    
+    With FLYTE_DISTRIBUTION_MIRRORS set, the mirrors and S3 are raced for a
+    complete copy (see fetch_distribution_hedged), which implies 'tempfile'.
+    
+    In every mode the SHA-256 is computed as the bytes are consumed and
+    checked against the expected digest, if any (see
+    expected_distribution_digest).
+    
+    Only the files selected by the `include` / `exclude` globs are
+    extracted (see distribution_member_filter; None reads them from the
+    environment, [] extracts everything). With a `needed` set of relative
+    paths, which implies 'tempfile', only the needed files and Python
+    modules are extracted and the downloaded archive is kept for the rest
+    (see LazyExtraction).
+    
+    With a BlobStore `blobs`, extracted files are added to it as they are
+    written (see extract_tar_stream).
+    
+    Returns:
+        dict: {"sha256": hex digest of the tarball, "bytes": tarball size},
+        plus "deferred": {"archive", "names"} when files were left for later
+    """
+    mode = os.environ.get("FLYTE_DISTRIBUTION_DOWNLOAD", "tempfile")
+    os.makedirs(dest_dir, exist_ok=True)
+    select = distribution_member_filter(include, exclude)
+    
+    if additional_distribution.endswith(".zip"):
+        info = _download_zip_distribution(additional_distribution, dest_dir)
+        if blobs is not None:
+            blobs.ingest(os.path.join(dest_dir, ZIP_DISTRIBUTION_NAME), info["sha256"])
+    elif mode in ("stream", "ranged") and not os.environ.get("FLYTE_DISTRIBUTION_MIRRORS") and needed is None:
+        info = stream_and_extract_distribution(additional_distribution, dest_dir, ranged=mode == "ranged",
+                                               select=select, blobs=blobs)
+    elif mode in ("tempfile", "stream", "ranged"):
+        info = _download_tempfile_and_extract(additional_distribution, dest_dir, select=select, needed=needed,
+                                              blobs=blobs)
+    else:
+        raise ValueError(f"Unknown FLYTE_DISTRIBUTION_DOWNLOAD mode: {mode}")
+    verify_distribution_digest(additional_distribution, info["sha256"])
+    return info
+
+
+def _download_tempfile_and_extract(additional_distribution: str, dest_dir: str, select=None,
+                                   needed: set = None, blobs=None) -> dict:
+    """
+    Download the tarball to a temporary file (resumably), then extract it.
+    
+    Selected files outside `needed`, other than Python modules (sources,
+    bytecode and extension modules), are deferred: their names are returned
+    along with the temporary file, which is then left for the caller.
+    """
+    import tempfile
+    
+    with tempfile.NamedTemporaryFile(suffix='.tar.gz', delete=False) as tmp:
+        tmp_path = tmp.name
+    
+    try:
+        print(f"[Flyte] Downloading: {additional_distribution.replace('s3://', '')}")
+        # Hashed while downloading rather than in a separate pass
+        info = download_distribution_file(additional_distribution, tmp_path)
+        print(f"[Flyte] Downloaded to: {tmp_path}")
+        
+        deferred = []
+        if needed is None:
+            eager = select
+        else:
+            from importlib.machinery import all_suffixes
+            
+            # Imports aren't all seen by the trace (extension modules are
+            # dlopen()ed without an open event), so modules are never deferred
+            module_suffixes = tuple(all_suffixes())
+            
+            def eager(relpath):
+                if select is not None and not select(relpath):
+                    return False
+                if relpath in needed or relpath.endswith(module_suffixes):
+                    return True
+                deferred.append(relpath)
+                return False
+        
+        fmt = extract_distribution_file(tmp_path, dest_dir, select=eager, blobs=blobs)
+        print(f"[Flyte] Extracted {fmt} distribution to: {dest_dir}"
+              + (f" ({len(deferred)} files deferred)" if deferred else ""))
+        if deferred:
+            info["deferred"] = {"archive": tmp_path, "names": deferred}
+            tmp_path = None
+        return info
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def stream_and_extract_distribution(additional_distribution: str, dest_dir: str, ranged: bool = False,
+                                    select=None, blobs=None) -> dict:
+    """
+    Extract the tarball while it downloads, without a temporary file.
+    
+    The S3 object is read on a background thread and fed to tarfile's stream
+    reader (see extract_distribution_stream), so only the extracted tree hits
+    disk, in reads of FLYTE_DISTRIBUTION_CHUNK_MB (defaults to 8).
+    
+    With ranged=True the object is fetched as parallel byte ranges of
+    FLYTE_DISTRIBUTION_PART_MB (defaults to 16) with up to
+    FLYTE_DISTRIBUTION_CONCURRENCY requests in flight (defaults to 8),
+    reassembled in order before extraction. Either way, failed ranges are
+    retried and resumed (see DownloadRetry).
+    """
+    chunk_size = int(float(os.environ.get("FLYTE_DISTRIBUTION_CHUNK_MB", "8")) * (1 << 20))
+    s3_path = additional_distribution.replace('s3://', '')
+    
+    concurrency = int(os.environ.get("FLYTE_DISTRIBUTION_CONCURRENCY", "8")) if ranged else 1
+    source = open_distribution_object(additional_distribution, concurrency)
+    if ranged:
+        print(f"[Flyte] Streaming {source.size / (1 << 20):.1f} MiB in "
+              f"{source.retry.part_size >> 20} MiB ranges x{concurrency}: {s3_path}")
+    else:
+        print(f"[Flyte] Streaming: {s3_path}")
+    
+    start = time.perf_counter()
+    with source as raw:
+        with _BackgroundReader(raw, chunk_size=chunk_size) as reader:
+            extract_distribution_stream(reader, dest_dir, select=select, blobs=blobs)
+            # Drain trailing padding so the reported size is the object size
+            while reader.read(chunk_size):
+                pass
+    elapsed = time.perf_counter() - start
+    
+    size_mb = reader.bytes_read / (1 << 20)
+    print(f"[Flyte] Streamed {size_mb:.1f} MiB and extracted to: {dest_dir} in {elapsed:.1f}s")
+    stats = {
+        "bytes": reader.bytes_read,
+        "seconds": round(elapsed, 3),
+        "mib_per_s": round(size_mb / elapsed, 2) if elapsed else None,
+    }
+    if ranged:
+        stats["parts"] = sorted(source.part_stats, key=lambda part: part["part"])
+    STARTUP_PROFILE.record("distribution_stream", stats)
+    _record_download_stats(source)
+    return {"sha256": reader.sha256.hexdigest(), "bytes": reader.bytes_read}
+
+
+# =============================================================================
+# ZIP DISTRIBUTIONS
+# =============================================================================
+
+# File name of a zip distribution inside its destination / cache tree
+ZIP_DISTRIBUTION_NAME = "distribution.zip"
+
+# Members that zipimport can import straight from the archive
+_ZIP_IMPORTABLE_SUFFIXES = (".py", ".pyc")
+
+
+def _download_zip_distribution(additional_distribution: str, dest_dir: str) -> dict:
+    """Download a zip distribution as dest_dir/ZIP_DISTRIBUTION_NAME, unextracted."""
+    import shutil
+    
+    zip_path = os.path.join(dest_dir, ZIP_DISTRIBUTION_NAME)
+    # Packages extracted from an earlier zip (see ZipDistributionFinder)
+    shutil.rmtree(f"{zip_path}.data", ignore_errors=True)
+    print(f"[Flyte] Downloading zip distribution: {additional_distribution.replace('s3://', '')}")
+    # Hash while downloading; a zip needs random access, so it can't stream
+    info = download_distribution_file(additional_distribution, zip_path)
+    STARTUP_PROFILE.record("distribution_format", "zip")
+    return info
+
+
+class ZipDistributionFinder:
+    """
+    Meta path finder for top-level packages of a zip distribution that ship
+    non-importable files (data files, extension modules).
+    
+    zipimport serves pure-Python packages straight from the archive, but code
+    that opens files relative to __file__ or loads a .so can't work from
+    inside a zip. On first import of such a package, this finder extracts
+    that package alone into `data_dir` and imports it from there, so its
+    __file__ and data files are real paths. Everything else stays zipped.
+    """
+    
+    def __init__(self, zip_path: str, data_dir: str):
+        import zipfile
+        
+        self.zip_path = zip_path
+        self.data_dir = data_dir
+        self._lock = threading.Lock()
+        self._extracted = set()
+        self.packages = {}
+        with zipfile.ZipFile(zip_path) as archive:
+            for name in archive.namelist():
+                package, sep, rest = name.partition("/")
+                if sep and rest and not rest.endswith("/"):
+                    self.packages.setdefault(package, []).append(name)
+        self.data_packages = {
+            package for package, names in self.packages.items()
+            if any(not name.endswith(_ZIP_IMPORTABLE_SUFFIXES) for name in names)
+        }
+    
+    def find_spec(self, fullname, path=None, target=None):
+        if path is not None or fullname not in self.data_packages:
+            return None
+        from importlib.machinery import PathFinder
+        
+        self.extract(fullname)
+        return PathFinder.find_spec(fullname, [self.data_dir])
+    
+    def extract(self, package: str):
+        """Extract one top-level package of the archive into data_dir."""
+        import zipfile
+        
+        with self._lock:
+            if package in self._extracted:
+                return
+            start = time.perf_counter()
+            with zipfile.ZipFile(self.zip_path) as archive:
+                archive.extractall(self.data_dir, members=self.packages[package])
+            self._extracted.add(package)
+            print(f"[Flyte] Extracted package '{package}' from zip distribution "
+                  f"({len(self.packages[package])} files, {time.perf_counter() - start:.2f}s)")
+
+
+def mount_zip_distribution(zip_path: str) -> str:
+    """
+    Put a zip distribution on sys.path without extracting it.
+    
+    Modules are imported with zipimport (precompiled .pyc members are used
+    as is); packages that need real files are extracted on first import by a
+    ZipDistributionFinder, into '<zip>.data' next to the archive.
+    
+    Returns:
+        str: The sys.path entry (the zip itself)
+    """
+    finder = ZipDistributionFinder(zip_path, f"{zip_path}.data")
+    if finder.data_packages:
+        sys.meta_path.insert(0, finder)
+    if zip_path not in sys.path:
+        sys.path.insert(0, zip_path)
+    print(f"[Flyte] Importing from zip distribution: {zip_path}"
+          f" (extract on import: {sorted(finder.data_packages) or 'none'})")
+    return zip_path
+
+
+# =============================================================================
+# DELTA DISTRIBUTIONS
+# =============================================================================
+
+# Manifest published next to a distribution: '<distribution>.manifest.json'
+DISTRIBUTION_MANIFEST_SUFFIX = ".manifest.json"
+
+# Copy of the manifest that describes an extracted dest dir
+LOCAL_MANIFEST_NAME = ".flyte-manifest.json"
+
+# Manifest entry fields that describe a file's content; where it sits in the
+# archive ('offset') or when it was written ('mtime') doesn't change it
+_MANIFEST_CONTENT_FIELDS = ("sha256", "mode", "link")
+
+
+def fetch_distribution_manifest(additional_distribution: str) -> dict:
+    """
+    Read the optional manifest published next to a distribution.
+    
+    The manifest describes every file of the distribution, so a tree
+    extracted from an earlier version can be patched instead of replaced:
+    
+        {
+            "version": 1,
+            "sha256": "<sha256 of the tarball>",          (optional)
+            "blobs": "s3://bucket/prefix/blobs",          (optional)
+            "archive": "s3://bucket/prefix/src.tar",      (optional)
+            "files": {
+                "pkg/mod.py": {"sha256": "...", "size": 812, "mode": 420,
+                               "offset": 10240},
+                "pkg/link": {"link": "mod.py"}
+            }
+        }
+    
+    Changed files are fetched either as objects named by their SHA-256 under
+    `blobs`, or as byte ranges at `offset` of the uncompressed tar `archive`
+    (defaults to the distribution itself). Relative locations are resolved
+    against the manifest's directory.
+    
+    Returns:
+        dict: The manifest, or None if there is none (or it is unusable)
+    """
+    import fsspec
+    
+    fs = fsspec.filesystem('s3')
+    manifest_path = additional_distribution.replace('s3://', '') + DISTRIBUTION_MANIFEST_SUFFIX
+    try:
+        manifest = json.loads(fs.cat_file(manifest_path))
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"[Flyte] WARNING: Could not read distribution manifest {manifest_path}: {e}")
+        return None
+    
+    files = manifest.get("files") if isinstance(manifest, dict) else None
+    if manifest.get("version") != 1 or not isinstance(files, dict):
+        print(f"[Flyte] WARNING: Ignoring unsupported distribution manifest {manifest_path}")
+        return None
+    for name, entry in files.items():
+        parts = Path(name).parts
+        if not parts or os.path.isabs(name) or ".." in parts:
+            print(f"[Flyte] WARNING: Ignoring distribution manifest with unsafe path: {name!r}")
+            return None
+        link = entry.get("link") if isinstance(entry, dict) else None
+        if link is not None and not _link_stays_inside(os.path.dirname(name), link):
+            print(f"[Flyte] WARNING: Ignoring distribution manifest with unsafe link: {name!r} -> {link!r}")
+            return None
+    
+    manifest_dir = manifest_path.rsplit("/", 1)[0]
+    for key in ("blobs", "archive"):
+        location = manifest.get(key)
+        if location and "://" not in location and not location.startswith("/"):
+            manifest[key] = f"{manifest_dir}/{location}"
+    if "archive" not in manifest:
+        manifest["archive"] = additional_distribution
+    return manifest
+
+
+def manifest_digest(manifest: dict) -> str:
+    """Digest identifying the content a manifest describes."""
+    if manifest.get("sha256"):
+        return manifest["sha256"]
+    canonical = json.dumps(manifest["files"], sort_keys=True, separators=(",", ":"))
+    return "m" + hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def plan_distribution_delta(manifest: dict, base_files: dict) -> dict:
+    """
+    Diff a manifest against the manifest of an already extracted tree.
+    
+    Files are unchanged when their _MANIFEST_CONTENT_FIELDS match, so a
+    file whose archive offset moved is not fetched again.
+    
+    Returns None if a full download is the better choice: no base tree,
+    changed files that can't be fetched individually, or more than
+    FLYTE_DISTRIBUTION_DELTA_MAX_FRACTION (defaults to 0.5) of the bytes
+    changed.
+    
+    Returns:
+        dict: {"changed", "removed", "unchanged": lists of paths,
+        "fetch_bytes", "reuse_bytes"}
+    """
+    if not base_files:
+        return None
+    files = manifest["files"]
+    changed, unchanged = [], []
+    fetch_bytes = reuse_bytes = 0
+    for name, entry in files.items():
+        base = base_files.get(name)
+        if base is not None and all(base.get(key) == entry.get(key) for key in _MANIFEST_CONTENT_FIELDS):
+            unchanged.append(name)
+            reuse_bytes += entry.get("size", 0)
+            continue
+        if "link" not in entry:
+            if "sha256" not in entry or not (manifest.get("blobs") or "offset" in entry):
+                return None
+            fetch_bytes += entry.get("size", 0)
+        changed.append(name)
+    removed = [name for name in base_files if name not in files]
+    
+    max_fraction = float(os.environ.get("FLYTE_DISTRIBUTION_DELTA_MAX_FRACTION", "0.5"))
+    if fetch_bytes > max_fraction * (fetch_bytes + reuse_bytes):
+        return None
+    return {
+        "changed": changed,
+        "removed": removed,
+        "unchanged": unchanged,
+        "fetch_bytes": fetch_bytes,
+        "reuse_bytes": reuse_bytes,
+    }
+
+
+def _coalesce_ranges(entries: list, max_gap: int = 256 << 10, max_size: int = 16 << 20) -> list:
+    """
+    Group (name, offset, size) members into runs read with one range request.
+    
+    Members closer than `max_gap` bytes are merged while the run stays below
+    `max_size`, so a handful of changed files costs one or two requests.
+    """
+    runs = []
+    for name, offset, size in sorted(entries, key=lambda entry: entry[1]):
+        if runs:
+            run = runs[-1]
+            if offset - run["end"] <= max_gap and offset + size - run["start"] <= max_size:
+                run["members"].append((name, offset, size))
+                run["end"] = max(run["end"], offset + size)
+                continue
+        runs.append({"start": offset, "end": offset + size, "members": [(name, offset, size)]})
+    return runs
+
+
+def _fetch_changed_files(manifest: dict, names: list) -> dict:
+    """
+    Fetch the content of changed manifest files and verify their SHA-256.
+    
+    Uses the per-file blob store when the manifest has one, else coalesced
+    byte ranges of the uncompressed archive, with up to
+    FLYTE_DISTRIBUTION_CONCURRENCY requests in flight (defaults to 8),
+    retried like any download (see DownloadRetry).
+    
+    Returns:
+        dict: Path -> bytes
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import fsspec
+    
+    fs = fsspec.filesystem('s3')
+    files = manifest["files"]
+    concurrency = int(os.environ.get("FLYTE_DISTRIBUTION_CONCURRENCY", "8"))
+    retry = DownloadRetry(16 << 20, concurrency)
+    
+    def fetch_blob(name):
+        blob = f"{manifest['blobs'].replace('s3://', '').rstrip('/')}/{files[name]['sha256']}"
+        size = files[name].get("size")
+        if not size:
+            return {name: fs.cat_file(blob)}
+        return {name: retry.fetch(lambda start, end: fs.cat_file(blob, start=start, end=end), 0, size)}
+    
+    if manifest.get("blobs"):
+        jobs = [(lambda name=name: fetch_blob(name)) for name in names]
+    else:
+        archive = manifest["archive"].replace('s3://', '')
+        runs = _coalesce_ranges([(name, files[name]["offset"], files[name]["size"]) for name in names])
+        
+        def fetch_run(run):
+            data = retry.fetch(lambda start, end: fs.cat_file(archive, start=start, end=end), run["start"], run["end"])
+            return {
+                name: data[offset - run["start"]:offset - run["start"] + size]
+                for name, offset, size in run["members"]
+            }
+        
+        jobs = [(lambda run=run: fetch_run(run)) for run in runs]
+    
+    content = {}
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="flyte-delta") as executor:
+        for fetched in executor.map(lambda job: job(), jobs):
+            content.update(fetched)
+    for name, data in content.items():
+        if hashlib.sha256(data).hexdigest() != files[name]["sha256"]:
+            raise IOError(f"Checksum mismatch for {name} in delta distribution")
+    return content
+
+
+def _link_stays_inside(directory: str, link: str) -> bool:
+    """Whether a relative symlink in `directory` (relative to the tree) points inside the tree."""
+    return not os.path.isabs(link) and os.path.normpath(os.path.join(directory, link)).split(os.sep)[0] != ".."
+
+
+def _manifest_file_path(tree: str, name: str, entry: dict) -> str:
+    """
+    Where manifest file `name` goes in `tree`, creating its directory.
+    
+    Like tarfile's 'data' filter, refuses paths whose directory resolves
+    outside the tree through symlinks created earlier, and symlinks that
+    would point outside it.
+    """
+    root = os.path.realpath(tree)
+    path = os.path.join(tree, name)
+    parent = os.path.realpath(os.path.dirname(path))
+    if parent != root and not parent.startswith(root + os.sep):
+        raise IOError(f"Refusing to write {name!r} outside {tree} (through a symlink)")
+    if "link" in entry and not _link_stays_inside(os.path.relpath(parent, root), entry["link"]):
+        raise IOError(f"Refusing symlink {name!r} -> {entry['link']!r} pointing outside {tree}")
+    os.makedirs(parent, exist_ok=True)
+    return path
+
+
+def _write_manifest_file(tree: str, name: str, entry: dict, data: bytes = None):
+    """Create one manifest file (or symlink) in `tree`."""
+    path = _manifest_file_path(tree, name, entry)
+    if "link" in entry:
+        os.symlink(entry["link"], path)
+        return
+    with open(path, "wb") as f:
+        f.write(data)
+    os.chmod(path, entry.get("mode", 0o644))
+    if "mtime" in entry:
+        os.utime(path, (entry["mtime"], entry["mtime"]))
+
+
+def apply_distribution_delta(manifest: dict, plan: dict, base_tree: str, dest_tree: str, blobs=None) -> dict:
+    """
+    Build the tree a manifest describes from a base tree plus changed files.
+    
+    Unchanged files are hardlinked (or cloned) from the base tree into
+    dest_tree, a fresh staging dir, and the changed ones are written there;
+    the caller publishes the result. With a BlobStore `blobs`, changed files
+    are added to it under their manifest SHA-256, or linked from it when it
+    already has them.
+    
+    Returns:
+        dict: Delta statistics (also recorded in the startup profile)
+    """
+    start = time.perf_counter()
+    files = manifest["files"]
+    content = _fetch_changed_files(manifest, [name for name in plan["changed"] if "link" not in files[name]])
+    
+    for name in plan["unchanged"]:
+        if "link" in files[name]:
+            _write_manifest_file(dest_tree, name, files[name])
+        else:
+            link_or_clone(os.path.join(base_tree, name), _manifest_file_path(dest_tree, name, files[name]))
+    for name in plan["changed"]:
+        entry = files[name]
+        if blobs is not None and "link" not in entry:
+            path = _manifest_file_path(dest_tree, name, entry)
+            if blobs.place(entry["sha256"], entry.get("mode", 0o644), path):
+                continue
+            _write_manifest_file(dest_tree, name, entry, content.get(name))
+            blobs.ingest(path, entry["sha256"])
+        else:
+            _write_manifest_file(dest_tree, name, entry, content.get(name))
+    
+    stats = {
+        "base": base_tree,
+        "files": len(files),
+        "changed": len(plan["changed"]),
+        "removed": len(plan["removed"]),
+        "bytes_fetched": sum(len(data) for data in content.values()),
+        "bytes_reused": plan["reuse_bytes"],
+        "source": "blobs" if manifest.get("blobs") else "archive",
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+    print(f"[Flyte] Applied delta distribution: {stats['changed']} changed, {stats['removed']} removed, "
+          f"{stats['bytes_fetched'] / (1 << 20):.1f} MiB fetched in {stats['seconds']:.1f}s")
+    STARTUP_PROFILE.record("distribution_delta", stats)
+    return stats
+
+
+def download_or_patch_distribution(additional_distribution: str, dest_dir: str, needed: set = None,
+                                   base_dir: str = None) -> dict:
+    """
+    Bring dest_dir up to date with a distribution.
+    
+    With FLYTE_DISTRIBUTION_DELTA enabled and a manifest published next to
+    the distribution, `base_dir`, a tree extracted from an earlier version
+    (and described by its LOCAL_MANIFEST_NAME), is patched into dest_dir, an
+    empty staging dir, with just the changed files. Otherwise the
+    distribution is downloaded and extracted in full.
+    
+    The local manifest is written last, once dest_dir is complete. A tree
+    left incomplete by FLYTE_DISTRIBUTION_INCLUDE /
+    FLYTE_DISTRIBUTION_EXCLUDE gets none; one whose files were deferred (see
+    download_and_extract_distribution) gets it as a "deferred" "finish"
+    file, to be written once they are extracted.
+    
+    Returns:
+        dict: {"sha256": tarball digest (None for a patched tree), "bytes":
+        bytes downloaded}
+    """
+    manifest = None
+    if _env_flag("FLYTE_DISTRIBUTION_DELTA", False) and not additional_distribution.endswith(".zip"):
+        manifest = fetch_distribution_manifest(additional_distribution)
+        expected = expected_distribution_digest(additional_distribution)
+        if manifest and expected and manifest.get("sha256") != expected:
+            # Patched trees are only verified file by file against the
+            # manifest, so it must vouch for the expected tarball
+            manifest = None
+    if manifest is None:
+        return download_and_extract_distribution(additional_distribution, dest_dir, needed=needed)
+    
+    local_manifest = os.path.join(dest_dir, LOCAL_MANIFEST_NAME)
+    base = _read_json(os.path.join(base_dir, LOCAL_MANIFEST_NAME), {}) if base_dir else {}
+    plan = plan_distribution_delta(manifest, base.get("files"))
+    if plan is not None:
+        stats = apply_distribution_delta(manifest, plan, base_dir, dest_dir)
+        info = {"sha256": manifest.get("sha256"), "bytes": stats["bytes_fetched"]}
+    else:
+        info = download_and_extract_distribution(additional_distribution, dest_dir, needed=needed)
+        if distribution_member_filter() is not None:
+            return info
+        if "deferred" in info:
+            info["deferred"]["finish"] = {LOCAL_MANIFEST_NAME: manifest}
+            return info
+    _write_json_atomic(local_manifest, manifest)
+    return info
+
+
+# =============================================================================
+# LAZY EXTRACTION
+# =============================================================================
+
+# Active DistributionAccessTrace and unfinished LazyExtractions, consulted
+# by the process-wide audit hook
+_ACCESS_TRACES = []
+_LAZY_EXTRACTIONS = []
+_AUDIT_HOOK_LOCK = threading.Lock()
+_AUDIT_HOOK_INSTALLED = False
+
+
+# Audit events that list a directory (os.walk, pathlib and glob go through
+# these); the listing waits until the deferred files in it are extracted
+_LISTING_AUDIT_EVENTS = frozenset(("os.listdir", "os.scandir", "glob.glob", "glob.glob/2"))
+
+
+def _glob_root(pattern: str) -> str:
+    """The leading components of a glob pattern that have no wildcards."""
+    import glob
+    
+    parts = pattern.split(os.sep)
+    for i, part in enumerate(parts):
+        if glob.has_magic(part):
+            return os.sep.join(parts[:i]) or ("/" if pattern.startswith(os.sep) else ".")
+    return pattern
+
+
+def _distribution_audit_hook(event: str, args: tuple):
+    """Route file reads to the access traces and pending lazy extractions."""
+    if event == "open":
+        if not (_ACCESS_TRACES or _LAZY_EXTRACTIONS):
+            return
+        path, _, flags = args
+        if not isinstance(path, str) or flags & (os.O_WRONLY | os.O_RDWR):
+            return
+        path = os.path.abspath(path)
+        for lazy in tuple(_LAZY_EXTRACTIONS):
+            lazy.wait_for(path)
+        for trace in tuple(_ACCESS_TRACES):
+            trace.record(path)
+    elif event in _LISTING_AUDIT_EVENTS and _LAZY_EXTRACTIONS:
+        path = args[0] if args[0] is not None else "."
+        if not isinstance(path, str):
+            return
+        if event.startswith("glob."):
+            root_dir = args[2] if event == "glob.glob/2" else None
+            path = _glob_root(path)
+            if isinstance(root_dir, str):
+                path = os.path.join(root_dir, path)
+        path = os.path.abspath(path)
+        for lazy in tuple(_LAZY_EXTRACTIONS):
+            # A glob's literal root may name a deferred file itself
+            lazy.wait_for(path)
+            lazy.wait_for(path, listing=True)
+
+
+def _install_audit_hook():
+    """Install _distribution_audit_hook once (audit hooks can't be removed)."""
+    global _AUDIT_HOOK_INSTALLED
+    
+    with _AUDIT_HOOK_LOCK:
+        if not _AUDIT_HOOK_INSTALLED:
+            sys.addaudithook(_distribution_audit_hook)
+            _AUDIT_HOOK_INSTALLED = True
+
+
+class DistributionAccessTrace:
+    """
+    Record of the distribution files a task reads, kept in
+    FLYTE_DISTRIBUTION_TRACE to decide what the next run extracts first.
+    
+    Reads (module imports included) under the watched trees are recorded
+    through an audit hook and saved at exit, replacing the previous run's
+    set:
+    
+        {"version": 1, "files": ["pkg/__init__.py", "pkg/mod.py", ...]}
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.trees = []
+        self.accessed = set()
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_environment(cls):
+        """The trace configured by FLYTE_DISTRIBUTION_TRACE, or None."""
+        path = os.environ.get("FLYTE_DISTRIBUTION_TRACE")
+        return cls(os.path.abspath(path)) if path else None
+    
+    def needed(self) -> set:
+        """Files read by the previous run, or None if there is no trace."""
+        files = _read_json(self.path, {}).get("files")
+        return set(files) if isinstance(files, list) else None
+    
+    def watch(self, tree: str):
+        """Record reads under `tree` from now on, saving the trace at exit."""
+        import atexit
+        
+        tree = os.path.abspath(tree)
+        with self._lock:
+            if tree in self.trees:
+                return
+            self.trees.append(tree)
+            if self not in _ACCESS_TRACES:
+                _ACCESS_TRACES.append(self)
+                atexit.register(self.save)
+        _install_audit_hook()
+    
+    def record(self, path: str):
+        for tree in self.trees:
+            if path.startswith(tree + os.sep):
+                if f"{os.sep}__pycache__{os.sep}" in path:
+                    # Precompiled modules are imported without reading the source
+                    from importlib.util import source_from_cache
+                    try:
+                        path = source_from_cache(path)
+                    except ValueError:
+                        return
+                self.accessed.add(path[len(tree) + 1:].replace(os.sep, "/"))
+                return
+    
+    def save(self):
+        with self._lock:
+            files = sorted(self.accessed)
+        if not files:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            _write_json_atomic(self.path, {"version": 1, "files": files})
+            print(f"[Flyte] Saved distribution access trace ({len(files)} files): {self.path}")
+        except OSError as e:
+            print(f"[Flyte] WARNING: Could not save distribution access trace {self.path}: {e}")
+
+
+class LazyExtraction:
+    """
+    Background extraction of the distribution files deferred by
+    download_and_extract_distribution.
+    
+    The kept archive is read again on a daemon thread and the deferred
+    files are written into `dest_dir`. Until then, reading one of them
+    (open() or an import, through _distribution_audit_hook and find_spec)
+    blocks until it has been extracted, and so does listing a directory
+    that holds some (os.listdir, os.scandir, glob; so os.walk and pathlib
+    too). Checks that only stat a path (os.path.exists, isfile, getsize)
+    raise no audit event: they see a deferred file as missing until it has
+    been extracted. `on_done(ok)` runs at the end; the archive is deleted.
+    """
+    
+    def __init__(self, archive: str, dest_dir: str, names: list, on_done=None):
+        self.archive = archive
+        self.dest_dir = os.path.abspath(dest_dir)
+        self.pending = {os.path.join(self.dest_dir, name) for name in names}
+        # Directory -> number of pending files anywhere below it
+        self.pending_dirs = {}
+        for path in self.pending:
+            for parent in self._parents(path):
+                self.pending_dirs[parent] = self.pending_dirs.get(parent, 0) + 1
+        self.on_done = on_done
+        self.finished = False
+        self.waited_s = 0.0
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._thread = None
+    
+    def start(self):
+        _install_audit_hook()
+        _LAZY_EXTRACTIONS.append(self)
+        sys.meta_path.insert(0, self)
+        self._thread = threading.Thread(target=self._run, name="flyte-lazy-extract", daemon=True)
+        self._thread.start()
+        print(f"[Flyte] Extracting {len(self.pending)} deferred files in the background")
+        return self
+    
+    def _parents(self, path: str):
+        """Directories from dest_dir down to the one holding `path`."""
+        relpath = os.path.relpath(os.path.dirname(path), self.dest_dir)
+        parent = self.dest_dir
+        yield parent
+        if relpath != os.curdir:
+            for part in relpath.split(os.sep):
+                parent = os.path.join(parent, part)
+                yield parent
+    
+    def wait_for(self, path: str, listing: bool = False):
+        """
+        Block while `path` is a deferred file not extracted yet (with
+        `listing`, a directory holding one).
+        """
+        waiting_on = self.pending_dirs if listing else self.pending
+        if self.finished or path not in waiting_on or threading.current_thread() is self._thread:
+            return
+        if os.getpid() != self._pid:
+            # A forked child (e.g. a compile worker) has no extraction thread
+            return
+        start = time.perf_counter()
+        with self._cond:
+            while path in waiting_on and not self.finished:
+                self._cond.wait()
+            self.waited_s += time.perf_counter() - start
+            STARTUP_PROFILE.record("distribution_lazy_wait_s", round(self.waited_s, 3))
+    
+    def find_spec(self, fullname, path=None, target=None):
+        if self.finished:
+            return None
+        import importlib
+        from importlib.machinery import all_suffixes
+        
+        base = os.path.join(self.dest_dir, *fullname.split("."))
+        candidates = [base + suffix for suffix in all_suffixes()]
+        candidates += [os.path.join(base, "__init__" + suffix) for suffix in all_suffixes()]
+        waited = False
+        for candidate in candidates:
+            if candidate in self.pending:
+                self.wait_for(candidate)
+                waited = True
+        if waited:
+            # Directory listings cached by the path finders predate them
+            importlib.invalidate_caches()
+        return None
+    
+    def wait(self, timeout: float = None) -> bool:
+        """Wait for the background extraction to finish."""
+        self._thread.join(timeout)
+        return self.finished
+    
+    def _run(self):
+        import tarfile
+        
+        start = time.perf_counter()
+        ok = False
+        try:
+            with open(self.archive, "rb") as raw:
+                stream, _ = open_decompressed(raw)
+                try:
+                    with tarfile.open(fileobj=stream, mode="r|") as tar:
+                        for member in tar:
+                            path = _safe_member_path(self.dest_dir, member.name)
+                            if path not in self.pending:
+                                continue
+                            _extract_member_stdlib(tar, member, self.dest_dir)
+                            with self._cond:
+                                self.pending.discard(path)
+                                for parent in self._parents(path):
+                                    self.pending_dirs[parent] -= 1
+                                    if not self.pending_dirs[parent]:
+                                        del self.pending_dirs[parent]
+                                self._cond.notify_all()
+                finally:
+                    close = getattr(stream, "close", None)
+                    if close is not None:
+                        close()
+            ok = True
+            elapsed = time.perf_counter() - start
+            print(f"[Flyte] Deferred distribution files extracted in {elapsed:.1f}s")
+            STARTUP_PROFILE.record("distribution_lazy_extract_s", round(elapsed, 3))
+        except Exception as e:
+            print(f"[Flyte] WARNING: Background extraction of deferred files failed: {e}")
+        finally:
+            with self._cond:
+                self.finished = True
+                self._cond.notify_all()
+            if self in _LAZY_EXTRACTIONS:
+                _LAZY_EXTRACTIONS.remove(self)
+            if self in sys.meta_path:
+                sys.meta_path.remove(self)
+            if os.path.exists(self.archive):
+                os.unlink(self.archive)
+            if self.on_done is not None:
+                self.on_done(ok)
+
+
+# =============================================================================
+# SINGLE-FLIGHT
+# =============================================================================
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def remove_stale_staging(directory: str, prefix: str = "") -> list:
+    """
+    Delete staging dirs left behind by processes that died mid-download.
+    
+    Staging entries are named '<prefix><pid>-...'; those whose pid is no
+    longer running are removed.
+    
+    Returns:
+        list: Names removed
+    """
+    import shutil
+    
+    removed = []
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return removed
+    for name in names:
+        if not name.startswith(prefix):
+            continue
+        pid = name[len(prefix):].split("-", 1)[0]
+        if pid.isdigit() and int(pid) != os.getpid() and not _pid_alive(int(pid)):
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+            removed.append(name)
+    if removed:
+        print(f"[Flyte] Removed {len(removed)} stale staging dir(s) in {directory}")
+    return removed
+
+
+@contextmanager
+def single_flight(key: str, timeout_s: float = None):
+    """
+    Hold a node-wide exclusive lock for `key` while the block runs.
+    
+    Concurrent processes fetching the same distribution take turns: the
+    first one downloads, the others wait and then find its result. The
+    lock is an fcntl.flock on <work dir>/.flyte-cache/locks/<hash>.lock,
+    which the kernel releases when its holder exits, so a crashed holder
+    never blocks anyone. A holder that is alive but keeps the lock past
+    FLYTE_DISTRIBUTION_LOCK_TIMEOUT_S (defaults to 600) is considered hung:
+    the waiter proceeds without the lock.
+    
+    Yields:
+        bool: Whether the lock is held
+    """
+    import fcntl
+    
+    if timeout_s is None:
+        timeout_s = float(os.environ.get("FLYTE_DISTRIBUTION_LOCK_TIMEOUT_S", "600"))
+    work_dir = os.environ.get("FLYTE_INTERNAL_WORK_DIR", "/tmp/flyte")
+    lock_dir = os.path.join(work_dir, ".flyte-cache", "locks")
+    os.makedirs(lock_dir, exist_ok=True)
+    lock_path = os.path.join(lock_dir, hashlib.sha256(key.encode()).hexdigest()[:32] + ".lock")
+    
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+    start = time.perf_counter()
+    held = False
+    try:
+        delay = 0.05
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                held = True
+                break
+            except BlockingIOError:
+                pass
+            waited = time.perf_counter() - start
+            if waited >= timeout_s:
+                holder = os.pread(fd, 256, 0).decode(errors="replace").strip()
+                print(f"[Flyte] WARNING: Lock for {key} still held after {waited:.0f}s ({holder or 'unknown holder'}); "
+                      f"proceeding without it")
+                break
+            if delay == 0.05:
+                print(f"[Flyte] Waiting for another process fetching {key}")
+            time.sleep(delay)
+            delay = min(1.0, delay * 2)
+        if held:
+            os.ftruncate(fd, 0)
+            os.pwrite(fd, f"pid={os.getpid()} since={time.time():.0f}\n".encode(), 0)
+        waited = round(time.perf_counter() - start, 3)
+        if waited >= 0.05:
+            STARTUP_PROFILE.record("distribution_lock", {"key": key, "waited_s": waited, "held": held})
+        yield held
+    finally:
+        if held:
+            os.ftruncate(fd, 0)
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+# Trees this process runs from: real path -> fd of its shared use lock
+_TREES_IN_USE = {}
+
+
+def _tree_lock_fd(tree: str) -> int:
+    """Open the use lock of a tree (in the single_flight lock dir)."""
+    work_dir = os.environ.get("FLYTE_INTERNAL_WORK_DIR", "/tmp/flyte")
+    lock_dir = os.path.join(work_dir, ".flyte-cache", "locks")
+    os.makedirs(lock_dir, exist_ok=True)
+    name = "use-" + hashlib.sha256(os.path.realpath(tree).encode()).hexdigest()[:32] + ".lock"
+    return os.open(os.path.join(lock_dir, name), os.O_RDWR | os.O_CREAT, 0o600)
+
+
+def use_tree(tree: str):
+    """
+    Mark `tree` as in use by this process until it exits.
+    
+    Holds a shared flock that remove_unused_tree() respects, so distribution
+    versions and cache entries aren't deleted under a running task. The
+    kernel drops it when the process exits; a warm server keeps every tree
+    it ran a task from until then.
+    """
+    import fcntl
+    
+    path = os.path.realpath(tree)
+    if path in _TREES_IN_USE:
+        return
+    fd = _tree_lock_fd(path)
+    # Blocks only while a remover holds it (briefly, for a rename)
+    fcntl.flock(fd, fcntl.LOCK_SH)
+    _TREES_IN_USE[path] = fd
+
+
+@contextmanager
+def unused_tree(tree: str):
+    """
+    Keep `tree` from being taken into use while the block runs.
+    
+    Yields:
+        bool: Whether no process uses it (through use_tree()); only then may
+        the block move it out of the way
+    """
+    import fcntl
+    
+    if os.path.realpath(tree) in _TREES_IN_USE:
+        yield False
+        return
+    fd = _tree_lock_fd(tree)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+def remove_unused_tree(tree: str) -> bool:
+    """
+    Delete `tree` unless a process holds it through use_tree().
+    
+    The tree is renamed aside under unused_tree(), so nobody starts using
+    it halfway through, then deleted.
+    
+    Returns:
+        bool: Whether it was removed
+    """
+    import shutil
+    
+    trash = f"{tree}.trash-{os.getpid()}"
+    with unused_tree(tree) as unused:
+        if not unused:
+            return False
+        try:
+            os.rename(tree, trash)
+        except FileNotFoundError:
+            return True
+    shutil.rmtree(trash, ignore_errors=True)
+    return True
+
+
+# Written into a dest dir once a distribution is completely extracted there
+DISTRIBUTION_MARKER_NAME = ".flyte-distribution.json"
+
+# Directory inside the dest dir holding one tree per distribution, with
+# FLYTE_DISTRIBUTION_VERSIONS
+DISTRIBUTION_VERSIONS_DIR = ".flyte-distributions"
+
+
+def _prune_versions(versions: str, keep: str):
+    """Remove the version trees under `versions` other than `keep` that nobody uses."""
+    if not os.path.isdir(versions):
+        return
+    for name in os.listdir(versions):
+        tree = os.path.join(versions, name)
+        if tree != keep and ".staging-" not in name and ".trash-" not in name:
+            remove_unused_tree(tree)
+
+
+def _latest_delta_base(dest_dir: str) -> str:
+    """The most recent complete tree for dest_dir with a local manifest, or None."""
+    versions = os.path.join(dest_dir, DISTRIBUTION_VERSIONS_DIR)
+    trees = [os.path.join(versions, name) for name in os.listdir(versions)] if os.path.isdir(versions) else []
+    trees.append(dest_dir)
+    complete = [
+        tree for tree in trees
+        if os.path.exists(os.path.join(tree, DISTRIBUTION_MARKER_NAME))
+        and os.path.exists(os.path.join(tree, LOCAL_MANIFEST_NAME))
+    ]
+    return max(complete, key=lambda tree: os.path.getmtime(os.path.join(tree, DISTRIBUTION_MARKER_NAME)), default=None)
+
+
+def _move_tree_contents(source: str, target: str):
+    """Rename everything under `source` into `target`, replacing what's there."""
+    import shutil
+    
+    for name in os.listdir(source):
+        src, dst = os.path.join(source, name), os.path.join(target, name)
+        src_dir = os.path.isdir(src) and not os.path.islink(src)
+        dst_dir = os.path.isdir(dst) and not os.path.islink(dst)
+        if src_dir and dst_dir:
+            _move_tree_contents(src, dst)
+            continue
+        if dst_dir:
+            shutil.rmtree(dst)
+        elif src_dir and os.path.lexists(dst):
+            os.unlink(dst)
+        os.replace(src, dst)
+
+
+def _publish_into_dest(staging: str, dest_dir: str):
+    """
+    Move a tree built in `staging` into dest_dir over an earlier one.
+    
+    dest_dir's marker and local manifest are removed first and the new
+    marker is moved in last, so an interrupted update is never reused or
+    taken as a delta base. Every file is renamed into place, so none is seen
+    half-written; files of the earlier distribution that the new one lacks
+    are left, as tarfile's extractall into dest_dir would.
+    """
+    import shutil
+    
+    for name in (DISTRIBUTION_MARKER_NAME, LOCAL_MANIFEST_NAME):
+        try:
+            os.unlink(os.path.join(dest_dir, name))
+        except FileNotFoundError:
+            pass
+    # Packages extracted from an earlier zip (see ZipDistributionFinder)
+    shutil.rmtree(os.path.join(dest_dir, f"{ZIP_DISTRIBUTION_NAME}.data"), ignore_errors=True)
+    marker = os.path.join(staging, DISTRIBUTION_MARKER_NAME)
+    state = _read_json(marker)
+    if state is not None:
+        os.unlink(marker)
+    _move_tree_contents(staging, dest_dir)
+    if state is not None:
+        _write_json_atomic(os.path.join(dest_dir, DISTRIBUTION_MARKER_NAME), state)
+    # Left behind: files already hardlinked into dest_dir (delta updates)
+    shutil.rmtree(staging, ignore_errors=True)
+
+
+def extract_distribution_once(additional_distribution: str, dest_dir: str) -> str:
+    """
+    Extract a distribution into dest_dir unless another process already has.
+    
+    Runs under single_flight() for the dest dir, so concurrent tasks never
+    extract the same tree at the same time. The distribution is built in a
+    staging dir ('.flyte-staging-<pid>-...' inside dest_dir) and then
+    renamed into dest_dir file by file (see _publish_into_dest); with
+    FLYTE_DISTRIBUTION_DELTA, dest_dir's previous version is the base it is
+    patched from. Tasks still running from a previous version in dest_dir
+    see its files replaced.
+    
+    With FLYTE_DISTRIBUTION_VERSIONS, each distribution gets its own tree
+    under dest_dir/DISTRIBUTION_VERSIONS_DIR instead, renamed into place
+    whole and never modified afterwards, so running tasks are unaffected;
+    the task then runs from that tree rather than dest_dir itself. The
+    tree is marked in use (see use_tree) and the other versions nobody uses
+    are removed. With FLYTE_DISTRIBUTION_DELTA, the newest earlier tree is
+    the base the new one is patched from.
+    
+    DISTRIBUTION_MARKER_NAME records which distribution a tree holds (and
+    the FLYTE_DISTRIBUTION_INCLUDE / FLYTE_DISTRIBUTION_EXCLUDE it was
+    extracted with), so the next task for the same distribution reuses it.
+    A waiter that gave up on the lock builds its own staging tree and runs
+    from it unless it can rename it into place as a new version.
+    
+    With a FLYTE_DISTRIBUTION_TRACE from an earlier run, only the files that
+    run read and Python modules are extracted before returning; the rest
+    follow in the background (see LazyExtraction), and the marker is written
+    and the lock released once they are done.
+    
+    Returns:
+        str: The tree holding the distribution
+    """
+    import shutil
+    from contextlib import ExitStack
+    
+    dest_dir = os.path.abspath(dest_dir)
+    trace = DistributionAccessTrace.from_environment()
+    needed = trace.needed() if trace is not None and not additional_distribution.endswith(".zip") else None
+    patterns = None
+    if distribution_member_filter() is not None:
+        patterns = {name: os.environ.get(f"FLYTE_DISTRIBUTION_{name.upper()}", "") for name in ("include", "exclude")}
+    key = hashlib.sha256(json.dumps([additional_distribution, patterns]).encode()).hexdigest()[:16]
+    versions = os.path.join(dest_dir, DISTRIBUTION_VERSIONS_DIR)
+    versioned = _env_flag("FLYTE_DISTRIBUTION_VERSIONS", False)
+    state = {"distribution": additional_distribution, "filter": patterns}
+    
+    with ExitStack() as stack:
+        held = stack.enter_context(single_flight(f"dest:{dest_dir}"))
+        tree = os.path.join(versions, key) if versioned else dest_dir
+        extracted = _read_json(os.path.join(tree, DISTRIBUTION_MARKER_NAME), {})
+        if extracted.get("distribution") == additional_distribution and extracted.get("filter") == patterns:
+            print(f"[Flyte] Reusing distribution already extracted in: {tree}")
+            STARTUP_PROFILE.record("distribution_reused", tree)
+            use_tree(tree)
+            if held and versioned:
+                _prune_versions(versions, tree)
+            return tree
+        
+        parent, prefix = (versions, f"{key}.staging-") if versioned else (dest_dir, ".flyte-staging-")
+        os.makedirs(parent, exist_ok=True)
+        remove_stale_staging(parent, prefix)
+        staging = tempfile.mkdtemp(prefix=f"{prefix}{os.getpid()}-", dir=parent)
+        try:
+            info = download_or_patch_distribution(additional_distribution, staging, needed,
+                                                  base_dir=_latest_delta_base(dest_dir))
+            state["sha256"] = info.get("sha256")
+            if "deferred" not in info:
+                _write_json_atomic(os.path.join(staging, DISTRIBUTION_MARKER_NAME), state)
+            if not versioned:
+                if held:
+                    _publish_into_dest(staging, dest_dir)
+                else:
+                    # Another process may be updating dest_dir
+                    tree = staging
+            else:
+                if held and os.path.isdir(tree):
+                    # Left unfinished by a process that died
+                    remove_unused_tree(tree)
+                try:
+                    os.rename(staging, tree)
+                except OSError:
+                    # Built concurrently by a process that didn't wait for
+                    # the lock, or still used: run from our own copy
+                    tree = staging
+            use_tree(tree)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        
+        if held and versioned:
+            _prune_versions(versions, tree)
+        
+        deferred = info.get("deferred")
+        if deferred is None:
+            return tree
+        
+        # Keep the lock until the deferred files are in place
+        lock = stack.pop_all()
+        
+        def finish(ok):
+            try:
+                if ok:
+                    for finish_name, data in deferred.get("finish", {}).items():
+                        _write_json_atomic(os.path.join(tree, finish_name), data)
+                    _write_json_atomic(os.path.join(tree, DISTRIBUTION_MARKER_NAME), state)
+            finally:
+                lock.close()
+        
+        LazyExtraction(deferred["archive"], tree, deferred["names"], on_done=finish).start()
+    return tree
+
+
+# =============================================================================
+# GIT CHECKOUT
+# =============================================================================
+
+# Directory of this entrypoint, captured before setup_environment() changes
+# the working directory. With a job's git_source, it is inside the checkout.
+_ENTRYPOINT_DIR = os.path.dirname(os.path.abspath(globals().get("__file__") or sys.argv[0]))
+
+
+def _git_checkout_commit(checkout: str) -> str:
+    """
+    The commit a checkout is at: `git rev-parse HEAD`, else the
+    '_commits/<sha>' component Databricks puts in git_source checkout paths.
+    """
+    import re
+    
+    try:
+        result = subprocess.run(
+            ["git", "-C", checkout, "rev-parse", "HEAD"],
+            check=False, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, timeout=10,
+        )
+        if result.returncode == 0 and result.stdout.strip():
+            return result.stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        pass
+    match = re.search(r"_commits/([0-9a-f]{7,40})(/|$)", checkout)
+    return match.group(1) if match else None
+
+
+def _module_source(tree: str, module: str) -> str:
+    """Path of `module`'s source under `tree`, or None."""
+    base = os.path.join(tree, *module.split("."))
+    for path in (f"{base}.py", os.path.join(base, "__init__.py")):
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def find_git_checkout(task_module: str) -> str:
+    """
+    Directory of the git checkout the task module can be imported from.
+    
+    FLYTE_GIT_CHECKOUT_DIR names it explicitly; otherwise the entrypoint's
+    directory and its parents up to the repository root are tried.
+    
+    Returns:
+        str: The directory, or None if the module isn't in the checkout
+    """
+    configured = os.environ.get("FLYTE_GIT_CHECKOUT_DIR")
+    if configured:
+        candidates = [os.path.abspath(configured)]
+    else:
+        candidates = []
+        directory = _ENTRYPOINT_DIR
+        while True:
+            candidates.append(directory)
+            parent = os.path.dirname(directory)
+            if os.path.exists(os.path.join(directory, ".git")) or parent == directory:
+                break
+            directory = parent
+    return next((c for c in candidates if _module_source(c, task_module)), None)
+
+
+def resolve_git_checkout(additional_distribution: str, task_module: str) -> str:
+    """
+    Decide whether a task can run from the job's git checkout instead of
+    downloading its fast-register distribution.
+    
+    The checkout is used when the task module is importable from it and
+    the checkout is provably the registered code:
+        - its commit matches FLYTE_GIT_COMMIT (--flyte-git-commit), or
+        - without an expected commit, every file of the distribution's
+          manifest (see fetch_distribution_manifest) is present in the
+          checkout with the same SHA-256.
+    Otherwise the distribution is downloaded as usual. The decision and
+    its reason are recorded in the startup profile.
+    
+    Returns:
+        str: The checkout directory to import from, or None
+    """
+    decision = {"used": False, "checkout": find_git_checkout(task_module)}
+    checkout = decision["checkout"]
+    if checkout is None:
+        decision["reason"] = f"{task_module} not found in the checkout"
+    else:
+        commit = decision["commit"] = _git_checkout_commit(checkout)
+        expected = os.environ.get("FLYTE_GIT_COMMIT")
+        if expected:
+            decision["used"] = bool(commit) and (commit.startswith(expected) or expected.startswith(commit))
+            decision["reason"] = f"checkout at {commit or 'unknown commit'}, expected {expected}"
+        else:
+            manifest = fetch_distribution_manifest(additional_distribution)
+            if manifest is None:
+                decision["reason"] = "no expected commit and no distribution manifest to compare with"
+            else:
+                mismatch = next((
+                    name for name, entry in manifest["files"].items()
+                    if "link" not in entry and not (
+                        os.path.isfile(os.path.join(checkout, name))
+                        and _file_sha256(os.path.join(checkout, name)) == entry.get("sha256")
+                    )
+                ), None)
+                decision["used"] = mismatch is None
+                decision["reason"] = f"{mismatch} differs from the distribution" if mismatch else \
+                    f"all {len(manifest['files'])} distribution files match"
+    
+    STARTUP_PROFILE.record("distribution_source", dict(decision, source="git_checkout" if decision["used"] else "download"))
+    if decision["used"]:
+        print(f"[Flyte] Running from git checkout {checkout} ({decision['reason']}); skipping download")
+        return checkout
+    print(f"[Flyte] Not using the git checkout: {decision['reason']}")
+    return None
+
+
+# =============================================================================
+# DISTRIBUTION CACHE
+# =============================================================================
+
+
+def _directory_size(path: str) -> int:
+    """Total size in bytes of the regular files under `path`."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _write_json_atomic(path: str, data):
+    """Write JSON to `path` via a temporary file and rename."""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str, default=None):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _clone_file(source: str, target: str):
+    """
+    Copy a file inside the kernel with copy_file_range.
+    
+    On filesystems with reflinks (btrfs, XFS) this shares extents instead of
+    copying bytes. Falls back to a regular copy where unsupported.
+    """
+    import shutil
+    
+    if hasattr(os, "copy_file_range"):
+        try:
+            with open(source, 'rb') as src, open(target, 'wb') as dst:
+                remaining = os.fstat(src.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+            if remaining == 0:
+                shutil.copystat(source, target)
+                return
+        except OSError:
+            pass
+    shutil.copy2(source, target)
+
+
+def link_or_clone(source: str, target: str):
+    """Hardlink `source` at `target`; clone it if hardlinks are unavailable."""
+    try:
+        os.link(source, target)
+    except OSError:
+        _clone_file(source, target)
+
+
+class BlobStore:
+    """
+    Content-addressed store of distribution files, shared by hardlinks.
+    
+    Each distinct file (SHA-256 and permission bits) is stored once as
+    objects/<sha256[:2]>/<sha256>-<mode>; cached trees hold hardlinks to
+    it, so the files shared by several versions of a distribution take up
+    disk space once. The permission bits are part of the key because
+    hardlinks share them.
+    
+    Extraction adds files as it writes them (see extract_tar_stream): the
+    SHA-256 is computed from the bytes on their way to disk, and a file the
+    store already has is hardlinked from it (place()) instead of written.
+    
+    A blob whose link count drops to 1 is no longer used by any tree and is
+    removed by gc().
+    """
+    
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+    
+    def blob_path(self, digest: str, mode: int) -> str:
+        return os.path.join(self.root, "objects", digest[:2], f"{digest}-{mode:o}")
+    
+    def place(self, digest: str, mode: int, path: str) -> bool:
+        """
+        Hardlink the stored blob with this content and mode at `path`.
+        
+        Returns:
+            bool: Whether the store had it (then there's nothing to write)
+        """
+        blob = self.blob_path(digest, mode)
+        try:
+            os.link(blob, path)
+            return True
+        except FileExistsError:
+            pass
+        except OSError:
+            return False
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.link"
+        try:
+            os.link(blob, tmp_path)
+        except OSError:
+            return False
+        os.replace(tmp_path, path)
+        return True
+    
+    def ingest(self, path: str, digest: str = None) -> int:
+        """
+        Move a regular file into the store and leave a hardlink in its place.
+        
+        If the store already has the content, the file is replaced by a link
+        to the existing blob. The file is only read to hash it when its
+        `digest` isn't given. Files on another filesystem than the store are
+        left as they are.
+        
+        Returns:
+            int: Bytes saved (the file size if it was a duplicate, else 0)
+        """
+        import stat
+        
+        st = os.lstat(path)
+        if not stat.S_ISREG(st.st_mode) or st.st_nlink > 1:
+            return 0
+        digest, mode = digest or _file_sha256(path), stat.S_IMODE(st.st_mode)
+        blob = self.blob_path(digest, mode)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            os.link(path, blob)
+            return 0
+        except FileExistsError:
+            pass
+        except OSError:
+            return 0
+        return st.st_size if self.place(digest, mode, path) else 0
+    
+    def ingest_tree(self, tree: str) -> dict:
+        """
+        Ingest every regular file of a tree not written through the store.
+        
+        Re-reads the files, so it is only used where extraction can't hash
+        them on the way (tarfile's extractall). Files are hashed on a thread
+        pool (hashlib releases the GIL).
+        
+        Returns:
+            dict: {"files", "bytes_saved", "seconds"}
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        
+        start = time.perf_counter()
+        paths = [os.path.join(root, name) for root, _, files in os.walk(tree) for name in files]
+        try:
+            with ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="flyte-blobs") as executor:
+                saved = sum(executor.map(self.ingest, paths))
+        except OSError as e:
+            print(f"[Flyte] WARNING: Could not deduplicate distribution files: {e}")
+            saved = 0
+        return {"files": len(paths), "bytes_saved": saved, "seconds": round(time.perf_counter() - start, 3)}
+    
+    def gc(self) -> int:
+        """Remove blobs that no tree links to any more; returns bytes freed."""
+        freed = 0
+        for root, _, files in os.walk(os.path.join(self.root, "objects")):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.lstat(path)
+                    if st.st_nlink == 1:
+                        os.unlink(path)
+                        freed += st.st_size
+                except OSError:
+                    pass
+        return freed
+
+
+class SharedDistributionCache:
+    """
+    Second cache tier on a path shared by all nodes, e.g. a Unity Catalog
+    Volume (/Volumes/<catalog>/<schema>/flyte_cache) or /dbfs.
+    
+    Layout under `root`:
+        trees/<sha256>.tar  extracted and precompiled tree, packed as an
+                            uncompressed tar (one sequential read from the
+                            mount instead of thousands of small files)
+        refs/<ref>          sha256 for a source fingerprint
+        staging/            in-progress publications
+    
+    Archives and refs are written to staging and renamed into place, so
+    readers take no locks and never see a partial archive. The tier is not
+    evicted by the entrypoint; manage its size on the shared path.
+    """
+    
+    def __init__(self, root: str):
+        self.root = root
+        for sub in ("trees", "refs", "staging"):
+            os.makedirs(os.path.join(root, sub), exist_ok=True)
+    
+    def archive_path(self, digest: str) -> str:
+        return os.path.join(self.root, "trees", f"{digest}.tar")
+    
+    def lookup(self, digest: str = None, ref: str = None) -> str:
+        """Return the digest of an archived tree by digest or fingerprint, or None."""
+        if not digest and ref:
+            try:
+                with open(os.path.join(self.root, "refs", ref)) as f:
+                    digest = f.read().strip()
+            except OSError:
+                return None
+        return digest if digest and os.path.exists(self.archive_path(digest)) else None
+    
+    def fetch(self, digest: str, dest_tree: str, blobs: BlobStore = None):
+        """Extract an archived tree into dest_tree (through the node's BlobStore `blobs`, if any)."""
+        with open(self.archive_path(digest), 'rb') as f:
+            extract_distribution_stream(f, dest_tree, blobs=blobs)
+    
+    def publish(self, tree: str, digest: str, ref: str = None):
+        """
+        Pack a tree (with its bytecode) into the shared tier.
+        
+        Members are written as plain files, directories and symlinks:
+        hardlinks from the node blob store are not carried over.
+        """
+        import tarfile
+        
+        archive = self.archive_path(digest)
+        if not os.path.exists(archive):
+            staging = os.path.join(self.root, "staging", f"{digest}.{os.getpid()}.{threading.get_ident()}.tar")
+            try:
+                with tarfile.open(staging, mode='w') as tar:
+                    for root, dirs, files in os.walk(tree):
+                        for name in sorted(dirs) + sorted(files):
+                            path = os.path.join(root, name)
+                            info = tarfile.TarInfo(os.path.relpath(path, tree))
+                            st = os.lstat(path)
+                            info.mode, info.mtime = st.st_mode & 0o7777, int(st.st_mtime)
+                            if os.path.islink(path):
+                                info.type, info.linkname = tarfile.SYMTYPE, os.readlink(path)
+                                tar.addfile(info)
+                            elif name in dirs:
+                                info.type = tarfile.DIRTYPE
+                                tar.addfile(info)
+                            else:
+                                info.size = st.st_size
+                                with open(path, 'rb') as f:
+                                    tar.addfile(info, f)
+                os.replace(staging, archive)
+            finally:
+                if os.path.exists(staging):
+                    os.unlink(staging)
+        if ref:
+            ref_path = os.path.join(self.root, "refs", ref)
+            tmp_path = f"{ref_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(digest)
+            os.replace(tmp_path, ref_path)
+
+
+class DistributionCache:
+    """
+    Node-local, content-addressed cache of extracted distributions.
+    
+    Layout under `root`:
+        entries/<sha256>/tree       extracted distribution, keyed by the
+                                    SHA-256 of the tarball
+        entries/<sha256>/meta.json  source, size and last-use time
+        entries/<sha256>/manifest.json
+                                    distribution manifest, if one was
+                                    published (base for delta updates)
+        refs/<ref>                  sha256 for a source fingerprint (URI,
+                                    S3 ETag, version id, size)
+        staging/                    in-progress extractions
+        blobs/                      BlobStore the trees' files are
+                                    hardlinked to (when `dedup` is on)
+        stats.json                  cumulative hit/miss/eviction counters
+    
+    An entry only becomes visible through an atomic rename of its fully
+    extracted staging directory. Entries are evicted least-recently-used
+    first once the cache grows beyond `max_bytes`. The bound applies to the
+    apparent size of the trees, so with deduplication the disk actually
+    used is lower.
+    
+    With a `shared` tier (SharedDistributionCache), node misses are served
+    from it before going to S3, and trees downloaded from S3 are published
+    to it once precompiled (see share_pending).
+    """
+    
+    def __init__(self, root: str, max_bytes: int, dedup: bool = True, shared: SharedDistributionCache = None):
+        self.root = root
+        self.max_bytes = max_bytes
+        for sub in ("entries", "refs", "staging"):
+            os.makedirs(os.path.join(root, sub), exist_ok=True)
+        self.blobs = BlobStore(os.path.join(root, "blobs")) if dedup else None
+        self.shared = shared
+        self._pending_share = None
+    
+    @classmethod
+    def from_environment(cls):
+        """Build the cache from FLYTE_DISTRIBUTION_CACHE*; None if disabled."""
+        if not _env_flag("FLYTE_DISTRIBUTION_CACHE", False):
+            return None
+        work_dir = os.environ.get("FLYTE_INTERNAL_WORK_DIR", "/tmp/flyte")
+        root = os.environ.get("FLYTE_DISTRIBUTION_CACHE_DIR") or os.path.join(work_dir, ".flyte-cache", "distributions")
+        max_mb = float(os.environ.get("FLYTE_DISTRIBUTION_CACHE_MAX_MB", "4096"))
+        shared_root = os.environ.get("FLYTE_DISTRIBUTION_SHARED_CACHE_DIR")
+        shared = None
+        if shared_root:
+            try:
+                shared = SharedDistributionCache(shared_root)
+            except OSError as e:
+                print(f"[Flyte] WARNING: Shared distribution cache unavailable at {shared_root}: {e}")
+        return cls(
+            root, int(max_mb * (1 << 20)),
+            dedup=_env_flag("FLYTE_DISTRIBUTION_CACHE_DEDUP", True), shared=shared,
+        )
+    
+    def _entry_dir(self, digest: str) -> str:
+        return os.path.join(self.root, "entries", digest)
+    
+    def tree_path(self, digest: str) -> str:
+        return os.path.join(self._entry_dir(digest), "tree")
+    
+    def fingerprint(self, uri: str) -> str:
+        """
+        Key a source object by its S3 ETag, version id and size.
+        
+        Returns None if the object metadata cannot be read, in which case
+        the cache can only be populated (by content hash), not consulted.
+        """
+        try:
+            import fsspec
+            
+            info = fsspec.filesystem('s3').info(uri.replace('s3://', ''))
+        except Exception as e:
+            print(f"[Flyte] WARNING: Could not stat {uri} for the distribution cache: {e}")
+            return None
+        parts = [uri, str(info.get("ETag", "")), str(info.get("VersionId", "")), str(info.get("size", ""))]
+        return hashlib.sha256("|".join(parts).encode()).hexdigest()
+    
+    def lookup(self, ref: str) -> str:
+        """Return the cached digest for a fingerprint, or None."""
+        if not ref:
+            return None
+        try:
+            with open(os.path.join(self.root, "refs", ref)) as f:
+                digest = f.read().strip()
+        except OSError:
+            return None
+        return digest if os.path.isdir(self.tree_path(digest)) else None
+    
+    def touch(self, digest: str):
+        """Mark an entry as used now (drives LRU eviction)."""
+        try:
+            os.utime(os.path.join(self._entry_dir(digest), "meta.json"))
+        except OSError:
+            pass
+    
+    def add_ref(self, ref: str, digest: str):
+        if ref:
+            ref_path = os.path.join(self.root, "refs", ref)
+            tmp_path = f"{ref_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(digest)
+            os.replace(tmp_path, ref_path)
+    
+    def new_staging_dir(self) -> str:
+        return tempfile.mkdtemp(prefix=f"{os.getpid()}-", dir=os.path.join(self.root, "staging"))
+    
+    def publish(self, staging_dir: str, digest: str, source: str) -> str:
+        """
+        Atomically move an extracted staging dir into the cache.
+        
+        `staging_dir` must contain the extracted tree under 'tree'. If the
+        same content is already cached, the staging copy is discarded.
+        
+        Returns:
+            str: Path of the cached tree
+        """
+        import shutil
+        
+        entry_dir = self._entry_dir(digest)
+        _write_json_atomic(os.path.join(staging_dir, "meta.json"), {
+            "source": source,
+            "size_bytes": _directory_size(os.path.join(staging_dir, "tree")),
+            "created_at": time.time(),
+        })
+        try:
+            os.rename(staging_dir, entry_dir)
+        except OSError:
+            if not os.path.isdir(entry_dir):
+                raise
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        return self.tree_path(digest)
+    
+    def evict(self, keep: str = None) -> list:
+        """
+        Remove least-recently-used entries until the cache fits max_bytes.
+        
+        Entries a task on the node still runs from (see use_tree) are
+        skipped, so the cache may stay above max_bytes until they are free.
+        
+        Args:
+            keep: Digest that must not be evicted (the entry in use)
+        
+        Returns:
+            list: Digests that were evicted
+        """
+        import shutil
+        
+        entries = []
+        entries_root = os.path.join(self.root, "entries")
+        for digest in os.listdir(entries_root):
+            meta_path = os.path.join(entries_root, digest, "meta.json")
+            meta = _read_json(meta_path)
+            if meta is None:
+                continue
+            try:
+                last_used = os.path.getmtime(meta_path)
+            except OSError:
+                continue
+            entries.append((last_used, digest, meta.get("size_bytes", 0)))
+        
+        total = sum(size for _, _, size in entries)
+        evicted = []
+        for _, digest, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if digest == keep:
+                continue
+            trash = os.path.join(self.root, "staging", f"{os.getpid()}-evict-{digest}")
+            with unused_tree(self.tree_path(digest)) as unused:
+                if not unused:
+                    continue
+                try:
+                    os.rename(self._entry_dir(digest), trash)
+                except OSError:
+                    continue
+            shutil.rmtree(trash, ignore_errors=True)
+            if sys.pycache_prefix:
+                # Bytecode written under a pycache prefix mirrors the tree path
+                shutil.rmtree(os.path.join(sys.pycache_prefix, self.tree_path(digest).lstrip(os.sep)), ignore_errors=True)
+            total -= size
+            evicted.append(digest)
+        if evicted and self.blobs is not None:
+            self.blobs.gc()
+        return evicted
+    
+    def delta_base(self, manifest: dict, candidates: int = 8):
+        """
+        Pick the cached tree to patch into the version a manifest describes.
+        
+        Among the `candidates` most recently used entries that have a
+        manifest, the one sharing the most bytes with `manifest` wins.
+        
+        Returns:
+            tuple: (digest, plan) for apply_distribution_delta, or None
+        """
+        entries = []
+        entries_root = os.path.join(self.root, "entries")
+        for digest in os.listdir(entries_root):
+            try:
+                last_used = os.path.getmtime(os.path.join(entries_root, digest, "meta.json"))
+            except OSError:
+                continue
+            if os.path.exists(os.path.join(entries_root, digest, "manifest.json")):
+                entries.append((last_used, digest))
+        
+        best = None
+        for _, digest in sorted(entries, reverse=True)[:candidates]:
+            base = _read_json(os.path.join(entries_root, digest, "manifest.json"), {})
+            plan = plan_distribution_delta(manifest, base.get("files"))
+            if plan is not None and (best is None or plan["reuse_bytes"] > best[1]["reuse_bytes"]):
+                best = (digest, plan)
+        return best
+    
+    def update_stats(self, **deltas) -> dict:
+        """Add to the cumulative counters in stats.json and return them."""
+        stats_path = os.path.join(self.root, "stats.json")
+        stats = _read_json(stats_path, {})
+        for name, delta in deltas.items():
+            stats[name] = stats.get(name, 0) + delta
+        try:
+            _write_json_atomic(stats_path, stats)
+        except OSError as e:
+            print(f"[Flyte] WARNING: Could not update cache stats: {e}")
+        return stats
+    
+    def _hit(self, digest: str) -> str:
+        """The tree of a cached entry, marked in use; None if it was evicted meanwhile."""
+        tree = self.tree_path(digest)
+        use_tree(tree)
+        if not os.path.isdir(tree):
+            return None
+        self.touch(digest)
+        stats = self.update_stats(hits=1)
+        print(f"[Flyte] Distribution cache hit: {digest[:12]}")
+        STARTUP_PROFILE.record("distribution_cache", {"hit": True, "digest": digest, "stats": stats})
+        return self.tree_path(digest)
+    
+    def fetch(self, additional_distribution: str) -> str:
+        """
+        Return the extracted tree for a distribution, downloading on a miss.
+        
+        Misses are single-flighted per node (see single_flight): when several
+        processes miss the same distribution at once, one fetches it and the
+        others wait and then hit the entry it published.
+        
+        Returns:
+            str: Directory to put on sys.path
+        """
+        # A known expected digest addresses the entry directly: no object
+        # metadata request, and the content was verified when it was cached
+        expected = expected_distribution_digest(additional_distribution)
+        if expected and os.path.isdir(self.tree_path(expected)):
+            tree = self._hit(expected)
+            if tree:
+                return tree
+        ref = self.fingerprint(additional_distribution)
+        digest = self.lookup(ref)
+        if digest:
+            tree = self._hit(digest)
+            if tree:
+                return tree
+        
+        with single_flight(f"cache:{self.root}:{additional_distribution}"):
+            # Another process may have cached it while this one waited
+            digest = expected if expected and os.path.isdir(self.tree_path(expected)) else self.lookup(ref)
+            tree = self._hit(digest) if digest else None
+            if tree:
+                return tree
+            remove_stale_staging(os.path.join(self.root, "staging"))
+            return self._fetch_miss(additional_distribution, expected, ref)
+    
+    def _fetch_miss(self, additional_distribution: str, expected: str, ref: str) -> str:
+        import shutil
+        
+        shared_digest = None
+        if self.shared is not None:
+            try:
+                shared_digest = self.shared.lookup(digest=expected, ref=ref)
+            except OSError as e:
+                print(f"[Flyte] WARNING: Shared distribution cache lookup failed: {e}")
+        
+        print(f"[Flyte] Distribution cache miss{' (shared cache hit)' if shared_digest else ''}")
+        manifest = base = None
+        if shared_digest is None and _env_flag("FLYTE_DISTRIBUTION_DELTA", False) and not additional_distribution.endswith(".zip"):
+            manifest = fetch_distribution_manifest(additional_distribution)
+            if manifest and expected and manifest.get("sha256") != expected:
+                manifest = None
+            base = self.delta_base(manifest) if manifest else None
+        staging_dir = self.new_staging_dir()
+        try:
+            staging_tree = os.path.join(staging_dir, "tree")
+            if shared_digest is not None:
+                self.shared.fetch(shared_digest, staging_tree, blobs=self.blobs)
+                digest = shared_digest
+                # Shared trees are published with their bytecode
+                Path(os.path.join(staging_dir, "compiled")).touch()
+            elif base is not None:
+                base_digest, plan = base
+                print(f"[Flyte] Patching cached distribution {base_digest[:12]}")
+                apply_distribution_delta(manifest, plan, self.tree_path(base_digest), staging_tree, blobs=self.blobs)
+                digest = manifest_digest(manifest)
+            else:
+                # Cached trees are shared by every task: always complete
+                digest = download_and_extract_distribution(
+                    additional_distribution, staging_tree, include=[], exclude=[], blobs=self.blobs
+                )["sha256"]
+            if manifest is not None:
+                _write_json_atomic(os.path.join(staging_dir, "manifest.json"), manifest)
+            tree = self.publish(staging_dir, digest, additional_distribution)
+        except BaseException:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+        use_tree(tree)
+        self.add_ref(ref, digest)
+        self.touch(digest)
+        evicted = self.evict(keep=digest)
+        if shared_digest is not None:
+            stats = self.update_stats(misses=1, shared_hits=1, evictions=len(evicted))
+        else:
+            stats = self.update_stats(misses=1, evictions=len(evicted))
+            if self.shared is not None:
+                self._pending_share = (tree, digest, ref)
+        if evicted:
+            print(f"[Flyte] Evicted {len(evicted)} cached distribution(s)")
+        STARTUP_PROFILE.record("distribution_cache", {
+            "hit": False, "shared_hit": shared_digest is not None, "digest": digest,
+            "delta": base is not None, "evicted": evicted, "stats": stats,
+        })
+        return tree
+    
+    def share_pending(self):
+        """
+        Publish the tree last downloaded from S3 to the shared tier.
+        
+        Runs on a (non-daemon) background thread, so the task doesn't wait
+        for the upload but the process doesn't exit before it completes.
+        """
+        if self._pending_share is None:
+            return
+        tree, digest, ref = self._pending_share
+        self._pending_share = None
+        
+        def share():
+            start = time.perf_counter()
+            try:
+                self.shared.publish(tree, digest, ref)
+                print(f"[Flyte] Published distribution {digest[:12]} to the shared cache "
+                      f"in {time.perf_counter() - start:.1f}s")
+            except Exception as e:
+                print(f"[Flyte] WARNING: Could not publish to the shared distribution cache: {e}")
+        
+        threading.Thread(target=share, name="flyte-share").start()
+
+
+def parse_fast_execute_args(args: list):
+    """
+    Parse pyflyte-fast-execute arguments.
+    
+    Args:
+        args: Arguments after 'pyflyte-fast-execute', i.e.
+            --additional-distribution <url> --dest-dir <dir> -- pyflyte-execute ...
+    
+    Returns:
+        tuple: (additional_distribution, dest_dir, execute_args, task_module)
+    """
+    additional_distribution = None
+    dest_dir = "."
+    execute_args = []
+    
+    i = 0
+    while i < len(args):
+        if args[i] == "--additional-distribution" and i + 1 < len(args):
+            additional_distribution = args[i + 1]
+            i += 2
+        elif args[i] == "--dest-dir" and i + 1 < len(args):
+            dest_dir = args[i + 1]
+            i += 2
+        elif args[i] == "--":
+            execute_args = args[i + 1:]
+            break
+        else:
+            i += 1
+    
+    # Extract task info for logging
+    task_module = None
+    for j, arg in enumerate(execute_args):
+        if arg == "task-module" and j + 1 < len(execute_args):
+            task_module = execute_args[j + 1]
+            break
+    
+    return additional_distribution, dest_dir, execute_args, task_module
+
+
+# Result of prepare_distribution() per (distribution, absolute dest dir), so
+# a distribution prefetched during startup is not downloaded a second time.
+# Failures are not kept: the next call (the task itself, or a later task in
+# a warm server) tries again.
+_PREPARED_DISTRIBUTIONS = {}
+_PREPARED_DISTRIBUTIONS_LOCK = threading.Lock()
+
+
+def precompile_distribution(tree: str, marker: str = None, invalidation_mode: str = None):
+    """
+    Compile the extracted distribution to bytecode before it is imported.
+    
+    Runs `python -m compileall` with FLYTE_COMPILE_WORKERS processes
+    (0 disables precompilation) in a separate interpreter, so no worker is
+    forked from this multi-threaded process. It blocks the task import and
+    covers the whole tree, so when FLYTE_COMPILE_WORKERS is unset only trees
+    with a `marker` (distribution cache entries, compiled once and reused by
+    later tasks) are compiled, with the CPU count; elsewhere Python compiles
+    just the modules the task imports, as it does without precompilation.
+    
+    Bytecode goes to __pycache__ next to the sources when the tree is
+    writable (which keeps it alongside cached distributions). Otherwise, or
+    if FLYTE_PYCACHE_PREFIX is set, it goes to a pycache prefix under the
+    work dir, and sys.pycache_prefix is pointed there so imports find it.
+    
+    Args:
+        tree: Extracted distribution directory
+        marker: File that records a completed compile, to skip it next time
+        invalidation_mode: compileall --invalidation-mode ('timestamp' by
+            default; 'checked-hash' for trees whose mtimes change)
+    """
+    workers = os.environ.get("FLYTE_COMPILE_WORKERS")
+    if not workers and marker is None:
+        return
+    workers = int(workers or os.cpu_count() or 1)
+    if workers <= 0 or (marker and os.path.exists(marker)):
+        return
+    
+    prefix = os.environ.get("FLYTE_PYCACHE_PREFIX")
+    if not prefix and not os.access(tree, os.W_OK):
+        work_dir = os.environ.get("FLYTE_INTERNAL_WORK_DIR", "/tmp/flyte")
+        prefix = os.path.join(work_dir, ".flyte-cache", "pycache")
+    
+    command = [sys.executable]
+    if prefix:
+        os.makedirs(prefix, exist_ok=True)
+        sys.pycache_prefix = prefix
+        os.environ["PYTHONPYCACHEPREFIX"] = prefix
+        command += ["-X", f"pycache_prefix={prefix}"]
+    command += ["-m", "compileall", "-q", "-j", str(workers)]
+    if invalidation_mode:
+        command += ["--invalidation-mode", invalidation_mode]
+    command.append(tree)
+    
+    with STARTUP_PROFILE.phase("compile"):
+        result = subprocess.run(command, check=False, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    if result.returncode != 0:
+        # Files that don't compile fail at import time with a proper error
+        print(f"[Flyte] WARNING: Bytecode precompilation reported errors:\n{result.stdout[-2000:]}")
+    elif marker:
+        Path(marker).touch()
+
+
+def prepare_distribution(additional_distribution: str, dest_dir: str, task_module: str = None) -> str:
+    """
+    Download and extract a distribution once per process.
+    
+    Safe to call from several threads; later calls for the same distribution
+    and destination return the path the first successful one prepared, and
+    retry after a failure.
+    With FLYTE_DISTRIBUTION_CACHE enabled, the extracted tree comes from the
+    node-local DistributionCache instead of `dest_dir` (backed by the shared
+    tier of FLYTE_DISTRIBUTION_SHARED_CACHE_DIR, if set); with
+    FLYTE_DISTRIBUTION_DELTA, an earlier version is patched rather than
+    downloaded again when possible. Cached trees (and others, with
+    FLYTE_COMPILE_WORKERS) are then precompiled to bytecode (see
+    precompile_distribution), and with
+    FLYTE_DISTRIBUTION_TRACE the files the task reads from it are recorded.
+    
+    With FLYTE_GIT_CHECKOUT enabled and `task_module` given, the job's git
+    checkout is used instead when it holds the registered code (see
+    resolve_git_checkout); nothing is downloaded then.
+    
+    Returns:
+        str: Absolute directory (or zip distribution) to put on sys.path
+    """
+    abs_dest = os.path.abspath(dest_dir)
+    key = (additional_distribution, abs_dest)
+    with _PREPARED_DISTRIBUTIONS_LOCK:
+        entry = _PREPARED_DISTRIBUTIONS.setdefault(key, {"lock": threading.Lock()})
+    
+    with entry["lock"]:
+        if "path" not in entry and task_module and _env_flag("FLYTE_GIT_CHECKOUT", False):
+            try:
+                checkout = resolve_git_checkout(additional_distribution, task_module)
+            except Exception as e:
+                print(f"[Flyte] WARNING: Could not check the git checkout: {e}")
+                checkout = None
+            if checkout is not None:
+                entry["path"] = checkout
+        if "path" not in entry:
+            with STARTUP_PROFILE.phase("download"):
+                cache = DistributionCache.from_environment()
+                if cache is not None:
+                    path = cache.fetch(additional_distribution)
+                    marker = os.path.join(os.path.dirname(path), "compiled")
+                else:
+                    path, marker = extract_distribution_once(additional_distribution, abs_dest), None
+            shared = cache is not None and cache.shared is not None
+            # Not from the tree: a reused dest dir may hold an earlier zip
+            if additional_distribution.endswith(".zip"):
+                path = os.path.join(path, ZIP_DISTRIBUTION_NAME)
+            else:
+                # Hash-based bytecode stays valid when the tree is
+                # unpacked from the shared tier with new mtimes
+                precompile_distribution(path, marker, invalidation_mode="checked-hash" if shared else None)
+            if shared:
+                cache.share_pending()
+            trace = DistributionAccessTrace.from_environment()
+            if trace is not None and os.path.isdir(path):
+                trace.watch(path)
+            entry["path"] = path
+        return entry["path"]
+
+
+def execute_flyte_task_directly(args: list):
+    """
+    Execute Flyte task directly to preserve SparkSession.
+    
+    This is the key to making Spark work in Databricks serverless with Flyte.
+    fast_execute_task_cmd clears Python state, losing the SparkSession.
+    By downloading the tarball and importing the module ourselves, we preserve
+    the SparkSession that was created by setup_spark_session().
+    
+    Zip distributions are imported from the archive without extraction.
+    """
+    import importlib
+    
+    # Parse args: --additional-distribution <url> --dest-dir <dir> -- pyflyte-execute ...
+    additional_distribution, dest_dir, execute_args, task_module = parse_fast_execute_args(args)
+    
+    print(f"[Flyte] Executing task: {task_module}")
+    
+    # Download and extract tarball (no-op if already prefetched during startup)
+    abs_dest = os.path.abspath(dest_dir)
+    if additional_distribution:
+        abs_dest = prepare_distribution(additional_distribution, dest_dir, task_module)
+    
+    # Add to sys.path
+    if abs_dest.endswith(".zip"):
+        mount_zip_distribution(abs_dest)
+    elif abs_dest not in sys.path:
+        sys.path.insert(0, abs_dest)
+    
+    # Import task module in our context (preserves SparkSession)
+    if task_module:
+        with STARTUP_PROFILE.phase("import"):
+            importlib.import_module(task_module)
+    
+    # Map tasks fan out over the shared SparkSession
+    if execute_args and execute_args[0] == "pyflyte-map-execute":
+        return execute_map_task_inprocess(execute_args[1:])
+    
+    # Execute via flytekit (handles inputs/outputs)
+    with STARTUP_PROFILE.phase("execute"):
+        from flytekit.bin.entrypoint import execute_task_cmd
+        exec_args = execute_args[1:] if execute_args and execute_args[0] == "pyflyte-execute" else execute_args
+        
+        execute_task_cmd.main(exec_args, standalone_mode=False)
+    return 0
+
+
+def _infer_map_task_size(map_args: list) -> int:
+    """
+    Number of subtasks of a map task: the length of its mapped list inputs.
+    
+    Reads the --inputs literal map through flytekit's data persistence.
+    """
+    from flytekit.core import utils
+    from flytekit.core.context_manager import FlyteContextManager
+    from flyteidl.core import literals_pb2
+    
+    inputs = None
+    for i, arg in enumerate(map_args):
+        if arg == "--inputs" and i + 1 < len(map_args):
+            inputs = map_args[i + 1]
+            break
+    if not inputs:
+        raise ValueError("pyflyte-map-execute has no --inputs; set FLYTE_MAP_TASK_SIZE")
+    
+    with tempfile.TemporaryDirectory(prefix="flyte_map_") as tmp_dir:
+        local_inputs = os.path.join(tmp_dir, "inputs.pb")
+        FlyteContextManager.current_context().file_access.get_data(inputs, local_inputs)
+        literal_map = utils.load_proto_from_file(literals_pb2.LiteralMap, local_inputs)
+    
+    lengths = [
+        len(literal.collection.literals)
+        for literal in literal_map.literals.values()
+        if literal.HasField("collection")
+    ]
+    if not lengths:
+        raise ValueError("Map task inputs contain no list input; set FLYTE_MAP_TASK_SIZE")
+    return max(lengths)
+
+
+# Where flytekit reads a map subtask's array index from the environment:
+# (module, class or None for a module function, attribute)
+_ARRAY_INDEX_READERS = (
+    ("flytekit.bin.entrypoint", None, "_compute_array_job_index"),
+    ("flytekit.core.array_node_map_task", "ArrayNodeMapTask", "_compute_array_job_index"),
+    ("flytekit.core.legacy_map_task", "MapPythonTask", "_compute_array_job_index"),
+    ("flytekit.core.map_task", "MapPythonTask", "_compute_array_job_index"),
+)
+
+
+@contextmanager
+def _thread_array_index(subtask: threading.local):
+    """
+    Make flytekit read the array index of a map subtask from subtask.index.
+    
+    The entrypoint and the map task classes each compute the index from
+    BATCH_JOB_ARRAY_INDEX_VAR_NAME / _OFFSET in os.environ, which every
+    thread shares. While active, each of them returns the calling thread's
+    subtask.index instead (the environment's index on threads without one).
+    """
+    import importlib
+    
+    patched = []
+    for module_name, class_name, attr in _ARRAY_INDEX_READERS:
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError:
+            continue
+        owner = getattr(module, class_name, None) if class_name else module
+        if owner is None or attr not in vars(owner):
+            continue
+        original = vars(owner)[attr]
+        compute = getattr(owner, attr)
+        
+        def thread_index(compute=compute):
+            return subtask.index if hasattr(subtask, "index") else compute()
+        
+        setattr(owner, attr, staticmethod(thread_index) if class_name else thread_index)
+        patched.append((owner, attr, original))
+    try:
+        yield
+    finally:
+        for owner, attr, original in reversed(patched):
+            setattr(owner, attr, original)
+
+
+def subtask_map_args(map_args: list, index: int) -> list:
+    """
+    pyflyte-map-execute arguments for one subtask run in-process.
+    
+    Appends the subtask index to --output-prefix (unless the legacy
+    MapTaskResolver, which does that itself, is used), --checkpoint-path and
+    --prev-checkpoint, so subtasks don't overwrite each other's outputs.
+    """
+    options = ["--checkpoint-path", "--prev-checkpoint"]
+    if "--resolver" in map_args:
+        resolver = map_args[map_args.index("--resolver") + 1]
+    else:
+        resolver = ""
+    if not resolver.endswith(".MapTaskResolver"):
+        options.append("--output-prefix")
+    
+    args = list(map_args)
+    end = args.index("--") if "--" in args else len(args)
+    for i in range(end - 1):
+        if args[i] in options and args[i + 1]:
+            args[i + 1] = args[i + 1].rstrip("/") + f"/{index}"
+    return args
+
+
+def execute_map_task_inprocess(map_args: list) -> int:
+    """
+    Execute a map (array) task in-process, fanning out over a thread pool.
+    
+    If the array index is already provided (BATCH_JOB_ARRAY_INDEX_VAR_NAME),
+    this is a single subtask and runs as is. Otherwise every subtask runs on
+    a thread against the SparkSession in _flyte_spark_session, with its own
+    array index (see _thread_array_index) and its own output prefix and
+    checkpoint paths: '<path>/<index>', the layout flytekit's legacy
+    MapTaskResolver uses for its output prefix.
+    
+    The number of subtasks is FLYTE_MAP_TASK_SIZE or the length of the list
+    inputs; at most FLYTE_MAP_CONCURRENCY (or --max-concurrency) run at once.
+    
+    Returns:
+        int: 0 if every subtask succeeded, 1 otherwise
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from flytekit.bin.entrypoint import map_execute_task_cmd
+    
+    if os.environ.get("BATCH_JOB_ARRAY_INDEX_VAR_NAME"):
+        with STARTUP_PROFILE.phase("execute"):
+            map_execute_task_cmd.main(map_args, standalone_mode=False)
+        return 0
+    
+    size = int(os.environ.get("FLYTE_MAP_TASK_SIZE") or _infer_map_task_size(map_args))
+    concurrency = int(os.environ.get("FLYTE_MAP_CONCURRENCY") or 0)
+    for i, arg in enumerate(map_args):
+        if arg == "--max-concurrency" and i + 1 < len(map_args) and not concurrency:
+            concurrency = int(map_args[i + 1])
+    concurrency = max(1, min(size, concurrency or os.cpu_count() or 4))
+    print(f"[Flyte] Map task: {size} subtask(s), {concurrency} at a time")
+    
+    subtask = threading.local()
+    
+    try:
+        from flytekit.core.context_manager import flyte_context_Var
+    except ImportError:
+        flyte_context_Var = None
+    parent_contexts = list(flyte_context_Var.get()) if flyte_context_Var is not None else None
+    
+    def run_subtask(index: int):
+        subtask.index = index
+        if flyte_context_Var is not None:
+            # Each thread gets its own copy of flytekit's context stack
+            flyte_context_Var.set(list(parent_contexts))
+        start = time.perf_counter()
+        try:
+            map_execute_task_cmd.main(subtask_map_args(map_args, index), standalone_mode=False)
+            return_code = 0
+        except SystemExit as e:
+            return_code = e.code or 0
+        except Exception as e:
+            print(f"[Flyte] ERROR: Map subtask {index} failed: {e}", file=sys.stderr)
+            return_code = 1
+        return {"index": index, "return_code": return_code, "seconds": round(time.perf_counter() - start, 3)}
+    
+    with STARTUP_PROFILE.phase("execute"), _thread_array_index(subtask):
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="flyte-map") as pool:
+            results = list(pool.map(run_subtask, range(size)))
+    
+    failed = [r["index"] for r in results if r["return_code"]]
+    STARTUP_PROFILE.record("map_task", {"size": size, "concurrency": concurrency, "subtasks": results})
+    if failed:
+        print(f"[Flyte] ERROR: Map subtasks failed: {failed}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def execute_flyte_command_inprocess(args: list):
+    """
+    Execute the Flyte command IN-PROCESS to preserve SparkSession.
+    
+    IMPORTANT: We use direct task execution instead of fast_execute_task_cmd
+    because fast_execute_task_cmd clears Python state when loading the task module,
+    which loses the SparkSession created by this entrypoint.
+    """
+    if not args:
+        print("[Flyte] ERROR: No command provided", file=sys.stderr)
+        return 1
+    
+    cmd = args[0] if args else ""
+    
+    try:
+        if cmd == "pyflyte-fast-execute":
+            # Use DIRECT execution to preserve SparkSession
+            return execute_flyte_task_directly(args[1:])
+            
+        elif cmd == "pyflyte-map-execute":
+            return execute_map_task_inprocess(args[1:])
+            
+        elif cmd == "pyflyte-execute":
+            with STARTUP_PROFILE.phase("execute"):
+                from flytekit.bin.entrypoint import execute_task_cmd
+                return execute_task_cmd.main(args[1:], standalone_mode=False) or 0
+            
+        else:
+            print(f"[Flyte] Unknown command '{cmd}', using subprocess")
+            with STARTUP_PROFILE.phase("execute"):
+                result = subprocess.run(args, check=False, env=os.environ.copy())
+            return result.returncode
+            
+    except SystemExit as e:
+        return e.code if e.code is not None else 0
+    except Exception as e:
+        print(f"[Flyte] ERROR: {e}", file=sys.stderr)
+        import traceback
+        traceback.print_exc()
+        return 1
+
+
+def is_running_in_ipython():
+    """Check if we're running inside IPython/Jupyter/Databricks notebook."""
+    try:
+        get_ipython()  # noqa: F821
+        return True
+    except NameError:
+        return False
+
+
+# =============================================================================
+# WARM SERVER
+# =============================================================================
+
+# Command that turns this entrypoint into a warm server instead of a task
+WARM_SERVER_COMMAND = "flyte-serve"
+
+# A spool server rewrites its heartbeat this often, and is considered gone
+# once it is older than WARM_SERVER_STALE_S
+WARM_SERVER_HEARTBEAT_S = 2
+WARM_SERVER_STALE_S = 10
+
+
+class _TeeStream:
+    """Text stream that writes to several streams at once."""
+    
+    def __init__(self, *streams):
+        self._streams = streams
+    
+    def write(self, data):
+        for stream in self._streams:
+            stream.write(data)
+        return len(data)
+    
+    def flush(self):
+        for stream in self._streams:
+            stream.flush()
+
+
+def _restore_environ(saved: dict, overrides: dict):
+    """
+    Undo the environment changes of an invocation.
+    
+    Variables are reset to `saved`, except the AWS credentials that
+    RefreshingAwsCredentials may have republished meanwhile: those are only
+    reset when the invocation's `overrides` set them and still hold that
+    value, so a refresh during the invocation is kept.
+    """
+    for key in set(os.environ) | set(saved):
+        current = os.environ.get(key)
+        if current == saved.get(key):
+            continue
+        if key in RefreshingAwsCredentials.ENV_KEYS and current != overrides.get(key):
+            continue
+        if key in saved:
+            os.environ[key] = saved[key]
+        else:
+            del os.environ[key]
+
+
+def run_isolated_invocation(args: list, env: dict = None, log_path: str = None) -> dict:
+    """
+    Run one Flyte command in this warm process, isolated from the next one.
+    
+    Environment variables (except refreshed AWS credentials, see
+    _restore_environ), the working directory and sys.path are restored
+    afterwards, and modules imported from sys.path entries added by the
+    invocation (e.g. the task's distribution) are dropped from sys.modules,
+    so the next task can import a different version of the same package.
+    Output is captured (and still echoed to this process's stdout/stderr).
+    
+    Args:
+        args: Flyte command, e.g. ['pyflyte-fast-execute', ...]
+        env: Extra environment variables for this invocation
+        log_path: File to write the invocation's log to (optional)
+    
+    Returns:
+        dict: {"return_code": int, "log": captured output}
+    """
+    import io
+    from contextlib import redirect_stderr, redirect_stdout
+    
+    saved_env = dict(os.environ)
+    saved_cwd = os.getcwd()
+    saved_path = list(sys.path)
+    saved_meta_path = list(sys.meta_path)
+    log = io.StringIO()
+    log_file = open(log_path, "w") if log_path else None
+    streams = [log] + ([log_file] if log_file else [])
+    
+    try:
+        os.environ.update(env or {})
+        with redirect_stdout(_TeeStream(sys.stdout, *streams)), redirect_stderr(_TeeStream(sys.stderr, *streams)):
+            return_code = execute_flyte_command_inprocess(args)
+    finally:
+        added_paths = [os.path.abspath(p) for p in sys.path if p and p not in saved_path]
+        added_paths += [
+            finder.data_dir for finder in sys.meta_path
+            if finder not in saved_meta_path and getattr(finder, "data_dir", None)
+        ]
+        for name, module in list(sys.modules.items()):
+            module_file = getattr(module, "__file__", None) or ""
+            if any(module_file.startswith(path + os.sep) for path in added_paths):
+                del sys.modules[name]
+        sys.path[:] = saved_path
+        sys.meta_path[:] = saved_meta_path
+        _restore_environ(saved_env, env or {})
+        os.chdir(saved_cwd)
+        if log_file:
+            log_file.close()
+    
+    return {"return_code": return_code, "log": log.getvalue()}
+
+
+def _parse_warm_server_address(address: str):
+    """Split 'unix:<socket path>' or 'spool:<directory>' into (kind, path)."""
+    kind, sep, path = address.partition(":")
+    if not sep or kind not in ("unix", "spool") or not path:
+        raise ValueError(f"FLYTE_WARM_SERVER must be 'unix:<path>' or 'spool:<dir>', got: {address}")
+    return kind, path
+
+
+def serve_warm(address: str, idle_timeout_s: float = None):
+    """
+    Keep this process (SparkSession, imports, credentials) warm for more tasks.
+    
+    Invocations are executed one at a time with run_isolated_invocation().
+    
+        unix:<path>  newline-delimited JSON over a Unix socket (mode 0600);
+                     each request {"args": [...], "env": {...}} is answered
+                     with {"accepted": true} when it starts and then one
+                     response {"return_code": ..., "log": ...}
+        spool:<dir>  requests are files <dir>/incoming/<id>.json; results go
+                     to <dir>/done/<id>.json and logs to <dir>/logs/<id>.log.
+                     The subdirectories are made private (0700): requests
+                     run arbitrary commands
+    
+    Returns after FLYTE_WARM_SERVER_IDLE_S seconds without requests
+    (defaults to 600).
+    """
+    if idle_timeout_s is None:
+        idle_timeout_s = float(os.environ.get("FLYTE_WARM_SERVER_IDLE_S", "600"))
+    kind, path = _parse_warm_server_address(address)
+    print(f"[Flyte] Warm server listening on {address} (idle timeout {idle_timeout_s:.0f}s)")
+    served = _serve_unix(path, idle_timeout_s) if kind == "unix" else _serve_spool(path, idle_timeout_s)
+    print(f"[Flyte] Warm server idle, exiting after {served} invocation(s)")
+
+
+def _serve_unix(socket_path: str, idle_timeout_s: float) -> int:
+    import socket
+    
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    os.chmod(socket_path, 0o600)
+    server.listen()
+    server.settimeout(idle_timeout_s)
+    served = 0
+    try:
+        while True:
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                return served
+            with conn, conn.makefile("rwb") as stream:
+                try:
+                    request = json.loads(stream.readline())
+                    stream.write(json.dumps({"accepted": True}).encode() + b"\n")
+                    stream.flush()
+                    response = run_isolated_invocation(request["args"], request.get("env"))
+                except Exception as e:
+                    response = {"return_code": 1, "log": f"[Flyte] ERROR: Bad warm server request: {e}\n"}
+                stream.write(json.dumps(response).encode() + b"\n")
+                stream.flush()
+            served += 1
+    finally:
+        server.close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def _serve_spool(spool_dir: str, idle_timeout_s: float) -> int:
+    for sub in ("incoming", "processing", "done", "logs"):
+        os.makedirs(os.path.join(spool_dir, sub), mode=0o700, exist_ok=True)
+        # Also when left behind by an earlier server with another umask
+        os.chmod(os.path.join(spool_dir, sub), 0o700)
+    heartbeat = os.path.join(spool_dir, "server.json")
+    stop = threading.Event()
+    
+    def beat():
+        # On its own thread, so long invocations don't look like a dead server
+        while True:
+            _write_json_atomic(heartbeat, {"pid": os.getpid(), "heartbeat": time.time()})
+            if stop.wait(WARM_SERVER_HEARTBEAT_S):
+                return
+    
+    beater = threading.Thread(target=beat, name="flyte-warm-heartbeat", daemon=True)
+    beater.start()
+    served = 0
+    last_request = time.monotonic()
+    try:
+        while time.monotonic() - last_request < idle_timeout_s:
+            requests = sorted(n for n in os.listdir(os.path.join(spool_dir, "incoming")) if n.endswith(".json"))
+            if not requests:
+                time.sleep(0.5)
+                continue
+            name = requests[0]
+            request_id = name[:-len(".json")]
+            claimed = os.path.join(spool_dir, "processing", name)
+            try:
+                os.rename(os.path.join(spool_dir, "incoming", name), claimed)
+            except OSError:
+                continue
+            log_path = os.path.join(spool_dir, "logs", f"{request_id}.log")
+            try:
+                request = _read_json(claimed)
+                response = run_isolated_invocation(request["args"], request.get("env"), log_path=log_path)
+            except Exception as e:
+                response = {"return_code": 1, "log": f"[Flyte] ERROR: Bad warm server request: {e}\n"}
+            response["log_path"] = log_path
+            _write_json_atomic(os.path.join(spool_dir, "done", name), response)
+            os.unlink(claimed)
+            served += 1
+            last_request = time.monotonic()
+    finally:
+        stop.set()
+        beater.join()
+        if os.path.exists(heartbeat):
+            os.unlink(heartbeat)
+    return served
+
+
+def submit_to_warm_server(address: str, args: list, env: dict = None):
+    """
+    Run a Flyte command on a live warm server.
+    
+    If the server goes away before it takes the request (a unix server
+    acknowledges it; a spool server claims it, and its heartbeat is re-read
+    while waiting), the request is withdrawn and None is returned; if the
+    server dies while running it, the task fails.
+    
+    Returns:
+        dict: The server's response, or None if no server is live at
+        `address` (the caller should then run the task itself)
+    """
+    import uuid
+    
+    kind, path = _parse_warm_server_address(address)
+    request = {"args": args, "env": env or {}}
+    
+    if kind == "unix":
+        import socket
+        
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            client.connect(path)
+        except OSError:
+            client.close()
+            return None
+        accepted = line = b""
+        with client, client.makefile("rwb") as stream:
+            try:
+                stream.write(json.dumps(request).encode() + b"\n")
+                stream.flush()
+                accepted = stream.readline()
+                if accepted:
+                    line = stream.readline()
+            except OSError:
+                pass
+        if not accepted:
+            print(f"[Flyte] WARNING: Warm server {address} went away; running the task here")
+            return None
+        if not line:
+            return {"return_code": 1, "log": f"[Flyte] ERROR: Warm server {address} stopped while running the task\n"}
+        return json.loads(line)
+    
+    def server_live():
+        heartbeat = _read_json(os.path.join(path, "server.json"))
+        return bool(heartbeat) and time.time() - heartbeat.get("heartbeat", 0) <= WARM_SERVER_STALE_S
+    
+    if not server_live():
+        return None
+    request_id = f"{time.time():.6f}-{uuid.uuid4().hex[:8]}"
+    incoming = os.path.join(path, "incoming", f"{request_id}.json")
+    _write_json_atomic(incoming + ".part", request)
+    os.rename(incoming + ".part", incoming)
+    done = os.path.join(path, "done", f"{request_id}.json")
+    while not os.path.exists(done):
+        time.sleep(0.2)
+        if os.path.exists(done) or server_live():
+            continue
+        try:
+            # Gone (or idle-exited) before claiming it: withdraw the request
+            os.unlink(incoming)
+            print(f"[Flyte] WARNING: Warm server {address} went away; running the task here")
+            return None
+        except FileNotFoundError:
+            pass
+        if not os.path.exists(done):
+            return {
+                "return_code": 1,
+                "log": f"[Flyte] ERROR: Warm server {address} stopped while running the task "
+                       f"(request {request_id})\n",
+            }
+    response = _read_json(done)
+    os.unlink(done)
+    return response
+
+
+# =============================================================================
+# BATCH EXECUTION
+# =============================================================================
+
+# Commands that start a new task invocation in a batch command line
+FLYTE_COMMANDS = ("pyflyte-fast-execute", "pyflyte-execute", "pyflyte-map-execute")
+
+
+def split_command_groups(args: list) -> list:
+    """
+    Split a command line holding several Flyte commands into one per task.
+    
+    A new group starts at every Flyte command name that is not the command
+    nested after '--' in pyflyte-fast-execute, e.g.
+        pyflyte-fast-execute ... -- pyflyte-execute ... pyflyte-execute ...
+    yields two groups.
+    """
+    groups = []
+    for i, arg in enumerate(args):
+        if not groups or (arg in FLYTE_COMMANDS and (i == 0 or args[i - 1] != "--")):
+            groups.append([])
+        groups[-1].append(arg)
+    return groups
+
+
+def load_batch_manifest(path: str) -> list:
+    """
+    Load a batch manifest.
+    
+    The manifest is JSON, either a list of tasks or {"tasks": [...]}, where
+    each task is {"args": [...], "env": {...}, "name": "..."} ("env" and
+    "name" optional). `path` may be local or any fsspec URL (e.g. s3://).
+    
+    Returns:
+        list: Task dicts
+    """
+    if "://" in path:
+        import fsspec
+        
+        with fsspec.open(path, "r") as f:
+            manifest = json.load(f)
+    else:
+        with open(path) as f:
+            manifest = json.load(f)
+    tasks = manifest["tasks"] if isinstance(manifest, dict) else manifest
+    for task in tasks:
+        if not task.get("args"):
+            raise ValueError(f"Batch manifest task without args: {task}")
+    return tasks
+
+
+def _batch_task_name(task: dict, index: int) -> str:
+    if task.get("name"):
+        return task["name"]
+    args = task["args"]
+    for j, arg in enumerate(args):
+        if arg == "task-name" and j + 1 < len(args):
+            return f"{index}:{args[j + 1]}"
+    return str(index)
+
+
+def check_batch_concurrency(tasks: list, concurrency: int):
+    """
+    Reject batch tasks with their own "env" when they would run concurrently.
+    
+    The environment is per process, so concurrent tasks can't each have
+    theirs; run such batches with FLYTE_BATCH_CONCURRENCY=1.
+    """
+    if concurrency <= 1:
+        return
+    with_env = [_batch_task_name(task, index) for index, task in enumerate(tasks) if task.get("env")]
+    if with_env:
+        raise ValueError(
+            f"Batch tasks with an 'env' can't run concurrently (FLYTE_BATCH_CONCURRENCY={concurrency}): "
+            f"{', '.join(with_env)}"
+        )
+
+
+def run_batch(tasks: list, concurrency: int = 1) -> dict:
+    """
+    Run several task invocations against the one SparkSession.
+    
+    Distributions are prepared once per process (see prepare_distribution),
+    so tasks of the same workflow version share one download. With
+    concurrency=1 tasks run one after another, isolated from each other by
+    run_isolated_invocation(). With higher concurrency they run on a thread
+    pool without that isolation (env, sys.path and output are shared), which
+    only suits tasks that don't rely on per-task process state; tasks with
+    their own "env" are rejected then (see check_batch_concurrency).
+    
+    Returns:
+        dict: {task name: {"return_code": int, "seconds": float}}
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    check_batch_concurrency(tasks, concurrency)
+    
+    def run(index_task):
+        index, task = index_task
+        name = _batch_task_name(task, index)
+        print(f"[Flyte] Batch task {name}: starting")
+        start = time.perf_counter()
+        if concurrency > 1:
+            return_code = execute_flyte_command_inprocess(task["args"])
+        else:
+            return_code = run_isolated_invocation(task["args"], task.get("env"))["return_code"]
+        elapsed = round(time.perf_counter() - start, 3)
+        print(f"[Flyte] Batch task {name}: return code {return_code} in {elapsed}s")
+        return name, {"return_code": return_code, "seconds": elapsed}
+    
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="flyte-batch") as pool:
+        results = dict(pool.map(run, enumerate(tasks)))
+    
+    print(f"[Flyte] BATCH_RESULTS {json.dumps(results)}")
+    STARTUP_PROFILE.record("batch", results)
+    return results
+
+
+# =============================================================================
+# IMPORTS
+# =============================================================================
+
+# Heavy modules imported on a background thread during startup with
+# FLYTE_PREIMPORT=true (or a comma-separated list of its own)
+DEFAULT_PREIMPORT_MODULES = "flytekit,flytekit.bin.entrypoint,pandas,pyarrow,s3fs"
+
+
+def _preimport_setting() -> str:
+    """Modules FLYTE_PREIMPORT asks to pre-import, or None when it is off (the default)."""
+    value = os.environ.get("FLYTE_PREIMPORT", "").strip()
+    if value.lower() in ("", "off", "false", "0", "no"):
+        return None
+    if value.lower() in ("on", "true", "1", "yes"):
+        return DEFAULT_PREIMPORT_MODULES
+    return value
+
+
+class _TimedLoader:
+    """Loader proxy that times exec_module() for ImportTimer."""
+    
+    def __init__(self, loader, timer, fullname: str):
+        self._loader = loader
+        self._timer = timer
+        self._fullname = fullname
+    
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+    
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+    
+    def exec_module(self, module):
+        # Put the real loader back so nothing downstream sees the proxy
+        module.__loader__ = self._loader
+        if module.__spec__ is not None:
+            module.__spec__.loader = self._loader
+        with self._timer.timing(self._fullname):
+            self._loader.exec_module(module)
+
+
+class ImportTimer:
+    """
+    Meta path hook that measures import time per top-level package.
+    
+    Like `python -X importtime`, each module's self time excludes the time
+    spent importing its own dependencies; the report aggregates self time
+    per top-level package, so it adds up to the total import cost.
+    """
+    
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.packages = {}
+    
+    def install(self):
+        if self not in sys.meta_path:
+            sys.meta_path.insert(0, self)
+        return self
+    
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+    
+    def find_spec(self, fullname, path, target=None):
+        if getattr(self._local, "finding", False):
+            return None
+        self._local.finding = True
+        try:
+            for finder in sys.meta_path:
+                find_spec = getattr(finder, "find_spec", None)
+                if finder is self or find_spec is None:
+                    continue
+                spec = find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            self._local.finding = False
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = _TimedLoader(spec.loader, self, fullname)
+        return spec
+    
+    @contextmanager
+    def timing(self, fullname: str):
+        stack = self._local.__dict__.setdefault("stack", [])
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            package = fullname.partition(".")[0]
+            with self._lock:
+                entry = self.packages.setdefault(package, {"self_s": 0.0, "modules": 0})
+                entry["self_s"] += elapsed - children
+                entry["modules"] += 1
+    
+    def report(self, top: int = 25) -> list:
+        """Packages sorted by total self import time, most expensive first."""
+        with self._lock:
+            rows = [
+                {"package": name, "self_s": round(entry["self_s"], 4), "modules": entry["modules"]}
+                for name, entry in self.packages.items()
+            ]
+        rows.sort(key=lambda row: row["self_s"], reverse=True)
+        return rows[:top]
+    
+    def print_report(self, top: int = 25):
+        print("[Flyte] Import time by package (self time):")
+        for row in self.report(top):
+            print(f"[Flyte]   {row['package']:<32} {row['self_s']:8.3f}s  {row['modules']:5d} modules")
+
+
+def preimport_modules(modules: str = None) -> list:
+    """
+    Import heavy modules ahead of time so the task import finds them loaded.
+    
+    Meant to run on a background thread while network-bound phases are in
+    flight. Modules that are not installed are skipped. The task import
+    waits for it, so it only pays off for modules the task imports anyway.
+    
+    Args:
+        modules: Comma-separated module names (defaults to FLYTE_PREIMPORT,
+            else DEFAULT_PREIMPORT_MODULES)
+    
+    Returns:
+        list: Modules that were imported
+    """
+    import importlib
+    
+    modules = modules or _preimport_setting() or DEFAULT_PREIMPORT_MODULES
+    imported = []
+    for name in (m.strip() for m in modules.split(",")):
+        if not name:
+            continue
+        try:
+            importlib.import_module(name)
+            imported.append(name)
+        except ImportError as e:
+            print(f"[Flyte] Pre-import skipped {name}: {e}")
+        except Exception as e:
+            print(f"[Flyte] WARNING: Pre-import of {name} failed: {e}")
+    return imported
+
+
+# =============================================================================
+# STARTUP ORCHESTRATION
+# =============================================================================
+
+
+class StartupScheduler:
+    """
+    Runs startup phases concurrently, respecting their dependencies.
+    
+    Each phase runs on its own thread as soon as every phase it requires has
+    finished, so cold start costs roughly the longest dependency chain rather
+    than the sum of all phases. A phase whose requirement raised is skipped
+    and reported as failed. With concurrent=False, phases run one after
+    another on the calling thread in the order they were added.
+    """
+    
+    def __init__(self, concurrent: bool = True):
+        self.concurrent = concurrent
+        self.results = {}
+        self.errors = {}
+        self._phases = {}
+        self._done = {}
+    
+    def add(self, name: str, fn, requires: tuple = (), profile: bool = True):
+        """
+        Register phase `name`.
+        
+        Args:
+            name: Phase name (also used in the startup profile)
+            fn: Callable run for the phase; its return value is the result
+            requires: Phases that must finish first (must already be added)
+            profile: Record the phase in STARTUP_PROFILE (disable for
+                callables that record their own phase)
+        """
+        missing = [dep for dep in requires if dep not in self._phases]
+        if missing:
+            raise ValueError(f"Phase '{name}' requires unknown phase(s): {missing}")
+        self._phases[name] = (fn, tuple(requires), profile)
+        self._done[name] = threading.Event()
+    
+    def _run_phase(self, name: str):
+        fn, requires, profile = self._phases[name]
+        try:
+            for dep in requires:
+                self._done[dep].wait()
+            failed = [dep for dep in requires if dep in self.errors]
+            if failed:
+                self.errors[name] = RuntimeError(f"Skipped: required phase(s) failed: {failed}")
+                return
+            if not profile:
+                self.results[name] = fn()
+                return
+            with STARTUP_PROFILE.phase(name):
+                self.results[name] = fn()
+        except Exception as e:
+            print(f"[Flyte] ERROR: Startup phase '{name}' failed: {e}")
+            self.errors[name] = e
+        finally:
+            self._done[name].set()
+    
+    def run(self) -> dict:
+        """Run all phases and wait for them; returns {name: result}."""
+        if not self.concurrent:
+            for name in self._phases:
+                self._run_phase(name)
+            return self.results
+        
+        threads = [
+            threading.Thread(target=self._run_phase, args=(name,), name=f"flyte-{name}")
+            for name in self._phases
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.results
+
+
+def cold_start(credential_provider: str = None, commands: list = None):
+    """
+    Run the startup phases and return the SparkSession (exits if unavailable).
+    
+    Args:
+        credential_provider: Databricks service credential provider name
+        commands: Flyte commands (argument lists) about to run; their
+            fast-register distributions are prefetched
+    
+    Phases and their dependencies:
+        environment   - working directory and serverless env vars
+        spark_session - the SparkSession must be created HERE (before
+                        fast_execute) because Databricks' pyspark handles
+                        unix:// URLs correctly only on first import
+        credentials   - AWS credentials from Databricks service credentials;
+                        must finish BEFORE any S3 access attempts. Waits for
+                        the SparkSession: dbutils needs one, and creating it
+                        here would race spark_session's sys.path changes and
+                        first pyspark import
+        preimport     - heavy imports (with FLYTE_PREIMPORT); wait for the
+                        SparkSession because flytekit plugins import pyspark
+        download      - prefetch the fast-register distributions of `commands`;
+                        needs credentials, and the working dir for
+                        relative paths
+    The task module is imported after all of these, on the main thread.
+    """
+    scheduler = StartupScheduler(concurrent=_env_flag("FLYTE_CONCURRENT_STARTUP", True))
+    STARTUP_PROFILE.record("concurrent_startup", scheduler.concurrent)
+    scheduler.add("environment", setup_environment)
+    scheduler.add("spark_session", setup_spark_session, requires=("environment",))
+    scheduler.add(
+        "credentials",
+        lambda: setup_aws_credentials_from_databricks(credential_provider),
+        requires=("spark_session",),
+    )
+    
+    if _preimport_setting():
+        scheduler.add("preimport", preimport_modules, requires=("spark_session",))
+    
+    distributions = []
+    for args in commands or []:
+        if args and args[0] == "pyflyte-fast-execute":
+            additional_distribution, dest_dir, _, task_module = parse_fast_execute_args(args[1:])
+            if additional_distribution and (additional_distribution, dest_dir) not in [d[:2] for d in distributions]:
+                distributions.append((additional_distribution, dest_dir, task_module))
+    for i, (additional_distribution, dest_dir, task_module) in enumerate(distributions):
+        scheduler.add(
+            "download" if i == 0 else f"download-{i}",
+            lambda d=additional_distribution, dest=dest_dir, m=task_module: prepare_distribution(d, dest, m),
+            requires=("credentials", "environment"),
+            profile=False,
+        )
+    
+    results = scheduler.run()
+    
+    if not results.get("credentials"):
+        print("[Flyte] WARNING: S3 operations may fail without credentials")
+    
+    spark = results.get("spark_session")
+    if not spark:
+        print("[Flyte] ERROR: Failed to create SparkSession - cannot proceed")
+        sys.exit(1)
+    return spark
+
+
+def main():
+    """Main entrypoint for Flyte serverless tasks."""
+    print("[Flyte] Serverless Entrypoint")
+    print(f"[Flyte] Python: {sys.version.split()[0]}")
+    print(f"[Flyte] Raw args: {sys.argv[1:]}")
+    
+    # Parse entrypoint options (--flyte-*) from command-line arguments
+    options, remaining_args = parse_entrypoint_args()
+    os.environ.update(options)
+    credential_provider = options.get("DATABRICKS_SERVICE_CREDENTIAL_PROVIDER")
+    print(f"[Flyte] Executing: {' '.join(remaining_args[:3])}..." if len(remaining_args) > 3 else f"[Flyte] Executing: {' '.join(remaining_args)}")
+    STARTUP_PROFILE.record("python", sys.version.split()[0])
+    STARTUP_PROFILE.record("command", remaining_args[:1])
+    
+    # Batch mode: a manifest, or several Flyte commands on one command line
+    batch_tasks = None
+    if os.environ.get("FLYTE_BATCH_MANIFEST"):
+        batch_tasks = load_batch_manifest(os.environ["FLYTE_BATCH_MANIFEST"]) + (
+            [{"args": group} for group in split_command_groups(remaining_args)] if remaining_args else []
+        )
+    elif len(split_command_groups(remaining_args)) > 1:
+        batch_tasks = [{"args": group} for group in split_command_groups(remaining_args)]
+    if batch_tasks:
+        print(f"[Flyte] Batch of {len(batch_tasks)} task(s)")
+    
+    warm_server = os.environ.get("FLYTE_WARM_SERVER")
+    serving = remaining_args[:1] == [WARM_SERVER_COMMAND]
+    response = None
+    if warm_server and not serving and not batch_tasks:
+        # Hand the task to a warm server if one is running on this node
+        response = submit_to_warm_server(warm_server, remaining_args, options)
+        STARTUP_PROFILE.record("warm_server", "hit" if response is not None else "miss")
+        if response is not None:
+            print(f"[Flyte] Task ran on warm server {warm_server}")
+            print(response.get("log", ""), end="")
+    
+    import_timer = ImportTimer().install() if _env_flag("FLYTE_IMPORT_REPORT", False) else None
+    
+    try:
+        if response is not None:
+            return_code = response["return_code"]
+        elif serving:
+            if not warm_server:
+                print(f"[Flyte] ERROR: '{WARM_SERVER_COMMAND}' requires FLYTE_WARM_SERVER")
+                sys.exit(1)
+            cold_start(credential_provider)
+            STARTUP_PROFILE.print_summary()
+            serve_warm(warm_server)
+            return_code = 0
+        elif batch_tasks:
+            concurrency = int(os.environ.get("FLYTE_BATCH_CONCURRENCY", "1"))
+            # Before paying for startup
+            check_batch_concurrency(batch_tasks, concurrency)
+            cold_start(credential_provider, [task["args"] for task in batch_tasks])
+            results = run_batch(batch_tasks, concurrency=concurrency)
+            return_code = next((r["return_code"] for r in results.values() if r["return_code"]), 0)
+        else:
+            cold_start(credential_provider, [remaining_args])
+            
+            # Execute the Flyte command (uses direct execution to preserve SparkSession)
+            return_code = execute_flyte_command_inprocess(remaining_args)
+    finally:
+        if import_timer is not None:
+            import_timer.uninstall()
+            import_timer.print_report()
+            STARTUP_PROFILE.record("import_report", import_timer.report())
+        STARTUP_PROFILE.print_summary()
+        STARTUP_PROFILE.emit()
     
     print(f"[Flyte] Task completed with return code: {return_code}")
     
@@ -0,0 +1,215 @@
+import hashlib
+import io
+import multiprocessing
+import os
+import signal
+import stat
+import tarfile
+import time
+
+import pytest
+
+import entrypoint_serverless as entrypoint
+
+
+def _build_tar(members: list) -> bytes:
+    """Build an uncompressed tar from (name, data, mode, type, linkname) tuples."""
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w") as tar:
+        for name, data, mode, type_, linkname in members:
+            info = tarfile.TarInfo(name)
+            info.mode = mode
+            info.type = type_
+            info.linkname = linkname
+            if data is not None:
+                info.size = len(data)
+            tar.addfile(info, io.BytesIO(data) if data is not None else None)
+    return buf.getvalue()
+
+
+def _file(name: str, data: bytes, mode: int = 0o644):
+    return name, data, mode, tarfile.REGTYPE, ""
+
+
+SAMPLE_MEMBERS = [
+    ("pkg", None, 0o755, tarfile.DIRTYPE, ""),
+    _file("pkg/__init__.py", b""),
+    _file("pkg/mod.py", b"x = 1\n"),
+    _file("pkg/run.sh", b"#!/bin/sh\n", 0o755),
+    ("pkg/private", None, 0o700, tarfile.DIRTYPE, ""),
+    _file("pkg/private/key", b"k", 0o600),
+    _file("implicit/deep/file.txt", b"deep"),
+    # Larger than _MAX_QUEUED_FILE, so written by the streaming path
+    _file("data/big.bin", os.urandom(5 << 20)),
+    ("pkg/link.py", None, 0o777, tarfile.SYMTYPE, "mod.py"),
+    ("pkg/hard.py", None, 0o644, tarfile.LNKTYPE, "pkg/mod.py"),
+    # A later member of the same name replaces the earlier one
+    _file("pkg/mod.py", b"x = 2\n"),
+]
+
+
+def _snapshot(root: str) -> dict:
+    """Map each path under root to its type, permission bits and contents."""
+    entries = {}
+    for directory, dirs, files in os.walk(root):
+        for name in dirs + files:
+            path = os.path.join(directory, name)
+            st = os.lstat(path)
+            if stat.S_ISLNK(st.st_mode):
+                entry = ("link", os.readlink(path))
+            elif stat.S_ISDIR(st.st_mode):
+                entry = ("dir", stat.S_IMODE(st.st_mode))
+            else:
+                with open(path, "rb") as f:
+                    entry = ("file", stat.S_IMODE(st.st_mode), hashlib.sha256(f.read()).hexdigest())
+            entries[os.path.relpath(path, root)] = entry
+    return entries
+
+
+@pytest.fixture
+def flyte_env(tmp_path, monkeypatch):
+    """A clean FLYTE_* environment with a mirror standing in for S3."""
+    for name in list(os.environ):
+        if name.startswith("FLYTE_"):
+            monkeypatch.delenv(name)
+    mirror = tmp_path / "mirror"
+    (mirror / "bucket").mkdir(parents=True)
+    monkeypatch.setenv("FLYTE_INTERNAL_WORK_DIR", str(tmp_path / "work"))
+    monkeypatch.setenv("FLYTE_DISTRIBUTION_MIRRORS", str(mirror))
+    # Never fall back to S3 while the mirror is being read
+    monkeypatch.setenv("FLYTE_DISTRIBUTION_HEDGE_S", "600")
+    entrypoint.STARTUP_PROFILE.info.pop("distribution_reused", None)
+
+    def publish(name: str, members: list) -> str:
+        (mirror / "bucket" / name).write_bytes(_build_tar(members))
+        return f"s3://bucket/{name}"
+
+    return publish
+
+
+def _extract_once(distribution: str, dest_dir: str, start, results):
+    start.wait()
+    tree = entrypoint.extract_distribution_once(distribution, dest_dir)
+    results.put((tree, "distribution_reused" in entrypoint.STARTUP_PROFILE.info))
+
+
+def _hold_lock(key: str, acquired):
+    with entrypoint.single_flight(key) as held:
+        assert held
+        acquired.set()
+        time.sleep(600)
+
+
+@pytest.mark.parametrize("extract", ["stream", "indexed"])
+def test_extraction_matches_extractall(tmp_path, extract):
+    raw = _build_tar(SAMPLE_MEMBERS)
+    expected, actual = tmp_path / "expected", tmp_path / "actual"
+    with tarfile.open(fileobj=io.BytesIO(raw)) as tar:
+        tar.extractall(expected, filter="data")
+
+    actual.mkdir()
+    if extract == "stream":
+        stats = entrypoint.extract_tar_stream(io.BytesIO(raw), str(actual), workers=4)
+    else:
+        (tmp_path / "dist.tar").write_bytes(raw)
+        stats = entrypoint.extract_indexed_tar(str(tmp_path / "dist.tar"), str(actual), workers=4)
+
+    assert _snapshot(str(actual)) == _snapshot(str(expected))
+    assert stats["links"] == 2
+
+
+def test_extraction_rejects_escaping_members(tmp_path):
+    raw = _build_tar([_file("../escape.txt", b"x")])
+    (tmp_path / "dest").mkdir()
+    with pytest.raises(ValueError, match="outside"):
+        entrypoint.extract_tar_stream(io.BytesIO(raw), str(tmp_path / "dest"))
+    assert not (tmp_path / "escape.txt").exists()
+
+
+def test_extracts_into_dest_dir_by_default(flyte_env, tmp_path):
+    dest = tmp_path / "dest"
+    first = flyte_env("v1.tar", [_file("pkg/mod.py", b"x = 1\n"), _file("pkg/old.py", b"")])
+    second = flyte_env("v2.tar", [_file("pkg/mod.py", b"x = 2\n")])
+
+    assert entrypoint.extract_distribution_once(first, str(dest)) == str(dest)
+    assert (dest / "pkg" / "mod.py").read_bytes() == b"x = 1\n"
+    assert entrypoint.extract_distribution_once(first, str(dest)) == str(dest)
+    assert "distribution_reused" in entrypoint.STARTUP_PROFILE.info
+
+    assert entrypoint.extract_distribution_once(second, str(dest)) == str(dest)
+    assert (dest / "pkg" / "mod.py").read_bytes() == b"x = 2\n"
+    # Like extractall, files the new distribution lacks are left alone
+    assert (dest / "pkg" / "old.py").exists()
+    assert not [name for name in os.listdir(dest) if name.startswith(".flyte-staging-")]
+    assert not (dest / entrypoint.DISTRIBUTION_VERSIONS_DIR).exists()
+
+
+def test_versioned_trees_are_opt_in(flyte_env, tmp_path, monkeypatch):
+    monkeypatch.setenv("FLYTE_DISTRIBUTION_VERSIONS", "true")
+    dest = tmp_path / "dest"
+    first = flyte_env("v1.tar", [_file("pkg/mod.py", b"x = 1\n")])
+    second = flyte_env("v2.tar", [_file("pkg/mod.py", b"x = 2\n")])
+
+    tree = entrypoint.extract_distribution_once(first, str(dest))
+    assert os.path.dirname(tree) == str(dest / entrypoint.DISTRIBUTION_VERSIONS_DIR)
+    assert not (dest / "pkg").exists()
+
+    new_tree = entrypoint.extract_distribution_once(second, str(dest))
+    assert new_tree != tree
+    with open(os.path.join(tree, "pkg", "mod.py"), "rb") as f:
+        assert f.read() == b"x = 1\n"
+    with open(os.path.join(new_tree, "pkg", "mod.py"), "rb") as f:
+        assert f.read() == b"x = 2\n"
+
+
+def test_concurrent_processes_extract_once(flyte_env, tmp_path):
+    distribution = flyte_env("dist.tar", SAMPLE_MEMBERS)
+    dest = str(tmp_path / "dest")
+    context = multiprocessing.get_context("fork")
+    start, results = context.Event(), context.Queue()
+    processes = [context.Process(target=_extract_once, args=(distribution, dest, start, results))
+                 for _ in range(4)]
+    for process in processes:
+        process.start()
+    start.set()
+    outcomes = [results.get(timeout=60) for _ in processes]
+    for process in processes:
+        process.join(timeout=60)
+        assert process.exitcode == 0
+
+    assert [tree for tree, _ in outcomes] == [dest] * 4
+    assert sorted(reused for _, reused in outcomes) == [False, True, True, True]
+    assert (tmp_path / "dest" / "pkg" / "mod.py").read_bytes() == b"x = 2\n"
+
+
+def test_lock_of_killed_holder_is_released(flyte_env):
+    context = multiprocessing.get_context("fork")
+    acquired = context.Event()
+    holder = context.Process(target=_hold_lock, args=("dest:/somewhere", acquired))
+    holder.start()
+    try:
+        assert acquired.wait(timeout=30)
+        with entrypoint.single_flight("dest:/somewhere", timeout_s=0.2) as held:
+            assert not held
+    finally:
+        os.kill(holder.pid, signal.SIGKILL)
+        holder.join(timeout=30)
+
+    start = time.perf_counter()
+    with entrypoint.single_flight("dest:/somewhere", timeout_s=30) as held:
+        assert held
+    assert time.perf_counter() - start < 5
+
+
+def test_staging_of_dead_process_is_removed(flyte_env, tmp_path):
+    dead = multiprocessing.get_context("fork").Process(target=os._exit, args=(0,))
+    dead.start()
+    dead.join()
+    dest = tmp_path / "dest"
+    stale = dest / f".flyte-staging-{dead.pid}-abc"
+    (stale / "pkg").mkdir(parents=True)
+
+    distribution = flyte_env("dist.tar", [_file("pkg/mod.py", b"x = 1\n")])
+    assert entrypoint.extract_distribution_once(distribution, str(dest)) == str(dest)
+    assert not stale.exists()
+    assert (dest / "pkg" / "mod.py").read_bytes() == b"x = 1\n"
@@ -0,0 +1,92 @@
+import os
+import textwrap
+import typing
+
+import pytest
+
+pytest.importorskip("flytekit")
+
+import entrypoint_serverless as entrypoint  # noqa: E402
+
+
+TASK_MODULE = """
+from flytekit import task
+
+
+@task
+def square(x: int) -> int:
+    return x * x
+"""
+
+
+def _write_inputs(path: str, values: list):
+    from flytekit.core import utils
+    from flytekit.core.context_manager import FlyteContextManager
+    from flytekit.core.type_engine import TypeEngine
+    from flytekit.models.literals import LiteralMap
+    
+    ctx = FlyteContextManager.current_context()
+    collection = TypeEngine.to_literal(ctx, values, typing.List[int], TypeEngine.to_literal_type(typing.List[int]))
+    utils.write_proto_to_file(LiteralMap({"x": collection}).to_flyte_idl(), path)
+
+
+def _read_output(path: str) -> int:
+    from flyteidl.core import literals_pb2
+    from flytekit.core import utils
+    
+    literal_map = utils.load_proto_from_file(literals_pb2.LiteralMap, path)
+    return literal_map.literals["o0"].scalar.primitive.integer
+
+
+@pytest.mark.parametrize("resolver", [
+    "flytekit.core.array_node_map_task.ArrayNodeMapTaskResolver",
+    "flytekit.core.legacy_map_task.MapTaskResolver",
+])
+def test_subtasks_get_their_own_element_and_output_prefix(tmp_path, monkeypatch, resolver):
+    (tmp_path / "map_task_module.py").write_text(textwrap.dedent(TASK_MODULE))
+    monkeypatch.syspath_prepend(str(tmp_path))
+    for name in ("BATCH_JOB_ARRAY_INDEX_VAR_NAME", "BATCH_JOB_ARRAY_INDEX_OFFSET", "FLYTE_MAP_TASK_SIZE"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("FLYTE_MAP_CONCURRENCY", "4")
+    
+    values = [1, 2, 3, 4, 5, 6]
+    _write_inputs(str(tmp_path / "inputs.pb"), values)
+    output_prefix = tmp_path / "outputs"
+    resolver_args = ["vars", "", "resolver", "flytekit.core.python_auto_container.default_task_resolver",
+                     "task-module", "map_task_module", "task-name", "square"]
+    
+    return_code = entrypoint.execute_map_task_inprocess([
+        "--inputs", str(tmp_path / "inputs.pb"),
+        "--output-prefix", str(output_prefix),
+        "--raw-output-data-prefix", str(tmp_path / "raw"),
+        "--checkpoint-path", str(tmp_path / "checkpoint"),
+        "--resolver", resolver,
+        "--", *resolver_args,
+    ])
+    
+    assert return_code == 0
+    assert sorted(os.listdir(output_prefix)) == [str(i) for i in range(len(values))]
+    for index, value in enumerate(values):
+        assert _read_output(str(output_prefix / str(index) / "outputs.pb")) == value * value
+
+
+def test_array_index_readers_are_restored():
+    from flytekit.bin import entrypoint as flyte_entrypoint
+    from flytekit.core.array_node_map_task import ArrayNodeMapTask
+    
+    compute_index = flyte_entrypoint._compute_array_job_index
+    class_compute_index = ArrayNodeMapTask.__dict__["_compute_array_job_index"]
+    with entrypoint._thread_array_index(entrypoint.threading.local()):
+        assert flyte_entrypoint._compute_array_job_index is not compute_index
+    assert flyte_entrypoint._compute_array_job_index is compute_index
+    assert ArrayNodeMapTask.__dict__["_compute_array_job_index"] is class_compute_index
+
+
+def test_subtask_map_args():
+    args = ["--inputs", "s3://b/in.pb", "--output-prefix", "s3://b/out/", "--checkpoint-path", "s3://b/cp",
+            "--resolver", "flytekit.core.array_node_map_task.ArrayNodeMapTaskResolver", "--", "vars", ""]
+    assert entrypoint.subtask_map_args(args, 3) == [
+        "--inputs", "s3://b/in.pb", "--output-prefix", "s3://b/out/3", "--checkpoint-path", "s3://b/cp/3",
+        "--resolver", "flytekit.core.array_node_map_task.ArrayNodeMapTaskResolver", "--", "vars", ""]
+    legacy = args[:7] + ["flytekit.core.legacy_map_task.MapTaskResolver"] + args[8:]
+    assert entrypoint.subtask_map_args(legacy, 3)[3] == "s3://b/out/"